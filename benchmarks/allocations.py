@@ -0,0 +1,80 @@
+"""Benchmark the memory that's allocated while the python engine evaluates each event."""
+from __future__ import print_function
+
+import gc
+import timeit
+import tracemalloc
+
+from eql.engines.base import Event
+from eql.engines.native import PythonEngine
+from eql.parser import parse_query
+
+QUERIES = {
+    'comparisons': [
+        'process where process_name == "cmd.exe" and pid > 100',
+        'process where process_name in ("net.exe", "sc.exe") or command_line == "*whoami*"',
+        'file where file_name == "*.exe" and not file_path == "C:\\\\Windows\\\\*"',
+    ],
+    'sequences': [
+        'sequence by unique_pid [process where process_name == "cmd.exe"] [file where file_name == "*.exe"]',
+        'join by unique_pid [process where true] [network where true]',
+    ],
+}
+
+
+def get_events(count):
+    """Generate events that match some of the queries."""
+    names = ['cmd.exe', 'net.exe', 'explorer.exe', 'svchost.exe', 'sc.exe']
+    events = []
+    for i in range(count):
+        event_type = ['process', 'file', 'network'][i % 3]
+        events.append(Event.from_data({
+            'event_type': event_type, 'pid': i % 500, 'unique_pid': i % 50,
+            'process_name': names[i % len(names)], 'command_line': 'cmd /c whoami' if i % 7 == 0 else 'x',
+            'file_name': 'a.exe' if i % 2 else 'b.txt', 'file_path': 'C:\\Temp\\a.exe',
+        }))
+    return events
+
+
+def measure(queries, events, config=None):
+    """Stream events one at a time, and get the peak and retained bytes that are allocated for each."""
+    engine = PythonEngine(config)
+    engine.add_queries([parse_query(query) for query in queries])
+
+    # Warm up caches, so that only the steady state is measured
+    engine.stream_events(events[:100], finalize=False)
+
+    peak = retained = 0
+    for event in events:
+        tracemalloc.start()
+        engine.stream_event(event)
+        current, event_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak += event_peak
+        retained += current
+
+    engine = PythonEngine(config)
+    engine.add_queries([parse_query(query) for query in queries])
+    engine.stream_events(events[:100], finalize=False)
+    elapsed = min(timeit.repeat(lambda: engine.stream_events(events, finalize=False), number=1, repeat=3))
+    return float(peak) / len(events), float(retained) / len(events), elapsed * 1e6 / len(events)
+
+
+def main(count=5000):
+    """Report the allocations for each event with the default and the tuned garbage collector."""
+    events = get_events(count)
+    configs = [
+        ('default', {}),
+        ('gc tuned', {'gc_freeze': True, 'gc_thresholds': (50000, 50, 50)}),
+    ]
+
+    print("{:<14}{:<10}{:>16}{:>16}{:>12}".format('queries', 'gc', 'peak B/event', 'kept B/event', 'us/event'))
+    for name, queries in sorted(QUERIES.items()):
+        for config_name, config in configs:
+            peak, retained, elapsed = measure(queries, events, config)
+            print("{:<14}{:<10}{:>16.1f}{:>16.1f}{:>12.2f}".format(name, config_name, peak, retained, elapsed))
+            gc.collect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Benchmark the latency of the first parsed query in a new process."""
+from __future__ import print_function
+
+import subprocess
+import sys
+import timeit
+
+QUERY = 'sequence by unique_pid [process where process_name == "cmd.exe"] [file where file_name == "*.exe"]'
+
+# Compile the grammar at runtime, which is the fallback when there's no generated parser
+COMPILED = """
+import tatsu, tatsu.semantics
+import eql.parser
+from eql.etc import get_etc_file
+eql.parser.tatsu_parser = tatsu.compile(get_etc_file('eql.ebnf'), parseinfo=True,
+                                        semantics=tatsu.semantics.ModelBuilderSemantics())
+eql.parser.parse_query({query!r})
+"""
+
+# Use the parser generated by `setup.py build_parser`
+GENERATED = """
+import eql.parser
+assert type(eql.parser.get_tatsu_parser()).__name__ == 'GeneratedParser', 'Run `setup.py build_parser` first'
+eql.parser.parse_query({query!r})
+"""
+
+
+def run(code, repeat):
+    """Get the best wall time of a new python process running the code."""
+    def spawn():
+        subprocess.check_call([sys.executable, '-c', code.format(query=QUERY)])
+
+    return min(timeit.repeat(spawn, number=1, repeat=repeat))
+
+
+def main(repeat=5):
+    """Compare the first query latency with and without the generated parser."""
+    baseline = run('import eql', repeat)
+    compiled = run(COMPILED, repeat)
+    generated = run(GENERATED, repeat)
+
+    print("import eql:                {:.3f}s".format(baseline))
+    print("first query (compiled):    {:.3f}s (+{:.3f}s)".format(compiled, compiled - baseline))
+    print("first query (generated):   {:.3f}s (+{:.3f}s)".format(generated, generated - baseline))
+
+
+if __name__ == '__main__':
+    main()
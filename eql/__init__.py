@@ -1,34 +1,56 @@
 """Event Query Language library."""
-from .engines import PythonEngine
-from .errors import EqlError, ParseError, SchemaError
-from .parser import (
-    get_preprocessor,
-    parse_definitions,
-    parse_expression,
-    parse_query,
-    parse_analytic,
-    parse_analytics,
-)
-from .loader import load_analytic, load_analytics
-from .schema import use_schema
-from . import functions
-from . import ast
-
+import importlib
+import sys
 
 __version__ = '0.6.3'
-__all__ = (
-    "__version__",
-    "PythonEngine",
-    "EqlError", "ParseError", "SchemaError",
-    "get_preprocessor",
-    "parse_definitions",
-    "parse_expression",
-    "parse_query",
-    "parse_analytic",
-    "parse_analytics",
-    "load_analytic",
-    "load_analytics",
-    "use_schema",
-    "functions",
-    "ast",
-)
+
+# Map each public name to the submodule that defines it, so heavy modules (tatsu, yaml, engines)
+# are only imported when they're first used
+_lazy_imports = {
+    "PythonEngine": "engines",
+    "ParseCache": "cache",
+    "use_parse_cache": "cache",
+    "EqlError": "errors",
+    "ParseError": "errors",
+    "SchemaError": "errors",
+    "get_preprocessor": "parser",
+    "parse_definitions": "parser",
+    "parse_expression": "parser",
+    "parse_query": "parser",
+    "parse_analytic": "parser",
+    "parse_analytics": "parser",
+    "load_analytic": "loader",
+    "load_analytics": "loader",
+    "load_analytics_parallel": "loader",
+    "use_schema": "schema",
+    "functions": None,
+    "ast": None,
+}
+
+__all__ = ("__version__", ) + tuple(_lazy_imports)
+
+
+def __getattr__(name):
+    """Import public names on first access."""
+    if name not in _lazy_imports:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    module_name = _lazy_imports[name]
+    if module_name is None:
+        value = importlib.import_module("." + name, __name__)
+    else:
+        value = getattr(importlib.import_module("." + module_name, __name__), name)
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    """List the public names, including the ones that aren't imported yet."""
+    return sorted(set(globals()) | set(_lazy_imports))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ isn't supported, so everything is imported up front
+    for _name in _lazy_imports:
+        __getattr__(_name)
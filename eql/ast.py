@@ -7,13 +7,15 @@ from collections import OrderedDict
 from operator import lt, le, eq, ne, ge, gt
 from string import Template
 
-from eql.utils import to_unicode, is_string, is_number
+from eql.matchers import match_wildcard
+from eql.utils import to_unicode, is_string, is_number, register_packable
 
 
 __all__ = (
     # base classes
     "BaseNode",
     "AstWalker",
+    "InternTable",
 
     "Expression",
     "EqlNode",
@@ -91,7 +93,35 @@ class BaseNode(object):
 
     def __eq__(self, other):
         """Check if two ASTs are equivalent."""
-        return type(self) == type(other) and list(self.iter_slots()) == list(other.iter_slots())
+        if self is other:
+            return True
+        elif type(self) is not type(other):
+            return False
+
+        # Nodes interned by the same table are only equal to themselves
+        table = getattr(self, '_interned', None)
+        other_table = getattr(other, '_interned', None)
+        if table is not None and table is other_table:
+            return False
+        elif table is not None and other_table is not None and hash(self) != hash(other):
+            # Interned nodes are frozen, so their cached hashes are safe to compare
+            return False
+        return list(self.iter_slots()) == list(other.iter_slots())
+
+    def __hash__(self):
+        """Get a structural hash of the AST, which is only cached for nodes frozen by :class:`~InternTable`."""
+        try:
+            return self._hash
+        except AttributeError:
+            value = hash((type(self).__name__, ) + tuple(_hash_value(v) for _, v in self.iter_slots()))
+            if getattr(self, '_interned', None) is not None:
+                self._hash = value
+            return value
+
+    def __getstate__(self):
+        """Get the state for pickling and copying, without any cached values."""
+        state = {k: v for k, v in getattr(self, '__dict__', {}).items() if k not in ('_hash', '_interned')}
+        return state or None, dict(self.iter_slots())
 
     def __ne__(self, other):
         """Check if two ASTs are not equivalent."""
@@ -131,6 +161,92 @@ class BaseNode(object):
         return unicoded
 
 
+def _hash_value(value):
+    """Hash a value within a node, including unhashable lists and dictionaries."""
+    if isinstance(value, (list, tuple)):
+        return hash(tuple(_hash_value(v) for v in value))
+    elif isinstance(value, dict):
+        return hash(frozenset((k, _hash_value(v)) for k, v in value.items()))
+    elif isinstance(value, set):
+        return hash(frozenset(value))
+
+    try:
+        return hash(value)
+    except TypeError:
+        return hash(type(value).__name__)
+
+
+class InternTable(object):
+    """Table of canonical syntax tree nodes, so that equivalent subtrees are shared and compared by identity.
+
+    Interned nodes must not be modified in place.
+    """
+
+    def __init__(self):
+        """Create an empty table."""
+        self._nodes = {}
+
+    def __len__(self):
+        """Get the number of unique nodes."""
+        return len(self._nodes)
+
+    def clear(self):
+        """Remove all nodes from the table."""
+        self._nodes.clear()
+
+    @classmethod
+    def _get_key(cls, value):
+        """Get a key that distinguishes values by type, with canonical nodes compared by identity."""
+        if isinstance(value, BaseNode):
+            return id(value)
+        elif isinstance(value, (list, tuple)):
+            return type(value), tuple(cls._get_key(v) for v in value)
+        elif isinstance(value, dict):
+            return type(value), tuple((k, cls._get_key(v)) for k, v in value.items())
+        hash(value)
+        return type(value), value
+
+    @classmethod
+    def _is_same(cls, a, b):
+        """Check that two values are the same objects, or containers of the same objects."""
+        if isinstance(a, (list, tuple)) and type(a) is type(b):
+            return len(a) == len(b) and all(cls._is_same(x, y) for x, y in zip(a, b))
+        elif isinstance(a, dict) and type(a) is type(b):
+            return list(a.keys()) == list(b.keys()) and all(cls._is_same(a[k], b[k]) for k in a)
+        return a is b
+
+    def intern(self, node):
+        """Get the canonical version of a node and all of its descendants.
+
+        :param BaseNode node: The syntax tree, or a list or dictionary of syntax trees
+        :rtype: BaseNode
+        """
+        if isinstance(node, BaseNode):
+            if getattr(node, '_interned', None) is self:
+                return node
+
+            slots = [v for _, v in node.iter_slots()]
+            args = [self.intern(v) for v in slots]
+            try:
+                key = (type(node), tuple(self._get_key(arg) for arg in args))
+            except TypeError:
+                return node
+
+            canonical = self._nodes.get(key)
+            if canonical is None:
+                if not self._is_same(slots, args):
+                    node = type(node)(*args)
+                node._interned = self
+                self._nodes[key] = canonical = node
+            return canonical
+
+        elif isinstance(node, (list, tuple)):
+            return type(node)(self.intern(v) for v in node)
+        elif isinstance(node, dict):
+            return type(node)((k, self.intern(v)) for k, v in node.items())
+        return node
+
+
 class AstWalker(object):
     """Base class that provides functionality for walking abstract syntax trees of eql.BaseNode."""
 
@@ -154,18 +270,29 @@ class AstWalker(object):
             for key, child in node.items():
                 cls.walk(child, func)
 
-    def transform(self, node, func, optimize=True):
+    def transform(self, node, func, optimize=True, copy=True):
         """Recursively transform the syntax tree by walking bottom-up.
 
         :param BaseNode node: Any AST node
         :param function func: Callback function for walking with the signature
             ``func(original_node, transformed_node) -> bool``
         :param bool optimize: Return an optimized copy of the AST
+        :param bool copy: Rebuild every node, instead of reusing the subtrees that weren't changed
         :rtype: BaseNode
         """
         if isinstance(node, BaseNode):
             cls = type(node)
-            args = [self.transform(child, func, optimize=optimize) for _, child in node.iter_slots()]
+            slots = [child for _, child in node.iter_slots()]
+            args = [self.transform(child, func, optimize=optimize, copy=copy) for child in slots]
+
+            if not copy and all(arg is child for arg, child in zip(args, slots)):
+                # Unchanged nodes are only optimized once, and kept if the optimizer has no effect
+                output = func(node, node)  # type: BaseNode
+                if optimize:
+                    optimized = output.optimize()
+                    return node if output is node and optimized == node else optimized
+                return output
+
             transformed = cls(*args)
             if optimize:
                 transformed = transformed.optimize()
@@ -176,9 +303,16 @@ class AstWalker(object):
                 return output.optimize()
             return output
         elif isinstance(node, (list, tuple)):
-            return [self.transform(child, func, optimize=optimize) for child in node]
+            transformed = [self.transform(child, func, optimize=optimize, copy=copy) for child in node]
+            if not copy and all(arg is child for arg, child in zip(transformed, node)):
+                return node
+            return transformed
         elif isinstance(node, dict):
-            return {key: self.transform(child, func, optimize=optimize) for key, child in node.items()}
+            transformed = {key: self.transform(child, func, optimize=optimize, copy=copy)
+                           for key, child in node.items()}
+            if not copy and all(transformed[key] is child for key, child in node.items()):
+                return node
+            return transformed
         else:
             return node
 
@@ -259,6 +393,24 @@ class Literal(Expression):
         assert type(self) is not Literal, "Illegal usage of Literal AST node"
         self.value = value
 
+    @classmethod
+    def from_python(cls, value):
+        """Get the literal for a python value, or None if it can't be represented in EQL.
+
+        :param object value: A python value
+        :rtype: Literal|None
+        """
+        if value is None:
+            return Null()
+        elif isinstance(value, bool):
+            return Boolean(value)
+        elif is_number(value):
+            # NaN and infinity don't have a syntax
+            if value - value == 0:
+                return Number(value)
+        elif is_string(value):
+            return String(to_unicode(value))
+
     def __and__(self, other):
         """Shortcut ANDing of Static Value nodes together."""
         if isinstance(other, Literal):
@@ -444,10 +596,7 @@ class FunctionCall(Expression):
 
             if len(self.arguments) >= 2 and all(isinstance(arg, String) for arg in self.arguments):
                 source = self.arguments[0].value
-                regex = '|'.join('^{}$'.format(r'.*?'.join(re.escape(sequence)
-                                                           for sequence in literal.value.split('*')))
-                                 for literal in self.arguments[1:])
-                return Boolean(re.match(regex, source, re.IGNORECASE) is not None)
+                return Boolean(match_wildcard(source, *(literal.value for literal in self.arguments[1:])))
         elif self.name == 'length' and all(isinstance(arg, String) for arg in self.arguments):
             return Number(len(*(arg.value for arg in self.arguments)))
         return self
@@ -725,12 +874,9 @@ class And(BaseCompound):
 
     def __and__(self, other):
         """Flatten multiple ``and`` terms."""
-        terms = self.terms
         if isinstance(other, And):
-            terms.extend(other.terms)
-        else:
-            terms.append(other)
-        return And(terms)
+            return And(self.terms + other.terms)
+        return And(self.terms + [other])
 
 
 class Or(BaseCompound):
@@ -748,12 +894,9 @@ class Or(BaseCompound):
 
     def __or__(self, other):
         """Flatten multiple ``or`` terms."""
-        terms = self.terms
         if isinstance(other, Or):
-            terms.extend(other.terms)
-        else:
-            terms.append(other)
-        return Or(terms)
+            return Or(self.terms + other.terms)
+        return Or(self.terms + [other])
 
 
 class EventQuery(EqlNode):
@@ -1169,10 +1312,11 @@ class Macro(BaseMacro, EqlNode):
             """Callback for walking the AST that expands the variables into the passed in expression."""
             if isinstance(node, Field):
                 if node.base in lookup and not node.path:
-                    node = walker.copy(lookup[node.base])
+                    node = lookup[node.base]
             return node
 
-        expanded = walker.transform(self.expression, expand_variables, optimize=optimize)
+        # Arguments are shared between the call and the expansion, since syntax trees aren't modified in place
+        expanded = walker.transform(self.expression, expand_variables, optimize=optimize, copy=False)
         return expanded
 
     def _render(self):
@@ -1186,11 +1330,15 @@ class Macro(BaseMacro, EqlNode):
 class PreProcessor(object):
     """An EQL preprocessor stores definitions and is used for macro expansion and constants."""
 
+    max_expansions = 4096
+
     def __init__(self, definitions=None):
         """Initialize a preprocessor environment that can load definitions."""
         self.walker = AstWalker()
         self.constants = OrderedDict()  # type: dict[str, Constant]
         self.macros = OrderedDict()  # type: dict[str, BaseMacro]
+        self._fingerprint = None
+        self._expansions = {}
         self.add_definitions(definitions or [])
 
     def add_definitions(self, definitions):
@@ -1201,6 +1349,8 @@ class PreProcessor(object):
     def add_definition(self, definition):  # type: (Definition) -> None
         """Add a named definition to the preprocessor."""
         name = definition.name
+        self._fingerprint = None
+        self._expansions.clear()
         if isinstance(definition, BaseMacro):
             # The macro may call into other macros so it should be expanded
             expanded_macro = self.expand(definition)
@@ -1213,6 +1363,8 @@ class PreProcessor(object):
     def expand(self, root, optimize=True):
         """Expand the function calls that match registered macros.
 
+        Subtrees without any macros or constants are shared with the input instead of copied.
+
         :param EqlNode root: The input node, macro, expression, etc.
         :param bool optimize: Toggle AST optimizations while expanding
         :rtype: EqlNode
@@ -1224,13 +1376,23 @@ class PreProcessor(object):
             if isinstance(node, FunctionCall):
                 if node.name in self.macros:
                     macro = self.macros[node.name]
-                    expanded = macro.expand(node.arguments, self.walker, optimize=optimize)
+                    if isinstance(macro, Macro):
+                        # Macros are pure, so calls with equivalent arguments share the same expansion
+                        key = (node.name, tuple(node.arguments), optimize)
+                        expanded = self._expansions.get(key)
+                        if expanded is None:
+                            expanded = macro.expand(node.arguments, self.walker, optimize=optimize)
+                            if len(self._expansions) >= self.max_expansions:
+                                self._expansions.clear()
+                            self._expansions[key] = expanded
+                    else:
+                        expanded = macro.expand(node.arguments, self.walker, optimize=optimize)
                     node = expanded
             elif isinstance(node, Field) and not node.path:
                 if node.base in self.constants:
                     node = self.constants[node.base].value
             return node
-        return self.walker.transform(root, expand_callback, optimize=optimize)
+        return self.walker.transform(root, expand_callback, optimize=optimize, copy=False)
 
     def copy(self):
         """Create a shallow copy of a preprocessor."""
@@ -1238,3 +1400,21 @@ class PreProcessor(object):
         preprocessor.constants.update(self.constants)
         preprocessor.macros.update(self.macros)
         return preprocessor
+
+
+def _get_node_class(name, cache={}):
+    """Find a syntax tree class by name, including any subclasses that were added after import."""
+    if name not in cache:
+        pending = [BaseNode]
+        while pending:
+            cls = pending.pop()
+            cache.setdefault(cls.__name__, cls)
+            pending.extend(cls.__subclasses__())
+    return cache[name]
+
+
+# Syntax trees are packed as the class name and the values of the slots, which line up with the arguments of __init__
+register_packable('node', BaseNode, lambda node: [type(node).__name__, [v for _, v in node.iter_slots()]],
+                  lambda args: _get_node_class(args[0])(*args[1]))
+register_packable('timedelta', datetime.timedelta, lambda delta: [delta.days, delta.seconds, delta.microseconds],
+                  lambda args: datetime.timedelta(*args))
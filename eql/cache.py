@@ -0,0 +1,194 @@
+"""Content-addressed cache for parsed EQL syntax trees."""
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import uuid
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from eql.ast import CustomMacro, PreProcessor
+from eql.functions import get_registry_version
+from eql.schema import get_schema_fingerprint
+
+
+__all__ = (
+    "ParseCache",
+    "get_parse_cache",
+    "set_parse_cache",
+    "use_parse_cache",
+)
+
+PICKLE_PROTOCOL = 2
+_parse_cache = None
+
+
+def get_preprocessor_fingerprint(preprocessor):
+    """Get a fingerprint of the definitions in a preprocessor, or None if they can't be fingerprinted.
+
+    :param PreProcessor preprocessor: The preprocessor with constants and macros
+    :rtype: str|None
+    """
+    if preprocessor is None:
+        preprocessor = PreProcessor()
+
+    sizes = len(preprocessor.constants), len(preprocessor.macros)
+    memoized = getattr(preprocessor, '_fingerprint', None)
+    if memoized is not None and memoized[0] == sizes:
+        return memoized[1]
+
+    if any(isinstance(macro, CustomMacro) for macro in preprocessor.macros.values()):
+        # Python callbacks can't be fingerprinted, so anything parsed with them is never cached
+        fingerprint = None
+    else:
+        digest = hashlib.sha256()
+        for definition in list(preprocessor.constants.values()) + list(preprocessor.macros.values()):
+            digest.update(definition.render().encode('utf-8'))
+            digest.update(b'\0')
+        fingerprint = digest.hexdigest()
+
+    preprocessor._fingerprint = (sizes, fingerprint)
+    return fingerprint
+
+
+class ParseCache(object):
+    """Cache of parsed syntax trees, with an in-process LRU and an optional on-disk store."""
+
+    def __init__(self, max_size=1024, directory=None):
+        """Create a parse cache.
+
+        :param int max_size: The maximum number of syntax trees to keep in memory
+        :param str directory: Optional directory to persist syntax trees across processes
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # type: dict[str, bytes]
+
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_key(self, text, start, preprocessor=None, **flags):
+        """Get the content address for a parse, or None if the parse can't be cached.
+
+        :param str text: EQL source text
+        :param str start: Entry point for the EQL grammar
+        :param PreProcessor preprocessor: Preprocessor used to expand definitions and constants
+        :param flags: Additional parser options
+        :rtype: str|None
+        """
+        preprocessor_fingerprint = get_preprocessor_fingerprint(preprocessor)
+        if preprocessor_fingerprint is None:
+            return
+
+        from eql import __version__
+        key = [__version__, sys.version_info[0], start, sorted(flags.items()), get_schema_fingerprint(),
+               preprocessor_fingerprint, get_registry_version(), text]
+        return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        """Get a fresh copy of a cached syntax tree, or None if it isn't cached.
+
+        :param str key: The content address from :meth:`~get_key`
+        :rtype: EqlNode|list[Definition]|None
+        """
+        data = self._entries.pop(key, None)
+
+        if data is None and self.directory is not None:
+            try:
+                with open(self._get_path(key), 'rb') as f:
+                    data = f.read()
+            except (IOError, OSError):
+                pass
+
+        if data is None:
+            self.misses += 1
+            return
+
+        try:
+            node = pickle.loads(data)
+        except Exception:
+            self.misses += 1
+            return
+
+        self.hits += 1
+        self._remember(key, data)
+        return node
+
+    def set(self, key, node):
+        """Add a syntax tree to the cache.
+
+        :param str key: The content address from :meth:`~get_key`
+        :param EqlNode|list[Definition] node: The parsed syntax tree
+        """
+        data = pickle.dumps(node, PICKLE_PROTOCOL)
+        self._remember(key, data)
+
+        if self.directory is not None:
+            path = self._get_path(key)
+            temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+            try:
+                with open(temp_path, 'wb') as f:
+                    f.write(data)
+                if os.path.exists(path):
+                    os.remove(temp_path)
+                else:
+                    os.rename(temp_path, path)
+            except (IOError, OSError):
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def _remember(self, key, data):
+        """Store the pickled syntax tree in memory as the most recently used."""
+        self._entries.pop(key, None)
+        self._entries[key] = data
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Clear the in-memory entries and any files in the on-disk store."""
+        self._entries.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pickle'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+def get_parse_cache():
+    """Get the parse cache that is currently in use.
+
+    :rtype: ParseCache|None
+    """
+    return _parse_cache
+
+
+def set_parse_cache(cache):
+    """Set the parse cache used by the parser, or None to disable caching.
+
+    :param ParseCache cache: The cache to use
+    """
+    global _parse_cache
+    _parse_cache = cache
+
+
+@contextlib.contextmanager
+def use_parse_cache(cache=None):
+    """Context manager for using python's `with` syntax for caching parsed queries.
+
+    :param ParseCache cache: The cache to use, or a new in-memory cache
+    """
+    current_cache = _parse_cache
+    set_parse_cache(cache if cache is not None else ParseCache())
+    try:
+        yield _parse_cache
+    finally:
+        set_parse_cache(current_cache)
@@ -2,12 +2,20 @@
 from collections import namedtuple
 
 from eql.ast import *  # noqa
-from eql.parser import parse_definitions
 from eql.schema import EVENT_TYPE_GENERIC, use_schema
-from eql.utils import is_string
+from eql.utils import is_string, register_packable
 
 
 DEFAULT_TIME_UNIT = 10000000  # Windows FileTime 0.1 microseconds
+MAX_EVENT_TYPES = 1024
+
+_event_types = {}  # type: dict[str, str]
+
+
+def _parse_definitions(text):
+    """Parse definitions, and only import the parser when text needs to be parsed."""
+    from eql.parser import parse_definitions
+    return parse_definitions(text)
 
 
 class NodeMethods(dict):
@@ -104,13 +112,13 @@ class BaseEngine(ConfigurableWalker):
         with use_schema(self.schema):
             definitions = self.get_config('definitions', [])
             if is_string(definitions):
-                definitions = parse_definitions(definitions)
+                definitions = _parse_definitions(definitions)
 
             self.preprocessor.add_definitions(definitions)
 
             for path in self.get_config('definitions_files', []):
                 with open(path, 'r') as f:
-                    definitions = parse_definitions(f.read())
+                    definitions = _parse_definitions(f.read())
                 self.preprocessor.add_definitions(definitions)
 
     def add_analytic(self, analytic):
@@ -202,6 +210,9 @@ class Event(namedtuple('Event', ['type', 'time', 'data'])):
         else:
             event_type = EVENT_TYPE_GENERIC
 
+        # Share one copy of each event type, so comparisons and lookups by type can match on identity
+        if len(_event_types) < MAX_EVENT_TYPES:
+            event_type = _event_types.setdefault(event_type, event_type)
         return cls(event_type, timestamp, data)
 
     def copy(self):
@@ -210,6 +221,9 @@ class Event(namedtuple('Event', ['type', 'time', 'data'])):
         return Event(self.type, self.time, data)
 
 
+register_packable('event', Event, list, lambda args: Event(*args))
+
+
 def register_extension(ext):
     """Decorator used for registering TextEngines with specific file extensions building."""
     def decorator(cls):
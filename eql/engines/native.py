@@ -1,16 +1,75 @@
 """EQL engine in native python."""
 from __future__ import print_function
 
+import contextlib
+import gc
+import hashlib
 import json
+import os
 import re
+import struct
+import warnings
 from collections import defaultdict, deque, OrderedDict, namedtuple
+from itertools import islice
 
+from eql import functions
 from eql.ast import *  # noqa
 from eql.engines.base import BaseEngine, BaseTranspiler, NodeMethods, Event, AnalyticOutput
-from eql.schema import EVENT_TYPE_ANY, EVENT_TYPE_GENERIC
-from eql.utils import is_string, is_number, get_type_converter, to_unicode
+from eql.engines.records import MISSING, CompactData, FlatData, ProjectedData, RecordLayout, StringInterner
+from eql.engines.records import compact_event, expand_event
+from eql.engines.timestamps import TimestampParser
+from eql.functions import FunctionInfo
+from eql.matchers import PatternSet, compile_wildcard, combine_regexes, has_nested_quantifiers
+from eql.optimizer import AdaptiveTerms, order_terms
+from eql.schema import EVENT_TYPE_ANY, EVENT_TYPE_GENERIC, FIELD_TYPE_NUMBER, get_field_type, get_schema
+from eql.utils import is_string, is_number, get_type_converter, to_unicode, pack, unpack, numbers, strings
 
 PIPE_EOF = object()
+ENUM_CACHE_SIZE = 1024
+
+
+def _ignore_event(event):
+    """Dispatch function for event types without any callbacks."""
+
+
+def fuse_callbacks(callbacks):
+    """Generate a single function that calls each callback in order, to avoid looping over them for every event.
+
+    :param list[callable] callbacks: The callbacks, which take a single argument
+    :rtype: callable
+    """
+    if not callbacks:
+        return _ignore_event
+    elif len(callbacks) == 1:
+        return callbacks[0]
+
+    names = ['callback{}'.format(index) for index in range(len(callbacks))]
+    lines = ['def fuse({}):'.format(', '.join(names)), '    def fused(event):']
+    lines.extend('        {}(event)'.format(name) for name in names)
+    lines.append('    return fused')
+
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['fuse'](*callbacks)
+
+
+def fuse_tuple(callbacks):
+    """Generate a single function that returns a tuple with the result of each callback, without a generator.
+
+    :param list[callable] callbacks: The callbacks, which take a single argument
+    :rtype: callable
+    """
+    names = ['callback{}'.format(index) for index in range(len(callbacks))]
+    lines = [
+        'def fuse({}):'.format(', '.join(names)),
+        '    def fused(value):',
+        '        return ({}, )'.format(', '.join('{}(value)'.format(name) for name in names)),
+        '    return fused',
+    ]
+
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['fuse'](*callbacks)
 
 
 class Scope(namedtuple('Scope', ['events', 'variables'])):
@@ -25,9 +84,11 @@ class Scope(namedtuple('Scope', ['events', 'variables'])):
         """Call a function by temporarily adding variables to the scope."""
         size = len(self.variables)
         self.variables.extend(args)
-        status = fn(self)
-        self.variables[size:] = []
-        return status
+        try:
+            return fn(self)
+        finally:
+            # Scopes are reused for every event, so variables are removed even when there's an error
+            self.variables[size:] = []
 
 
 class PythonEngine(BaseEngine, BaseTranspiler):
@@ -38,6 +99,20 @@ class PythonEngine(BaseEngine, BaseTranspiler):
     reducers = NodeMethods()
     special_functions = NodeMethods()
 
+    regex_functions = ('match', 'matchLite')
+    flipped_comparators = {
+        Comparison.LT: Comparison.GT, Comparison.LE: Comparison.GE, Comparison.EQ: Comparison.EQ,
+        Comparison.NE: Comparison.NE, Comparison.GE: Comparison.LE, Comparison.GT: Comparison.LT,
+    }
+
+    # Built-in string functions that can be checked with the shared patterns for a field
+    shared_string_functions = {
+        'startsWith': ('_str_starts_with', PatternSet.PREFIX),
+        'endsWith': ('_str_ends_width', PatternSet.SUFFIX),
+        'stringContains': ('_str_contains', PatternSet.SUBSTRING),
+    }
+    state_mergers = NodeMethods()
+
     def __init__(self, config=None):
         """Create a python engine for EQL."""
         super(PythonEngine, self).__init__(config)
@@ -45,11 +120,26 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         self._any_event_hooks = []
         # Any new list of hooks will automatically inherit from the global list
         self._event_hooks = defaultdict(lambda: list(self._any_event_hooks))
+        self._dispatchers = {}  # type: dict[str, callable]
+        self._gc_frozen = False
         self._functions = {}
         self._query_multiple_events = True
         self._in_pipe = False
         self._query_pipes = []
         self._reducer_hooks = defaultdict(list)
+        self._owner_id = None
+        self._query_count = 0
+        self._states = OrderedDict()  # type: dict[str, (str, dict)]
+        self._state_counts = defaultdict(int)
+        self._owner_states = OrderedDict()  # type: dict[object, list[str]]
+        self._owner_fingerprints = {}
+        self._owner_event_types = defaultdict(set)
+        # Callbacks, pipes and batch results that were appended to shared lists, so they can be detached again
+        self._owner_entries = defaultdict(list)  # type: dict[object, list[(list, object)]]
+        self._dirty_types = set()
+        self._reduced = False
+        self._snapshot_path = None
+        self._snapshot_increments = 0
         self.host_key = self.get_config('host_key', 'hostname')
         self.pid_key = self.get_config('pid_key', 'pid')
         self.ppid_key = self.get_config('ppid_key', 'ppid')
@@ -63,28 +153,17 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             self.create_values = ["create"]
             self.terminate_values = ["terminate"]
 
-        self.add_custom_function('length', self._length)
-        self.add_custom_function('arrayContains', self._array_contains)
+        self._function_info = {}  # type: dict[str, FunctionInfo]
+        self._memoized = {}
+        self._batch_calls = []
+        self._batch_positions = {}
+        self._current_batch = []
+        self.memoize_cost = self.get_config('memoize_cost', 50)
         self.add_custom_function('safe', self._convert_safe_callback)
 
-        # String functions
-        self.add_custom_function('match', self._match)
-        self.add_custom_function('matchLite', self._match)
-        self.add_custom_function('startsWith', self._str_starts_with)
-        self.add_custom_function('endsWith', self._str_ends_width)
-        self.add_custom_function('stringContains', self._str_contains)
-        self.add_custom_function('indexOf', self._str_index_of)
-        self.add_custom_function('substring', self._str_substring)
-        self.add_custom_function('string', to_unicode)
-        self.add_custom_function('concat', self._concat)
-        self.add_custom_function('number', self._number)
-
-        # Math functions
-        self.add_custom_function('add', self._add)
-        self.add_custom_function('subtract', self._subtract)
-        self.add_custom_function('multiply', self._multiply)
-        self.add_custom_function('divide', self._divide)
-        self.add_custom_function('modulo', self._modulo)
+        # Built-in functions, and any functions that were registered globally
+        for name, info in functions.get_functions().items():
+            self.add_custom_function(name, info)
 
         self._scoped = list()
 
@@ -93,6 +172,33 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
         self._output_hooks.extend(self.get_config('hooks', []))
         self.flatten = self.get_config('flatten', False)
+        self.reorder_predicates = self.get_config('reorder_predicates', False)
+        self.field_statistics = self.get_config('field_statistics')
+        self.adaptive_predicates = self.get_config('adaptive_predicates', False)
+        self.shared_patterns = self.get_config('shared_patterns', False)
+        self.unsafe_regex = self.get_config('unsafe_regex', 'allow')
+        self.unsafe_patterns = []  # type: list[(str, str)]
+        self._pattern_sets = {}  # type: dict[str, PatternSet]
+        self._adaptive_terms = OrderedDict()  # type: dict[str, list[AdaptiveTerms]]
+        self._event_type = None
+        self.compact_events = self.get_config('compact_events', False)
+        self._layouts = {}  # type: dict[str, RecordLayout]
+        self._retained_fields = None  # type: tuple[str]
+        self._event_store = self.get_config('event_store')
+        if self._event_store is not None and not callable(self._event_store):
+            self._event_store = self._event_store.get
+        self.event_id_key = self.get_config('event_id_key', 'serial_event_id')
+        self.flatten_paths = self.get_config('flatten_paths', False)
+        self.flatten_max_items = self.get_config('flatten_max_items', 64)
+        self._timestamps = None  # type: TimestampParser
+        self.time_fields = self.get_config('time_fields', ['timestamp'])
+        if self.get_config('time_format') is not None:
+            self._timestamps = TimestampParser(self.get_config('time_format'), self._time_unit,
+                                               self.get_config('time_cache_size', 4096))
+        self._interner = None  # type: StringInterner
+        if self.get_config('intern_fields'):
+            table_size = self.get_config('intern_table_size', 65536)
+            self._interner = StringInterner(self.get_config('intern_fields'), table_size)
 
         if self.get_config('print', False):
             self._default_emitter = self.print_events
@@ -101,103 +207,26 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         else:
             self._default_emitter = self.get_result_emitter()
 
-    @staticmethod
-    def _length(value):
-        if value is None:
-            return 0
-        else:
-            return len(value)
-
-    @staticmethod
-    def _match(pattern, value):
-        return value is not None and re.match(pattern, value, re.IGNORECASE) is not None
-
-    @staticmethod
-    def _str_starts_with(a, b):  # type: (str, str) -> bool
-        return is_string(a) and is_string(b) and a.lower().startswith(b.lower())
-
-    @staticmethod
-    def _str_ends_width(a, b):  # type: (str, str) -> bool
-        return is_string(a) and is_string(b) and a.lower().endswith(b.lower())
-
-    @staticmethod
-    def _str_contains(a, b):  # type: (str, str) -> bool
-        return is_string(a) and is_string(b) and b.lower() in a.lower()
-
-    @staticmethod
-    def _str_index_of(a, b, start=0):  # type: (str, str, int) -> int
-        if is_string(a) and is_string(b):
-            a = a.lower()
-            b = b.lower()
-            if b in a[start:]:
-                return a.index(b, start)
-
-    @staticmethod
-    def _add(a, b):  # type: (int|float, int|float) -> (int|float)
-        return (a or 0) + (b or 0)
-
-    @staticmethod
-    def _subtract(a, b):  # type: (int|float, int|float) -> (int|float)
-        return (a or 0) - (b or 0)
-
-    @staticmethod
-    def _divide(a, b):  # type: (int|float, int|float) -> (int|float)
-        if not b:
-            return float('NaN')
-        return (a or 0) / b
-
-    @staticmethod
-    def _multiply(a, b):  # type: (int|float, int|float) -> (int|float)
-        return (a or 0) * (b or 0)
-
-    @staticmethod
-    def _modulo(a, b):  # type: (int|float, int|float) -> (int|float)
-        if not b:
-            return float('NaN')
-        return (a or 0) % b
-
-    @staticmethod
-    def _str_substring(a, start=None, end=None):  # type: (str, int, int) -> str
-        if is_string(a):
-            return a[start:end]
-
-    @staticmethod
-    def _concat(*args):
-        return u"".join(to_unicode(arg) for arg in args)
-
-    @staticmethod
-    def _number(arg, base=10):  # type: (str, int) -> int|float
-        if is_number(arg):
-            return arg
-        elif is_string(arg):
-            if '.' in arg:
-                return float(arg)
-            if arg.startswith('0x'):
-                arg = arg[2:]
-                base = 16
-            try:
-                return int(arg, base)
-            except ValueError:
-                return None
-
-    @staticmethod
-    def _array_contains(array, value):
-        if array is None:
-            return False
-
-        if is_string(value):
-            value = value.lower()
-
-        for item in array:
-            if item == value:
-                return True
-            elif is_string(item) and item.lower() == value:
-                return True
-        return False
+    # Built-in functions are implemented in eql.functions
+    _length = staticmethod(functions.length)
+    _match = staticmethod(functions.match)
+    _str_starts_with = staticmethod(functions.starts_with)
+    _str_ends_width = staticmethod(functions.ends_with)
+    _str_contains = staticmethod(functions.string_contains)
+    _str_index_of = staticmethod(functions.index_of)
+    _add = staticmethod(functions.add)
+    _subtract = staticmethod(functions.subtract)
+    _divide = staticmethod(functions.divide)
+    _multiply = staticmethod(functions.multiply)
+    _modulo = staticmethod(functions.modulo)
+    _str_substring = staticmethod(functions.substring)
+    _concat = staticmethod(functions.concat)
+    _number = staticmethod(functions.number)
+    _array_contains = staticmethod(functions.array_contains)
 
     def print_event(self, event):  # type: (Event) -> None
         """Print an event to stdout."""
-        print(json.dumps(event.data, sort_keys=True))
+        print(json.dumps(self._restore_event(event).data, sort_keys=True))
 
     def print_events(self, events):
         """Print an array of events to stdout."""
@@ -205,7 +234,29 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             for event in events:
                 self.print_event(event)
 
+    def _restore_event(self, event):  # type: (Event) -> Event
+        """Convert a retained event back to a dictionary, and restore the rest of its fields from the event store."""
+        event = expand_event(event)
+        if self._event_store is not None and isinstance(event.data, ProjectedData):
+            # Only fields that were dropped by the projection are restored, not fields that pipes removed
+            projected = event.data
+            event_id = projected.get(self.event_id_key)
+            stored = self._event_store(event_id) if event_id is not None else None
+            if stored is not None:
+                data = {key: value for key, value in getattr(stored, 'data', stored).items()
+                        if key not in projected.fields}
+                data.update(projected)
+                event = event._replace(data=data)
+        return event
+
     def _to_hooks(self, item):
+        if self.compact_events or self._event_store is not None:
+            # Hooks get full dictionaries that they can modify
+            if isinstance(item, AnalyticOutput):
+                item = AnalyticOutput(item.analytic_id, [self._restore_event(event) for event in item.events])
+            else:
+                item = self._restore_event(item)
+
         for hook in self._output_hooks:
             hook(item)
 
@@ -258,8 +309,13 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
             return wrapped
         else:
+            # Reuse a single scope instead of allocating one for every event
+            events = [None]
+            scope = Scope(events, [])
+
             def wrapped(event):
-                return cb(Scope([event], []))
+                events[0] = event
+                return cb(scope)
 
             return wrapped
 
@@ -278,11 +334,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             return self.convert(args[0], scoped=scoped, piped=piped)
 
         callbacks = [self.convert(arg, scoped=scoped, piped=piped) for arg in args]
-
-        def to_tuple_callback(value):
-            return tuple(callback(value) for callback in callbacks)
-
-        return to_tuple_callback
+        return fuse_tuple(callbacks)
 
     def _convert_tuple(self, args):
         """Convert a tuple of AST nodes to a callback function that returns a tuple of values.
@@ -296,10 +348,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             tup = tuple()
             return lambda e: tup
 
-        def to_tuple_callback(value):
-            return tuple(callback(value) for callback in callbacks)
-
-        return to_tuple_callback
+        return fuse_tuple(callbacks)
 
     def convert_pipe(self, node, next_pipe):
         """Convert an EQL pipe into a callback function.
@@ -343,7 +392,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             for key in node.path:
                 if value is None:
                     break
-                elif isinstance(value, dict):
+                elif isinstance(value, (dict, CompactData)):
                     value = value.get(key)
                 elif key < len(value):
                     value = value[key]
@@ -363,13 +412,29 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
             return dynamic_func
 
-        if self._in_pipe:
+        index = 0
+        if self._in_pipe and self._query_multiple_events:
             # Check if this is querying for any events
-            if self._query_multiple_events:
-                index, node = node.query_multiple_events()
-            else:
-                index = 0
+            index, node = node.query_multiple_events()
+
+        if self.flatten_paths and node.path:
+            key = (node.base, ) + tuple(node.path)
+
+            def flat_callback(scope):  # type: (Scope) -> object
+                data = scope.events[index].data
+                try:
+                    value = data.paths.get(key, MISSING)
+                except AttributeError:
+                    # Events that were created by pipes or restored from a snapshot aren't indexed
+                    value = MISSING
+
+                if value is MISSING:
+                    return walk_path(data.get(node.base))
+                return value
+
+            return flat_callback
 
+        elif self._in_pipe:
             def pipe_callback(scope):  # type: (Scope) -> object
                 event = scope.events[index]
                 return walk_path(event.data.get(node.base))
@@ -413,20 +478,33 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
         return callback
 
+    def _get_shared_pattern_callback(self, source, patterns):
+        """Check a value against patterns that are indexed for every analytic, so it's only scanned once.
+
+        :param Expression source: The value to check
+        :param list[(str, str)] patterns: The kind and text of each pattern, or a wildcard with a kind of None
+        :rtype: (Scope) -> bool
+        """
+        pattern_set = self._pattern_sets.setdefault(source.render(), PatternSet())
+        identifiers = frozenset(pattern_set.add(kind, text) if kind else pattern_set.add_wildcard(text)
+                                for kind, text in patterns)
+        get_source = self.convert(source)
+
+        def check_patterns(scope):
+            return not identifiers.isdisjoint(pattern_set.match(get_source(scope)))
+
+        return check_patterns
+
     @special_functions.add('wildcard')
     def _convert_wildcard(self, arguments):
-        patterns = []
-        for literal in arguments[1:]:
-            regex = re.escape(literal.value.lower())
-            regex = "^" + regex.replace('\\*', '.*?') + "$"
-            patterns.append(regex)
+        if self.shared_patterns:
+            return self._get_shared_pattern_callback(arguments[0], [(None, literal.value) for literal in arguments[1:]])
 
-        compound = re.compile('|'.join(patterns), re.I)
+        matcher = compile_wildcard([literal.value for literal in arguments[1:]])
         get_source = self.convert(arguments[0])
 
         def check_match(scope):
-            text = get_source(scope)
-            return text is not None and compound.match(text) is not None
+            return matcher(get_source(scope))
 
         return check_match
 
@@ -457,6 +535,35 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             return unbound(self, node.arguments)
 
         func = self._functions[node.name]
+        if self.shared_patterns and len(node.arguments) == 2 and isinstance(node.arguments[1], String):
+            method, kind = self.shared_string_functions.get(name, (None, None))
+            if method is not None and func == getattr(self, method):
+                return self._get_shared_pattern_callback(node.arguments[0], [(kind, node.arguments[1].value)])
+
+        if name in self.regex_functions and func == self._match and len(node.arguments) == 2:
+            if isinstance(node.arguments[0], String):
+                callback = self._get_regex_callback(node.arguments[0].value, node.arguments[1])
+                if callback is not None:
+                    return callback
+
+        info = self._function_info.get(name)
+        literals = all(isinstance(arg, Literal) for arg in node.arguments)
+        if info is not None and info.pure and not info.batch and literals:
+            # Calls with literal arguments are evaluated once, with the function that this engine resolved
+            try:
+                value = func(*(arg.value for arg in node.arguments))
+            except Exception:
+                pass
+            else:
+                return lambda scope: value
+
+        if info is not None and info.batch:
+            return self._get_batch_callback(info, node.arguments)
+        elif info is not None and info.deterministic and (info.cost is None or info.cost >= self.memoize_cost):
+            if name not in self._memoized:
+                self._memoized[name] = functions.memoize(func, self.get_config('function_cache_size', 1024))
+            func = self._memoized[name]
+
         get_arguments = self._convert_tuple(node.arguments)
 
         def wrapped_function(scope):  # type: (Scope) -> bool
@@ -464,9 +571,216 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
         return wrapped_function
 
+    def _get_batch_callback(self, info, arguments):
+        """Call a batch function once for the remaining events of the same type in the batch being streamed.
+
+        :param FunctionInfo info: A function that takes a list of argument tuples and returns a list of results
+        :param list[Expression] arguments: The arguments to the function
+        :rtype: (Scope) -> object
+        """
+        func = info.func
+        get_arguments = self._convert_tuple(arguments)
+        results = {}
+        self._add_entry(self._batch_calls, results)
+
+        # Arguments can only be collected ahead of time if they only depend on the event being streamed
+        variables = []
+
+        def find_variables(child):
+            if isinstance(child, Field) and child.base in self._scoped:
+                variables.append(child)
+            return True
+
+        AstWalker.walk(arguments, find_variables)
+        if self._in_pipe or variables:
+            return lambda scope: func([get_arguments(scope)])[0]
+
+        batch_positions = self._batch_positions
+
+        def batch_callback(scope):  # type: (Scope) -> object
+            event = scope.event
+            key = id(event)
+            if key in results:
+                return results[key]
+
+            position = batch_positions.get(key)
+            if position is None:
+                return func([get_arguments(scope)])[0]
+
+            batch = [e for e in self._current_batch[position:] if e.type == event.type]
+            values = func([get_arguments(Scope([e], [])) for e in batch])
+            results.update(zip([id(e) for e in batch], values))
+            return results[key]
+
+        return batch_callback
+
+    def _check_regex(self, pattern):
+        """Check a regular expression for nested quantifiers, which may backtrack catastrophically."""
+        if self.unsafe_regex != 'allow' and has_nested_quantifiers(pattern):
+            message = u"Regular expression {} may backtrack catastrophically".format(pattern)
+            if self.unsafe_regex == 'error':
+                raise ValueError(message)
+            self.unsafe_patterns.append((self._owner_id, pattern))
+            warnings.warn(message, RuntimeWarning)
+
+    def _get_regex_callback(self, pattern, source):
+        """Compile a literal regular expression once, instead of looking it up for every event.
+
+        :param str pattern: The regular expression
+        :param Expression source: The value to match
+        :rtype: (Scope) -> bool
+        """
+        try:
+            regex = re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            # Invalid patterns still fail when they're evaluated
+            return
+
+        self._check_regex(pattern)
+        get_source = self.convert(source)
+
+        def match_regex(scope):  # type: (Scope) -> bool
+            value = get_source(scope)
+            return is_string(value) and regex.match(value) is not None
+
+        return match_regex
+
+    def _merge_regex_terms(self, terms):
+        """Combine ``match`` terms in an ``or`` that check the same value into a single regular expression.
+
+        :param list[Expression] terms: The terms of the ``or``
+        :rtype: list[Expression]
+        """
+        def is_literal_regex(term):
+            return (isinstance(term, FunctionCall) and term.name in self.regex_functions and
+                    len(term.arguments) == 2 and isinstance(term.arguments[0], String) and
+                    self._functions.get(term.name) == self._match)
+
+        patterns = OrderedDict()  # type: dict[Expression, list[str]]
+        for term in terms:
+            if is_literal_regex(term):
+                patterns.setdefault(term.arguments[1], []).append(term.arguments[0].value)
+
+        combined = {}
+        for source, source_patterns in patterns.items():
+            merged = combine_regexes(source_patterns) if len(source_patterns) > 1 else None
+            if merged is not None:
+                combined[source] = FunctionCall('match', [String(merged), source])
+
+        if not combined:
+            return terms
+
+        merged_terms = []
+        for term in terms:
+            if is_literal_regex(term) and term.arguments[1] in combined:
+                # The combined expression replaces the first term that checks the same value
+                merged = combined[term.arguments[1]]
+                if merged is not None:
+                    merged_terms.append(merged)
+                    combined[term.arguments[1]] = None
+            else:
+                merged_terms.append(term)
+        return merged_terms
+
+    def _get_layout(self, event_type):  # type: (str) -> RecordLayout
+        """Get the shared layout for compact records of an event type, starting with the fields in the schema."""
+        layout = self._layouts.get(event_type)
+        if layout is None:
+            schema = self.schema if self.schema is not None else get_schema()
+            fields = schema.get('field_types', {}).get(event_type, {})
+            keys = sorted(field for field in fields if '.' not in field and '[' not in field)
+            layout = self._layouts[event_type] = RecordLayout(keys)
+        return layout
+
+    def _get_retained_fields(self, query):  # type: (PipedQuery) -> tuple[str]
+        """Get the fields that retained events need for the pipes of a query and the outputs, or None for every field.
+
+        Fields are only dropped when the ``output_fields`` or ``event_store`` options are set.
+        """
+        output_fields = self.get_config('output_fields')
+        if output_fields is None and self._event_store is None:
+            return
+
+        fields = set(output_fields or [])
+        if self._event_store is not None:
+            fields.add(self.event_id_key)
+        query_multiple = not isinstance(query.first, EventQuery)
+
+        def add_fields(node):
+            if isinstance(node, Field):
+                fields.add(node.query_multiple_events()[1].base if query_multiple else node.base)
+            elif isinstance(node, (CountPipe, UniqueCountPipe)):
+                fields.add(self.host_key)
+            elif isinstance(node, NamedSubquery):
+                fields.add(self.pid_key)
+            return True
+
+        AstWalker.walk(query.pipes, add_fields)
+        return tuple(sorted(fields))
+
+    def _get_retainer(self):  # type: () -> callable
+        """Get a function that prepares a list of events to be held in the state of a query."""
+        fields = self._retained_fields
+        get_layout = self._get_layout if self.compact_events else None
+
+        if fields is None and get_layout is None:
+            def retain(events):  # type: (list[Event]) -> list[Event]
+                return events
+
+            return retain
+
+        def retain_event(event):  # type: (Event) -> Event
+            if fields is not None and not isinstance(event.data, CompactData):
+                data = event.data
+                projected = ProjectedData({field: data[field] for field in fields if field in data}, fields)
+                event = event._replace(data=projected)
+            if get_layout is not None:
+                event = compact_event(event, get_layout(event.type))
+            return event
+
+        def retain(events):  # type: (list[Event]) -> list[Event]
+            return [retain_event(event) for event in events]
+
+        return retain
+
+    def _get_field_type(self, node):  # type: (Expression) -> str|frozenset[str]
+        """Get the type of a field from the schema, within the event query that's being converted."""
+        if isinstance(node, Field) and self._event_type is not None:
+            return get_field_type(self._event_type, node, self.schema)
+
+    @staticmethod
+    def _get_enum_matcher(values):  # type: (set[str]) -> callable
+        """Check values of an enum field, which are remembered since there are only a few distinct values."""
+        cache = {}
+
+        def matches(value):
+            try:
+                return cache[value]
+            except KeyError:
+                pass
+            except TypeError:
+                return False
+
+            result = is_string(value) and value.lower() in values
+            if len(cache) < ENUM_CACHE_SIZE:
+                cache[value] = result
+            return result
+
+        return matches
+
     @converters.add(InSet)
     def _check_in_set(self, node):  # type: (InSet) -> callable
-        if all(isinstance(item, Literal) for item in node.container):
+        if isinstance(self._get_field_type(node.expression), frozenset) and \
+                all(isinstance(item, String) for item in node.container):
+            get_value = self.convert(node.expression)
+            matches = self._get_enum_matcher(set(item.value.lower() for item in node.container))
+
+            def callback(scope):  # type: (Scope) -> bool
+                return matches(get_value(scope))
+
+            return callback
+
+        elif all(isinstance(item, Literal) for item in node.container):
             values = set()
             for item in node.container:
                 value = item.value
@@ -488,11 +802,71 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         else:
             return self.convert(node.synonym)
 
-    @converters.add(Comparison)
-    def _compare(self, node):  # type: (Comparison) -> callable
-        get_left = self.convert(node.left)
-        get_right = self.convert(node.right)
+    def _get_typed_comparison(self, node):  # type: (Comparison) -> callable
+        """Get a comparison that's specialized for a literal value, or for fields with a declared type."""
+        left, comparator, right = node.left, node.comparator, node.right
+        if isinstance(left, Literal):
+            left, comparator, right = right, self.flipped_comparators[comparator], left
+
+        compare = Comparison.func_lookup[comparator]
+        equality = comparator in (Comparison.EQ, Comparison.NE)
+        expected = comparator != Comparison.NE
+        field_type = self._get_field_type(left)
+
+        if isinstance(right, String) and equality:
+            get_value = self.convert(left)
+            if isinstance(field_type, frozenset):
+                matches = self._get_enum_matcher({right.value.lower()})
+            else:
+                lowered = right.value.lower()
+
+                def matches(value):
+                    return isinstance(value, strings) and value.lower() == lowered
+
+            def callback(scope):  # type: (Scope) -> bool
+                return matches(get_value(scope)) == expected
+
+        elif isinstance(right, String):
+            get_value, literal = self.convert(left), right.value
+
+            def callback(scope):  # type: (Scope) -> bool
+                value = get_value(scope)
+                return isinstance(value, strings) and compare(value, literal)
+
+        elif isinstance(right, Number) and equality:
+            get_value, literal = self.convert(left), right.value
 
+            def callback(scope):  # type: (Scope) -> bool
+                value = get_value(scope)
+                return (isinstance(value, numbers) and value == literal) == expected
+
+        elif isinstance(right, Number):
+            get_value, literal = self.convert(left), right.value
+
+            def callback(scope):  # type: (Scope) -> bool
+                value = get_value(scope)
+                return isinstance(value, numbers) and compare(value, literal)
+
+        elif field_type == FIELD_TYPE_NUMBER and self._get_field_type(right) == FIELD_TYPE_NUMBER:
+            get_left, get_right = self.convert(left), self.convert(right)
+            # Events that don't follow the schema, such as missing fields or strings, compare as usual
+            compare_any = self._get_generic_comparison(comparator)
+
+            def callback(scope):  # type: (Scope) -> bool
+                x = get_left(scope)
+                y = get_right(scope)
+                if isinstance(x, numbers) and isinstance(y, numbers):
+                    return compare(x, y)
+                return compare_any(x, y)
+
+        else:
+            return
+
+        return callback
+
+    @staticmethod
+    def _get_generic_comparison(comparator):  # type: (str) -> callable
+        """Get a comparison of two values of any type, where strings are compared case-insensitively."""
         def types_match(x, y):
             return (
                     type(x) == type(y) or
@@ -509,25 +883,37 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                 return x == y
 
         # Create different comparison functions so that this if statement doesn't need to be evaluated every time
-        if node.comparator == Comparison.EQ:
+        if comparator == Comparison.EQ:
             compare = equals
-        elif node.comparator == Comparison.NE:
+        elif comparator == Comparison.NE:
             def compare(x, y):
                 return not equals(x, y)
-        elif node.comparator == Comparison.LT:
+        elif comparator == Comparison.LT:
             def compare(x, y):
                 return types_match(x, y) and x < y
-        elif node.comparator == Comparison.LE:
+        elif comparator == Comparison.LE:
             def compare(x, y):
                 return types_match(x, y) and x <= y
-        elif node.comparator == Comparison.GT:
+        elif comparator == Comparison.GT:
             def compare(x, y):
                 return types_match(x, y) and x > y
-        elif node.comparator == Comparison.GE:
+        elif comparator == Comparison.GE:
             def compare(x, y):
                 return types_match(x, y) and x >= y
         else:
-            raise NotImplementedError("Unknown comparator {}".format(node.comparator))
+            raise NotImplementedError("Unknown comparator {}".format(comparator))
+
+        return compare
+
+    @converters.add(Comparison)
+    def _compare(self, node):  # type: (Comparison) -> callable
+        typed_callback = self._get_typed_comparison(node)
+        if typed_callback is not None:
+            return typed_callback
+
+        get_left = self.convert(node.left)
+        get_right = self.convert(node.right)
+        compare = self._get_generic_comparison(node.comparator)
 
         def callback(scope):  # type: (Scope) -> bool
             left = get_left(scope)
@@ -536,21 +922,81 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
         return callback
 
+    def _get_term_callbacks(self, node):  # type: (CompoundTerm) -> (list[callable], AdaptiveTerms)
+        terms = order_terms(node, self.field_statistics) if self.reorder_predicates else node.terms
+        if isinstance(node, Or):
+            terms = self._merge_regex_terms(terms)
+        get_terms = [self.convert(term) for term in terms]
+
+        if self.adaptive_predicates and len(terms) > 1:
+            adaptive = AdaptiveTerms(node, terms, get_terms, sample_rate=self.get_config('adaptive_sample_rate', 32),
+                                     interval=self.get_config('adaptive_interval', 64))
+            self._adaptive_terms.setdefault(self._owner_id, []).append(adaptive)
+            return adaptive.ordered, adaptive
+        return get_terms, None
+
     @converters.add(And)
     def _convert_and(self, node):  # type: (CompoundTerm) -> callable
-        get_terms = [self.convert(term) for term in node.terms]
+        get_terms, adaptive = self._get_term_callbacks(node)
+
+        if adaptive is not None:
+            def adaptive_and_terms(scope):  # type: (Scope) -> bool
+                adaptive.countdown -= 1
+                if adaptive.countdown:
+                    for get_term in get_terms:
+                        if not get_term(scope):
+                            return False
+                    return True
+                return adaptive.measure(scope)
 
+            return adaptive_and_terms
+
+        elif len(get_terms) == 2:
+            get_first, get_second = get_terms
+
+            def and_two_terms(scope):  # type: (Scope) -> bool
+                return bool(get_first(scope) and get_second(scope))
+
+            return and_two_terms
+
+        # Loop instead of calling all() with a generator, which is allocated for every event
         def and_terms(scope):  # type: (Scope) -> bool
-            return all(get_term(scope) for get_term in get_terms)
+            for get_term in get_terms:
+                if not get_term(scope):
+                    return False
+            return True
 
         return and_terms
 
     @converters.add(Or)
     def _convert_or(self, node):  # type: (CompoundTerm) -> callable
-        get_terms = [self.convert(term) for term in node.terms]
+        get_terms, adaptive = self._get_term_callbacks(node)
+
+        if adaptive is not None:
+            def adaptive_or_terms(scope):  # type: (Scope) -> bool
+                adaptive.countdown -= 1
+                if adaptive.countdown:
+                    for get_term in get_terms:
+                        if get_term(scope):
+                            return True
+                    return False
+                return adaptive.measure(scope)
+
+            return adaptive_or_terms
+
+        elif len(get_terms) == 2:
+            get_first, get_second = get_terms
+
+            def or_two_terms(scope):  # type: (Scope) -> bool
+                return bool(get_first(scope) or get_second(scope))
+
+            return or_two_terms
 
         def or_terms(scope):  # type: (Scope) -> bool
-            return any(get_term(scope) for get_term in get_terms)
+            for get_term in get_terms:
+                if get_term(scope):
+                    return True
+            return False
 
         return or_terms
 
@@ -559,11 +1005,13 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         host_key = self.host_key
         if len(node.arguments) == 0:
             # Counting only the total
-            summary = {'key': 'totals', 'count': 0}
-            hosts = set()
+            total = {'count': 0, 'hosts': set()}
+            self._add_state('count_total', total=total)
 
             def count_total_callback(events):
                 if events is PIPE_EOF:
+                    summary = {'key': 'totals', 'count': total['count']}
+                    hosts = total['hosts']
                     if len(hosts):
                         summary['total_hosts'] = len(hosts)
                         summary['hosts'] = list(sorted(hosts))
@@ -571,15 +1019,16 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                     next_pipe([Event(EVENT_TYPE_GENERIC, 0, summary)])
                     next_pipe(PIPE_EOF)
                 else:
-                    summary['count'] += 1
+                    total['count'] += 1
                     if host_key in events[0].data:
-                        hosts.add(events[0].data[host_key])
+                        total['hosts'].add(events[0].data[host_key])
 
             return count_total_callback
 
         else:
             get_key = self._convert_key(node.arguments, scoped=True, piped=True)
             count_table = defaultdict(lambda: {'count': 0, 'hosts': set()})
+            self._add_state('count', table=count_table)
 
             def count_tuple_callback(events):  # type: (list[Event]) -> None
                 if events is PIPE_EOF:
@@ -626,6 +1075,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
     def _convert_head_pipe(self, node, next_pipe):  # type: (HeadPipe, callable) -> callable
         totals = [0]  # has to be mutable because of python scoping
         max_count = node.count
+        self._add_state('head', totals=totals)
 
         def head_callback(events):
             if totals[0] < max_count:
@@ -643,6 +1093,8 @@ class PythonEngine(BaseEngine, BaseTranspiler):
     @reducers.add(TailPipe)
     def _convert_tail_pipe(self, node, next_pipe):  # type: (TailPipe, callable) -> callable
         output_buffer = deque(maxlen=node.count)
+        retain = self._get_retainer()
+        self._add_state('tail', buffer=output_buffer)
 
         def tail_callback(events):
             if events is PIPE_EOF:
@@ -650,7 +1102,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                     next_pipe(output)
                 next_pipe(PIPE_EOF)
             else:
-                output_buffer.append(events)
+                output_buffer.append(retain(events))
 
         return tail_callback
 
@@ -659,6 +1111,8 @@ class PythonEngine(BaseEngine, BaseTranspiler):
     def _convert_sort_pipe(self, node, next_pipe):  # type: (SortPipe, callable) -> callable
         output_buffer = []
         sort_key = self._convert_key(node.arguments, scoped=True, piped=True)
+        retain = self._get_retainer()
+        self._add_state('sort', buffer=output_buffer)
 
         def sort_callback(events):
             if events is PIPE_EOF:
@@ -672,7 +1126,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                     next_pipe(output)
                 next_pipe(PIPE_EOF)
             else:
-                output_buffer.append(events)
+                output_buffer.append(retain(events))
 
         return sort_callback
 
@@ -681,6 +1135,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
     def _convert_unique_pipe(self, node, next_pipe):  # type: (UniquePipe, callable) -> callable
         seen = set()
         get_unique_key = self._convert_key(node.arguments, scoped=True, piped=True)
+        self._add_state('unique', seen=seen)
 
         def unique_callback(events):
             if events is PIPE_EOF:
@@ -700,6 +1155,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         host_key = self.host_key
         get_unique_key = self._convert_key(node.arguments, scoped=True, piped=True)
         results = OrderedDict()
+        self._add_state('unique_count', results=results)
 
         def count_unique_callback(events):  # type: (list[Event]) -> None
             if events is PIPE_EOF:
@@ -748,6 +1204,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         if len(node.arguments) == 0:
             # Counting only the total
             result = {'key': 'totals', 'count': 0, 'hosts': set()}
+            self._add_state('count_total', total=result)
 
             def count_total_aggregates(events):  # type: (list[Event]) -> None
                 if events is PIPE_EOF:
@@ -765,12 +1222,13 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                     if host_key in piece:
                         result['hosts'].add(piece[host_key])
                     elif 'hosts' in piece:
-                        results['hosts'].update(piece['hosts'])
+                        result['hosts'].update(piece['hosts'])
 
             return count_total_aggregates
 
         else:
             results = defaultdict(lambda: {'count': 0, 'hosts': set()})
+            self._add_state('count', table=results)
 
             def count_tuple_callback(events):  # type: (list[Event]) -> None
                 if events is PIPE_EOF:
@@ -800,6 +1258,50 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
             return count_tuple_callback
 
+    @staticmethod
+    @state_mergers.add('count')
+    def _merge_count_tables(state, other):  # type: (dict, dict) -> None
+        table = state['table']
+        for key, details in other['table'].items():
+            entry = table.setdefault(key, {'count': 0, 'hosts': set()})
+            entry['count'] += details['count']
+            entry['hosts'].update(details['hosts'])
+
+    @staticmethod
+    @state_mergers.add('count_total')
+    def _merge_count_totals(state, other):  # type: (dict, dict) -> None
+        total = state['total']
+        total['count'] += other['total']['count']
+        total['hosts'].update(other['total']['hosts'])
+
+    @staticmethod
+    @state_mergers.add('unique')
+    def _merge_unique_keys(state, other):  # type: (dict, dict) -> None
+        state['seen'].update(other['seen'])
+
+    @staticmethod
+    @state_mergers.add('unique_count')
+    def _merge_unique_counts(state, other):  # type: (dict, dict) -> None
+        results = state['results']
+        for key, events in other['results'].items():
+            if key not in results:
+                results[key] = events
+            else:
+                match = results[key][0].data
+                match['count'] += events[0].data['count']
+                match['hosts'].update(events[0].data['hosts'])
+
+    @staticmethod
+    @state_mergers.add('head')
+    def _merge_head_totals(state, other):  # type: (dict, dict) -> None
+        state['totals'][0] += other['totals'][0]
+
+    @staticmethod
+    @state_mergers.add('tail')
+    @state_mergers.add('sort')
+    def _merge_buffers(state, other):  # type: (dict, dict) -> None
+        state['buffer'].extend(other['buffer'])
+
     @converters.add(NamedSubquery)
     def _get_named_of(self, node):  # type: (NamedSubquery) -> callable
         if node.query_type == NamedSubquery.DESCENDANT:
@@ -818,6 +1320,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         process_subtype = self.process_subtype
         creates = self.create_values
         terminates = self.terminate_values
+        self._add_state('descendant', sources=sources, descendants=descendants, dead_processes=dead_processes)
 
         @self.event_callback("process")
         def update_descendants(event):  # type: (Event) -> None
@@ -864,6 +1367,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         process_subtype = self.process_subtype
         creates = self.create_values
         terminates = self.terminate_values
+        self._add_state('child', parents=parents, children=children, dead_processes=dead_processes)
 
         @self.event_callback("process")
         def update_children(event):  # type: (Event) -> None
@@ -909,6 +1413,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         process_subtype = self.process_subtype
         creates = self.create_values
         terminates = self.terminate_values
+        self._add_state('event', processes=processes, dead_processes=dead_processes)
 
         @self.event_callback("process")
         def purge_on_terminate(event):  # type: (Event) -> None
@@ -934,16 +1439,25 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         def match_processes(event):  # type: (Event) -> None
             pid = event.data.get('pid', 0)
             if pid != 0 and process_match(event):
-                processes.add(event.data.get(self.pid_id))
+                processes.add(event.data.get(self.pid_key))
 
         def check_for_match(scope):  # type: (Scope) -> None
             return scope.event.data.get(self.pid_key) in processes
 
         return check_for_match
 
+    def _convert_event_condition(self, node):  # type: (EventQuery) -> callable
+        """Convert the condition of an event query, for callbacks that are only registered for its event type."""
+        # Field types from the schema depend on the event type
+        previous_type, self._event_type = self._event_type, node.event_type
+        try:
+            return self.convert(node.query, scoped=True)
+        finally:
+            self._event_type = previous_type
+
     @converters.add(EventQuery)
     def _convert_event_query(self, node):  # type: (EventQuery) -> callable
-        check_match = self.convert(node.query, scoped=True)
+        check_match = self._convert_event_condition(node)
         expected_type = node.event_type
 
         def match_event_callback(event):  # type: (Event) -> bool
@@ -958,9 +1472,11 @@ class PythonEngine(BaseEngine, BaseTranspiler):
     def _convert_join(self, node, next_pipe):  # type: (Join, callable) -> callable
         size = len(node.queries)
         lookup = defaultdict(lambda: [None] * size)  # type: dict[object, list[Event]]
+        retain = self._get_retainer()
+        self._add_state('join', lookup=lookup)
 
         def convert_join_term(subquery, position):  # type: (SubqueryBy, int) -> callable
-            check_event = self.convert(subquery.query)
+            check_event = self._convert_event_condition(subquery.query)
             get_join_value = self._convert_key(subquery.join_values, scoped=True)
 
             @self.event_callback(subquery.query.event_type)
@@ -968,13 +1484,13 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                 if check_event(event):
                     join_value = get_join_value(event)
                     if lookup[join_value][position] is None:
-                        lookup[join_value][position] = event
+                        lookup[join_value][position] = retain([event])[0]
                         if all(event is not None for event in lookup[join_value]):
                             next_pipe(lookup[join_value])
                             lookup.pop(join_value)
 
         if node.close:
-            check_close_event = self.convert(node.close.query)
+            check_close_event = self._convert_event_condition(node.close.query)
             close_join_value = self._convert_key(node.close.join_values, scoped=True)
 
             @self.event_callback(node.close.query.event_type)
@@ -988,18 +1504,18 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
     def _convert_sequence_term(self, subquery, position, size, lookups, next_pipe=None):
         # type: (SubqueryBy, int, int, list[dict[object, list[Event]]], callable) -> callable
-        check_event = self.convert(subquery.query)
+        check_event = self._convert_event_condition(subquery.query)
         get_join_value = self._convert_key(subquery.join_values, scoped=True)
         last_position = size - 1
         fork = bool(subquery.params.kv.get('fork', Boolean(False)).value)
+        retain = self._get_retainer()
 
         if position == 0:
             @self.event_callback(subquery.query.event_type)
             def start_sequence_callback(event):  # type: (Event) -> None
                 if check_event(event):
                     join_value = get_join_value(event)
-                    sequence = [event]
-                    lookups[1][join_value] = sequence
+                    lookups[1][join_value] = retain([event])
 
         elif position < last_position:
             next_position = position + 1
@@ -1013,7 +1529,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                             sequence = list(lookups[position].get(join_value))
                         else:
                             sequence = lookups[position].pop(join_value)
-                        sequence.append(event)
+                        sequence.extend(retain([event]))
                         lookups[next_position][join_value] = sequence
 
         else:
@@ -1038,6 +1554,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         # Two lookups can help avoid unnecessary calls
         size = len(node.queries)
         lookups = [{} for _ in range(size)]  # type: list[dict[object, list[Event]]]
+        self._add_state('sequence', lookups=lookups)
 
         if 'maxspan' in node.params.kv:
             max_span = self.convert(node.params.kv['maxspan'])
@@ -1052,7 +1569,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
                             sub_lookup.pop(join_key)
 
         if node.close:
-            check_close_event = self.convert(node.close.query)
+            check_close_event = self._convert_event_condition(node.close.query)
             get_close_join_value = self._convert_key(node.close.join_values, scoped=True)
 
             @self.event_callback(node.close.query.event_type)
@@ -1073,11 +1590,16 @@ class PythonEngine(BaseEngine, BaseTranspiler):
         prev_query_value = self._query_multiple_events
         self._query_multiple_events = query_multiple
         output_pipe = output_pipe or self._default_emitter
+        retained_fields = self._retained_fields
         self._in_pipe = True
 
-        for pipe in reversed(pipes):
+        for index, pipe in reversed(list(enumerate(pipes))):
+            # Aggregating pipes output new fields, so the events after them are never projected
+            aggregated = any(isinstance(previous, (CountPipe, UniqueCountPipe)) for previous in pipes[:index])
+            self._retained_fields = None if aggregated else retained_fields
             output_pipe = self.convert_pipe(pipe, output_pipe)
 
+        self._retained_fields = retained_fields
         self._in_pipe = False
         self._query_multiple_events = prev_query_value
         return output_pipe
@@ -1098,10 +1620,12 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             # Sort these events by time
             next_pipe = output_pipe
             results = []
+            retain = self._get_retainer()
+            self._add_state('sort', buffer=results)
 
             def sort_results(events):  # type: (list[Event]) -> None
                 if events is not PIPE_EOF:
-                    results.append(events)
+                    results.append(retain(events))
                 else:
                     results.sort(key=lambda result: (max(event.time for event in result),
                                                      max(event.data.get('serial_event_id') for event in result)))
@@ -1117,6 +1641,13 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
     @converters.add(PipedQuery)
     def _convert_piped_query(self, node, output_pipe=None):  # type: (PipedQuery, callable) -> callable
+        previous_fields, self._retained_fields = self._retained_fields, self._get_retained_fields(node)
+        try:
+            self._convert_query_pipes(node, output_pipe)
+        finally:
+            self._retained_fields = previous_fields
+
+    def _convert_query_pipes(self, node, output_pipe=None):  # type: (PipedQuery, callable) -> callable
         base_query = node.first
 
         query_multiple = not isinstance(base_query, EventQuery)
@@ -1125,7 +1656,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
         if isinstance(base_query, EventQuery):
             event_query = base_query
-            check_match = self._convert_event_query(event_query)
+            check_match = self._convert_event_condition(event_query)
 
             @self.event_callback(event_query.event_type)
             def callback(event):  # type: (Event) -> None
@@ -1143,21 +1674,176 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
     def _convert_analytic(self, analytic):  # type: (EqlAnalytic) -> callable
         analytic_id = analytic.id or analytic.name
-        self._convert_piped_query(analytic.query, self.get_result_emitter(analytic_id))
+        with self._owned_by(analytic_id, analytic.query):
+            self._convert_piped_query(analytic.query, self.get_result_emitter(analytic_id))
+
+    @contextlib.contextmanager
+    def _owned_by(self, owner_id, query):
+        """Attribute any state or callbacks that are created within the context to an analytic or query."""
+        previous = self._owner_id
+        self._owner_id = owner_id
+        self._owner_states.setdefault(owner_id, [])
+        self._owner_fingerprints[owner_id] = hashlib.md5(query.render().encode('utf-8')).hexdigest()
+        try:
+            yield
+        finally:
+            self._owner_id = previous
+
+    def _add_entry(self, entries, item):
+        """Append to a list that's shared by every analytic, and attribute the item to the current owner."""
+        entries.append(item)
+        self._owner_entries[self._owner_id].append((entries, item))
+
+    @staticmethod
+    def _remove_entry(entries, item):
+        """Remove an item from a list by identity, since callbacks and state containers may compare equal."""
+        for index, existing in enumerate(entries):
+            if existing is item:
+                del entries[index]
+                return
+
+    def _remove_owner(self, owner_id):
+        """Detach the callbacks, pipes and state of an analytic or query, leaving every other owner untouched."""
+        for entries, item in self._owner_entries.pop(owner_id, []):
+            if entries is self._any_event_hooks:
+                # Callbacks for any event were also copied into the list for every event type
+                self._remove_entry(entries, item)
+                for event_hooks in self._event_hooks.values():
+                    self._remove_entry(event_hooks, item)
+            else:
+                self._remove_entry(entries, item)
+
+        for key in self._owner_states.pop(owner_id, []):
+            self._states.pop(key, None)
+
+        self._state_counts.pop(owner_id, None)
+        self._owner_fingerprints.pop(owner_id, None)
+        self._owner_event_types.pop(owner_id, None)
+        self._adaptive_terms.pop(owner_id, None)
+        self._dispatchers.clear()
+
+    def _add_state(self, kind, **containers):
+        """Register the mutable containers of a stateful callback, so they can be serialized and merged.
+
+        :param str kind: The type of state, used to look up the merge function
+        :param containers: The mutable containers (dict, list, set or deque) that hold the state
+        """
+        index = self._state_counts[self._owner_id]
+        self._state_counts[self._owner_id] += 1
+        key = "{}/{}".format(self._owner_id, index)
+        self._states[key] = (kind, containers)
+        self._owner_states.setdefault(self._owner_id, []).append(key)
+
+    def _get_state(self, key, kind):
+        """Get the containers for registered state and check that the kind matches."""
+        if key not in self._states:
+            raise KeyError("Unknown state {}".format(key))
+
+        local_kind, containers = self._states[key]
+        if local_kind != kind:
+            raise ValueError("Unable to combine {} state with {} state for {}".format(kind, local_kind, key))
+        return containers
+
+    @staticmethod
+    def _load_containers(containers, values):
+        """Replace the contents of state containers in place, so that existing callbacks see the changes."""
+        for name, container in containers.items():
+            value = values[name]
+            if isinstance(container, (dict, set)):
+                container.clear()
+                container.update(value)
+            elif isinstance(container, deque):
+                container.clear()
+                container.extend(value)
+            else:
+                container[:] = value
+
+    def get_predicate_stats(self):
+        """Get the runtime counters and current order of every ``and`` and ``or``, by analytic or query.
+
+        Counters are only collected when the ``adaptive_predicates`` option is set.
 
-    def add_custom_function(self, name, func):  # type: (str, function) -> None
-        """Load a python function into the EQL engine."""
-        self._functions[name] = func
+        :rtype: dict[str, list[dict]]
+        """
+        return OrderedDict((owner_id, [adaptive.get_stats() for adaptive in adaptive_terms])
+                           for owner_id, adaptive_terms in self._adaptive_terms.items())
+
+    def get_intern_stats(self):
+        """Get the size of the table of interned strings and the number of strings that were deduplicated.
+
+        Strings are only interned for the fields in the ``intern_fields`` option.
+
+        :rtype: dict|None
+        """
+        if self._interner is not None:
+            return self._interner.get_stats()
+
+    def add_custom_function(self, name, func, **metadata):  # type: (str, function) -> None
+        """Load a python function into the EQL engine.
+
+        :param str name: The name of the function within EQL
+        :param callable|FunctionInfo func: The python function
+        :param metadata: Optional arguments to :class:`~eql.functions.FunctionInfo`, such as ``deterministic=True``
+        """
+        info = func if isinstance(func, FunctionInfo) else FunctionInfo(name, func, **metadata)
+        self._functions[name] = info.func
+        self._function_info[name] = info
+        self._memoized.pop(name, None)
 
     def add_analytic(self, analytic):  # type: (EqlAnalytic) -> None
         """Convert an analytic and load into the engine."""
         expanded_analytic = self.preprocessor.expand(analytic)
         self._convert_analytic(expanded_analytic)
 
+    def remove_analytic(self, analytic_id):  # type: (str) -> None
+        """Detach an analytic from the engine, along with its reducers and post-processors, while events are streaming.
+
+        The state of every other analytic is kept, so sequences and named subqueries that are in progress continue.
+
+        :param str analytic_id: The id (or name) of the analytic, or the name of a query, such as ``query-0``
+        """
+        if analytic_id not in self._owner_states:
+            raise KeyError("Unknown analytic {}".format(analytic_id))
+
+        self._remove_owner(analytic_id)
+        self._remove_owner('reducer/{}'.format(analytic_id))
+        self._remove_owner('post/{}'.format(analytic_id))
+        self._reducer_hooks.pop(analytic_id, None)
+
+    def replace_analytic(self, analytic):  # type: (EqlAnalytic) -> None
+        """Replace the analytic with the same id, or add it if it's new, while events are streaming.
+
+        When the query is unchanged, the state of its sequences, joins and pipes carries over to the new analytic.
+        A reducer that was registered with :meth:`~add_reducer` is registered again for the new query,
+        and post-processors from :meth:`~add_post_processor` are kept as they are.
+
+        :param EqlAnalytic analytic: The new version of the analytic
+        """
+        expanded_analytic = self.preprocessor.expand(analytic)
+        analytic_id = expanded_analytic.id or expanded_analytic.name
+        reducer_id = 'reducer/{}'.format(analytic_id)
+        fingerprint = self._owner_fingerprints.get(analytic_id)
+        states = [self._states[key] for key in self._owner_states.get(analytic_id, [])]
+        had_reducer = reducer_id in self._owner_states
+
+        self._remove_owner(analytic_id)
+        self._remove_owner(reducer_id)
+
+        self._convert_analytic(expanded_analytic)
+        if had_reducer:
+            self.add_reducer(expanded_analytic)
+
+        if fingerprint == self._owner_fingerprints[analytic_id]:
+            for (kind, containers), key in zip(states, self._owner_states[analytic_id]):
+                if self._states[key][0] == kind:
+                    self._load_containers(self._states[key][1], containers)
+
     def add_query(self, query):  # type: (PipedQuery | EqlAnalytic) -> None
         """Convert an analytic and load into the engine."""
         query = self.preprocessor.expand(query)
-        self._convert_piped_query(query)
+        with self._owned_by('query-{}'.format(self._query_count), query):
+            self._query_count += 1
+            self._convert_piped_query(query)
 
     def add_queries(self, queries):
         """Add multiple queries to the engine."""
@@ -1167,8 +1853,9 @@ class PythonEngine(BaseEngine, BaseTranspiler):
     def add_post_processor(self, query, analytic_id=None, output_pipe=None, query_multiple=False):
         # type: (PipedQuery, str, callable, bool) -> None
         """Register a query post-processor to perform additional filtering of results."""
-        chain = self._get_pipe_chain(query.pipes, output_pipe, query_multiple=query_multiple)
-        self._reducer_hooks[analytic_id].append(chain)
+        with self._owned_by('post/{}'.format(analytic_id), query):
+            chain = self._get_pipe_chain(query.pipes, output_pipe, query_multiple=query_multiple)
+            self._add_entry(self._reducer_hooks[analytic_id], chain)
 
     def add_reducer(self, query, analytic_id=None, output_pipe=None):
         """Reduce the output from multiple queries.
@@ -1183,15 +1870,183 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             query = query.query
 
         query_multiple = not isinstance(query.first, EventQuery)
-        reduce_pipe_chain = self._get_pipe_reducers(query.pipes, output_pipe, query_multiple=query_multiple)
+        with self._owned_by('reducer/{}'.format(analytic_id), query):
+            reduce_pipe_chain = self._get_pipe_reducers(query.pipes, output_pipe, query_multiple=query_multiple)
+
+            # At this point output_pipe is the entry point to the reducer
+            self._add_entry(self._reducer_hooks[analytic_id], reduce_pipe_chain)
 
-        # At this point output_pipe is the entry point to the reducer
-        self._reducer_hooks[analytic_id].append(reduce_pipe_chain)
+    def dump_pipe_states(self):
+        """Serialize the partial state of all stateful pipes and reducers to compact binary.
+
+        The output can be shipped to another engine with the same queries or analytics,
+        and combined with :meth:`~merge_pipe_states` or restored with :meth:`~load_pipe_states`.
+
+        :rtype: bytes
+        """
+        states = OrderedDict((key, [kind, containers]) for key, (kind, containers) in self._states.items()
+                             if kind in self.state_mergers)
+        return pack(states)
+
+    def load_pipe_states(self, data):
+        """Replace the partial state of the stateful pipes and reducers with serialized state.
+
+        :param bytes data: State from :meth:`~dump_pipe_states`
+        """
+        for key, (kind, values) in unpack(data).items():
+            self._load_containers(self._get_state(key, kind), values)
+        self._snapshot_path = None
+
+    def merge_pipe_states(self, data):
+        """Combine serialized partial state from another engine into the stateful pipes and reducers.
+
+        :param bytes data: State from :meth:`~dump_pipe_states`
+        """
+        for key, (kind, values) in unpack(data).items():
+            self.state_mergers[kind](self._get_state(key, kind), values)
+        self._snapshot_path = None
+
+    @classmethod
+    def combine_pipe_states(cls, *states):
+        """Merge the serialized pipe states from multiple engines, without loading them into an engine.
+
+        :param bytes states: Multiple outputs of :meth:`~dump_pipe_states`
+        :rtype: bytes
+        """
+        combined = unpack(states[0])
+        for data in states[1:]:
+            for key, (kind, values) in unpack(data).items():
+                if key in combined:
+                    if combined[key][0] != kind:
+                        raise ValueError("Unable to combine {} state with {} state for {}".format(
+                            kind, combined[key][0], key))
+                    cls.state_mergers[kind](combined[key][1], values)
+                else:
+                    combined[key] = [kind, values]
+        return pack(combined)
+
+    def _get_dirty_owners(self):
+        """Get the analytics and queries with state that may have changed since the last snapshot."""
+        dirty = []
+        for owner in self._owner_states:
+            event_types = self._owner_event_types[owner]
+            if (self._dirty_types and EVENT_TYPE_ANY in event_types) or not event_types.isdisjoint(self._dirty_types):
+                dirty.append(owner)
+            elif self._reduced and not event_types:
+                dirty.append(owner)
+        return dirty
+
+    def snapshot(self, path, full=False):
+        """Persist the state of all sequences, joins, named subqueries and pipes to a file.
+
+        The first snapshot to a file writes the state for every analytic and query.
+        Later snapshots append the state of only the analytics that received events since the previous snapshot,
+        and the file is rewritten once ``snapshot_max_increments`` (default 50) snapshots were appended.
+
+        :param str path: The snapshot file
+        :param bool full: Rewrite the state for every analytic, instead of appending changes
+        """
+        max_increments = self.get_config('snapshot_max_increments', 50)
+        full = full or path != self._snapshot_path or self._snapshot_increments >= max_increments
+        owners = list(self._owner_states) if full else self._get_dirty_owners()
+
+        frame = OrderedDict()
+        for owner in owners:
+            states = OrderedDict((key, list(self._states[key])) for key in self._owner_states[owner])
+            frame[to_unicode(owner)] = [self._owner_fingerprints.get(owner), states]
+
+        packed = pack(frame)
+        record = struct.pack('>I', len(packed)) + packed
+
+        if full:
+            temp_path = path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(record)
+            getattr(os, 'replace', os.rename)(temp_path, path)
+            self._snapshot_increments = 0
+        else:
+            with open(path, 'ab') as f:
+                f.write(record)
+            self._snapshot_increments += 1
+
+        self._snapshot_path = path
+        self._dirty_types.clear()
+        self._reduced = False
+
+    def restore(self, path):
+        """Restore the state of sequences, joins, named subqueries and pipes from :meth:`~snapshot`.
+
+        State is matched to the loaded analytics and queries, and state for any analytic
+        that was removed or whose query changed is skipped.
+
+        :param str path: The snapshot file
+        """
+        frames = []
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    break
+                size, = struct.unpack('>I', header)
+                packed = f.read(size)
+                if len(packed) < size:
+                    # the last snapshot was interrupted while writing
+                    break
+                frames.append(packed)
+
+        saved = OrderedDict()
+        for packed in frames:
+            saved.update(unpack(packed))
+
+        owners = {to_unicode(owner): owner for owner in self._owner_states}
+        for name, (fingerprint, states) in saved.items():
+            if name not in owners or self._owner_fingerprints.get(owners[name]) != fingerprint:
+                continue
+
+            for key, (kind, values) in states.items():
+                if key in self._states and self._states[key][0] == kind:
+                    self._load_containers(self._states[key][1], values)
+
+        self._snapshot_path = path
+        self._snapshot_increments = max(len(frames) - 1, 0)
+        self._dirty_types.clear()
+        self._reduced = False
 
     def stream_event(self, event):  # type: (Event) -> None
         """Stream a single :class:`~Event` through the engine."""
-        for hook in self._event_hooks[event.type]:
-            hook(event)
+        self._dispatch_event(self._prepare_event(event))
+
+    def _prepare_event(self, event):  # type: (Event) -> Event
+        """Intern, normalize and flatten an event as it's ingested, which may replace the event."""
+        if self._interner is not None:
+            self._interner.intern_data(event.data)
+        if self._timestamps is not None:
+            event = self._normalize_time(event)
+        if self.flatten_paths and not isinstance(event.data, FlatData):
+            event = event._replace(data=FlatData(event.data, self.flatten_max_items))
+        return event
+
+    def _dispatch_event(self, event):  # type: (Event) -> None
+        """Run the callbacks for an event that was already prepared."""
+        self._dirty_types.add(event.type)
+        dispatch = self._dispatchers.get(event.type)
+        if dispatch is None:
+            dispatch = self._get_dispatcher(event.type)
+        dispatch(event)
+
+    def _get_dispatcher(self, event_type):  # type: (str) -> callable
+        """Fuse the callbacks for an event type into a single function, which is kept until callbacks change."""
+        hooks = self._event_hooks.get(event_type, self._any_event_hooks)
+        dispatch = self._dispatchers[event_type] = fuse_callbacks(hooks)
+        return dispatch
+
+    def _normalize_time(self, event):  # type: (Event) -> Event
+        """Get the time of an event from the first of the time fields, in the time unit of the engine."""
+        for field in self.time_fields:
+            value = event.data.get(field)
+            if value is not None:
+                return event._replace(time=self._timestamps.parse(value))
+        return event
 
     def finalize(self):
         """Send the engine an EOF signal, so that aggregating pipes can finish."""
@@ -1204,13 +2059,61 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
     def stream_events(self, events, finalize=True):
         """Stream :class:`~Event` objects through the engine."""
-        for event in events:
-            if not isinstance(event, Event):
-                event = Event.from_data(event)
-            self.stream_event(event)
+        with self._tuned_gc():
+            if self._batch_calls:
+                self._stream_batches(events)
+            else:
+                for event in events:
+                    if not isinstance(event, Event):
+                        event = Event.from_data(event)
+                    self.stream_event(event)
         if finalize:
             self.finalize()
 
+    @contextlib.contextmanager
+    def _tuned_gc(self):
+        """Tune the garbage collector while streaming, with the ``gc_freeze`` and ``gc_thresholds`` options."""
+        thresholds = self.get_config('gc_thresholds')
+        if self.get_config('gc_freeze', False) and not self._gc_frozen and hasattr(gc, 'freeze'):
+            # Objects from loading queries live as long as the engine, so move them out of the collected generations.
+            # This is global to the interpreter and is never undone here, since other objects may be frozen too
+            gc.collect()
+            gc.freeze()
+            self._gc_frozen = True
+
+        if thresholds is None:
+            yield
+            return
+
+        previous = gc.get_threshold()
+        gc.set_threshold(*thresholds)
+        try:
+            yield
+        finally:
+            gc.set_threshold(*previous)
+
+    def _stream_batches(self, events):
+        """Stream events in batches, so that batch functions are called once for many events."""
+        batch_size = self.get_config('batch_size', 256)
+        iterator = iter(events)
+        while True:
+            # Events are prepared first, so batch functions are keyed by and called with the events that are checked
+            batch = [self._prepare_event(event if isinstance(event, Event) else Event.from_data(event))
+                     for event in islice(iterator, batch_size)]
+            if not batch:
+                break
+
+            self._current_batch = batch
+            self._batch_positions.update((id(event), position) for position, event in enumerate(batch))
+            try:
+                for event in batch:
+                    self._dispatch_event(event)
+            finally:
+                self._current_batch = []
+                self._batch_positions.clear()
+                for results in self._batch_calls:
+                    results.clear()
+
     def reduce_events(self, inputs, analytic_id=None, finalize=True):
         """Run an event through the reducers registered with :meth:`~add_reducer` and :meth:`~add_post_processor`.
 
@@ -1229,6 +2132,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
             else:
                 raise ValueError("Unable to reduce {}".format(data))
 
+            self._reduced = True
             for reducer in self._reducer_hooks[analytic_id]:
                 reducer(events)
 
@@ -1237,14 +2141,17 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
     def add_event_callback(self, event_type, f):  # type: (int, callable) -> None
         """Register a callback for incoming events."""
+        self._owner_event_types[self._owner_id].add(event_type)
         if event_type == EVENT_TYPE_ANY:
             # Note that if querying over all events, we need to preserve the order the hooks were created
             # So append them to all existing hook arrays
             self._any_event_hooks.append(f)
             for _, event_hooks in self._event_hooks.items():
                 event_hooks.append(f)
+            self._owner_entries[self._owner_id].append((self._any_event_hooks, f))
         else:
-            self._event_hooks[event_type].append(f)
+            self._add_entry(self._event_hooks[event_type], f)
+        self._dispatchers.clear()
 
     def event_callback(self, *event_types):
         """Get a decorator that registers a function as an event callback in the engine."""
@@ -1259,7 +2166,7 @@ class PythonEngine(BaseEngine, BaseTranspiler):
 
     def register_output_pipe(self, f):
         """"Register a pipe, so that it can get called when the engine is closing."""
-        self._query_pipes.append(f)
+        self._add_entry(self._query_pipes, f)
 
     def output_pipe(self, f):
         """"Decorator that registers a pipe, so that it can get called when the engine is closing."""
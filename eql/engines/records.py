@@ -0,0 +1,331 @@
+"""Compact records, interned values and flattened paths for the data of events."""
+import sys
+
+from eql.utils import is_string, register_packable
+
+
+__all__ = (
+    "CompactData",
+    "FlatData",
+    "ProjectedData",
+    "RecordLayout",
+    "StringInterner",
+    "compact_event",
+    "expand_event",
+)
+
+MISSING = object()
+
+
+class RecordLayout(object):
+    """Offsets of the keys within compact records, which are shared by every record of an event type.
+
+    Keys are only ever appended, so records that were created earlier stay valid as new keys are observed.
+    """
+
+    __slots__ = 'keys', 'offsets', 'children'
+
+    def __init__(self, keys=()):
+        """Create a layout with known keys, such as the fields declared by the schema.
+
+        :param list[str] keys: The keys to start with
+        """
+        self.keys = []  # type: list[str]
+        self.offsets = {}  # type: dict[str, int]
+        self.children = {}  # type: dict[str, RecordLayout]
+        for key in keys:
+            self.add(key)
+
+    def __len__(self):
+        """Get the number of keys."""
+        return len(self.keys)
+
+    def add(self, key):
+        """Add a key to the layout and get its offset.
+
+        :param str key: The key to add
+        :rtype: int
+        """
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self.offsets[key] = len(self.keys)
+            self.keys.append(key)
+        return offset
+
+    def compact(self, data):
+        """Convert a dictionary into a compact record, including any nested dictionaries.
+
+        :param dict data: The event data
+        :rtype: CompactData
+        """
+        offsets = self.offsets
+        for key in data:
+            if key not in offsets:
+                self.add(key)
+
+        values = [MISSING] * len(self.keys)
+        for key, value in data.items():
+            if type(value) is dict:
+                child = self.children.get(key)
+                if child is None:
+                    child = self.children[key] = RecordLayout()
+                value = child.compact(value)
+            values[offsets[key]] = value
+
+        # Keys that are only in later records are left off the end
+        while values and values[-1] is MISSING:
+            values.pop()
+        return CompactData(self, tuple(values), getattr(data, 'fields', None))
+
+
+class CompactData(object):
+    """Read-only mapping stored as a tuple of values, with the keys in a shared :class:`~RecordLayout`."""
+
+    __slots__ = 'layout', 'values', 'fields'
+    __hash__ = None
+
+    def __init__(self, layout, values, fields=None):
+        """Create a record.
+
+        :param RecordLayout layout: The offset of each key
+        :param tuple values: The values in the same order as the layout, with ``MISSING`` for absent keys
+        :param frozenset[str] fields: The fields that were kept, if the record was projected from a larger event
+        """
+        self.layout = layout
+        self.values = values
+        self.fields = fields
+
+    def get(self, key, default=None):
+        """Get the value of a key, or a default when it's absent."""
+        offset = self.layout.offsets.get(key)
+        if offset is None or offset >= len(self.values):
+            return default
+
+        value = self.values[offset]
+        return default if value is MISSING else value
+
+    def __getitem__(self, key):
+        """Get the value of a key."""
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        """Check if a key is in the record."""
+        return self.get(key, MISSING) is not MISSING
+
+    def __iter__(self):
+        """Iterate over the keys in the record."""
+        keys = self.layout.keys
+        for offset, value in enumerate(self.values):
+            if value is not MISSING:
+                yield keys[offset]
+
+    def __len__(self):
+        """Get the number of keys in the record."""
+        return sum(1 for value in self.values if value is not MISSING)
+
+    def keys(self):
+        """Get the keys in the record."""
+        return list(self)
+
+    def items(self):
+        """Get the keys and values in the record."""
+        keys = self.layout.keys
+        return [(keys[offset], value) for offset, value in enumerate(self.values) if value is not MISSING]
+
+    def to_dict(self):
+        """Convert the record and any nested records back into dictionaries.
+
+        :rtype: dict
+        """
+        data = {key: value.to_dict() if isinstance(value, CompactData) else value for key, value in self.items()}
+        return data if self.fields is None else ProjectedData(data, self.fields)
+
+    copy = to_dict
+
+    def __eq__(self, other):
+        """Compare to another record or a dictionary."""
+        if isinstance(other, CompactData):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        """Compare to another record or a dictionary."""
+        return not self == other
+
+    def __repr__(self):
+        """Show the record as a dictionary."""
+        return "{}({!r})".format(type(self).__name__, self.to_dict())
+
+
+register_packable('compact', CompactData, CompactData.to_dict, dict)
+
+
+def compact_event(event, layout):
+    """Convert the data of an event into a compact record.
+
+    :param Event event: The event to convert
+    :param RecordLayout layout: The layout for the type of event
+    :rtype: Event
+    """
+    if isinstance(event.data, CompactData):
+        return event
+    return event._replace(data=layout.compact(event.data))
+
+
+def expand_event(event):
+    """Convert the data of an event back into a dictionary.
+
+    :param Event event: The event to convert
+    :rtype: Event
+    """
+    if isinstance(event.data, CompactData):
+        return event._replace(data=event.data.to_dict())
+    return event
+
+
+class ProjectedData(dict):
+    """Event data that only kept some of the fields of an event, so the others can be restored from an event store.
+
+    Fields that pipes remove or add afterwards are left alone when the event is restored.
+    """
+
+    __slots__ = 'fields',
+
+    def __init__(self, data, fields):
+        """Mark the data of an event as projected.
+
+        :param dict data: The fields that were kept
+        :param list[str] fields: Every field that the projection kept, including ones the event didn't have
+        """
+        super(ProjectedData, self).__init__(data)
+        self.fields = frozenset(fields)
+
+    def copy(self):
+        """Copy the data, which is still marked as projected."""
+        return ProjectedData(self, self.fields)
+
+
+register_packable('projected', ProjectedData, lambda data: [dict(data), sorted(data.fields)],
+                  lambda args: ProjectedData(*args))
+
+
+class FlatData(dict):
+    """Event data with an index of every nested value by its path, so nested fields are found with a single lookup.
+
+    Paths are tuples of the keys and array indexes under the top level key, such as ``('process', 'parent', 'name')``.
+    """
+
+    __slots__ = 'paths',
+
+    def __init__(self, data, max_items=64):
+        """Index the nested values of event data.
+
+        :param dict data: The event data
+        :param int max_items: The maximum number of items of each array to index
+        """
+        super(FlatData, self).__init__(data)
+        self.paths = {}  # type: dict[tuple, object]
+        for key, value in data.items():
+            if isinstance(value, (dict, list)):
+                self._add_paths((key, ), value, max_items)
+
+    def _add_paths(self, prefix, value, max_items):
+        if isinstance(value, dict):
+            items = value.items()
+        else:
+            items = enumerate(value[:max_items])
+
+        for key, child in items:
+            path = prefix + (key, )
+            self.paths[path] = child
+            if isinstance(child, (dict, list)):
+                self._add_paths(path, child, max_items)
+
+
+class StringInterner(object):
+    """Bounded table that deduplicates repeated string values of selected fields, as events are ingested.
+
+    Once the table is full, new strings are no longer added, but the strings that are already in the table are
+    still deduplicated.
+    """
+
+    def __init__(self, fields, max_size=65536):
+        """Create an empty table.
+
+        :param list[str] fields: The fields to intern, with ``.`` between the keys of nested fields
+        :param int max_size: The maximum number of distinct strings to keep
+        """
+        self.fields = list(fields)
+        self.paths = [tuple(field.split('.')) for field in self.fields]
+        self.max_size = max_size
+        self.table = {}  # type: dict[str, str]
+        self.hits = 0
+        self.misses = 0
+        self.overflow = 0
+        self.bytes_saved = 0
+
+    def __len__(self):
+        """Get the number of distinct strings in the table."""
+        return len(self.table)
+
+    def intern(self, value):
+        """Get the shared copy of a string, which is added to the table if there's room.
+
+        :param str value: The string to intern
+        :rtype: str
+        """
+        interned = self.table.get(value)
+        if interned is not None:
+            self.hits += 1
+            if interned is not value:
+                self.bytes_saved += sys.getsizeof(value)
+            return interned
+
+        self.misses += 1
+        if len(self.table) < self.max_size:
+            self.table[value] = value
+        else:
+            self.overflow += 1
+        return value
+
+    def _intern_value(self, value):
+        if is_string(value):
+            return self.intern(value)
+        elif isinstance(value, list):
+            value[:] = [self.intern(item) if is_string(item) else item for item in value]
+        return value
+
+    def intern_data(self, data):
+        """Replace the values of the interned fields in event data with their shared copies.
+
+        :param dict data: The event data, which is modified in place
+        """
+        for path in self.paths:
+            parent = data
+            for key in path[:-1]:
+                parent = parent.get(key)
+                if not isinstance(parent, dict):
+                    break
+            else:
+                key = path[-1]
+                value = parent.get(key)
+                if value is not None:
+                    parent[key] = self._intern_value(value)
+
+    def get_stats(self):
+        """Get the size of the table and the number of strings that were deduplicated.
+
+        :rtype: dict
+        """
+        return {
+            'fields': self.fields,
+            'entries': len(self.table),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'overflow': self.overflow,
+            'bytes_saved': self.bytes_saved,
+        }
@@ -0,0 +1,166 @@
+"""Conversion of timestamps in different formats to the integer time unit of an engine."""
+import datetime
+import re
+
+from eql.utils import is_number, is_string
+
+
+__all__ = (
+    "TIME_FORMATS",
+    "TimestampParser",
+)
+
+# Times are measured from the FileTime epoch, so FileTime values in the default time unit are unchanged
+EPOCH = datetime.datetime(1601, 1, 1)
+UNIX_EPOCH_SECONDS = 11644473600
+FILETIME_UNIT = 10000000
+
+AUTO = 'auto'
+ISO8601 = 'iso8601'
+EPOCH_SECONDS = 'epoch_s'
+EPOCH_MILLISECONDS = 'epoch_ms'
+EPOCH_MICROSECONDS = 'epoch_us'
+EPOCH_NANOSECONDS = 'epoch_ns'
+FILETIME = 'filetime'
+
+TIME_FORMATS = (AUTO, ISO8601, EPOCH_SECONDS, EPOCH_MILLISECONDS, EPOCH_MICROSECONDS, EPOCH_NANOSECONDS, FILETIME)
+
+# Units per second for each numeric format
+NUMERIC_UNITS = {
+    EPOCH_SECONDS: 1,
+    EPOCH_MILLISECONDS: 10 ** 3,
+    EPOCH_MICROSECONDS: 10 ** 6,
+    EPOCH_NANOSECONDS: 10 ** 9,
+    FILETIME: FILETIME_UNIT,
+}
+
+# Upper bounds used to guess the format of a number, which hold for dates between 1973 and 2286
+AUTO_RANGES = (
+    (10 ** 11, EPOCH_SECONDS),
+    (10 ** 14, EPOCH_MILLISECONDS),
+    (10 ** 16, EPOCH_MICROSECONDS),
+    (10 ** 18, FILETIME),
+)
+
+ISO8601_RE = re.compile(r"""
+    (?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})
+    (?:[Tt\ ](?P<hour>\d{2}):(?P<minute>\d{2}))?
+""", re.VERBOSE)
+
+# Everything after the minute: optional seconds, fraction and timezone
+SUFFIX_RE = re.compile(r"(?::(\d{2})(?:[.,](\d+))?)?\s*(?:([Zz])|([+-])(\d{2}):?(\d{2}))?$")
+
+# Numbers within strings, such as epoch seconds from JSON logs
+NUMBER_RE = re.compile(r"[+-]?\d+(?:\.\d+)?$")
+
+
+class TimestampParser(object):
+    """Convert timestamps to integers in an engine's time unit, measured from the FileTime epoch.
+
+    ISO-8601 strings are split after the minute, and the time of the minute is cached, so that timestamps which
+    share a prefix only need to parse the seconds and timezone.
+    """
+
+    def __init__(self, time_format=AUTO, time_unit=FILETIME_UNIT, cache_size=4096):
+        """Create a parser for a format.
+
+        :param str time_format: One of :data:`TIME_FORMATS`. With ``auto``, strings are parsed as ISO-8601 and the
+            format of numbers is guessed from their magnitude
+        :param int time_unit: The number of units per second
+        :param int cache_size: The maximum number of ISO-8601 prefixes to remember
+        """
+        if time_format not in TIME_FORMATS:
+            raise ValueError("Unknown time format {}. Expected one of {}".format(time_format, ', '.join(TIME_FORMATS)))
+
+        self.time_format = time_format
+        self.time_unit = time_unit
+        self.cache_size = cache_size
+        self._prefixes = {}  # type: dict[str, int]
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, value):
+        """Convert a timestamp to the time unit.
+
+        :param str|int|float value: The timestamp
+        :rtype: int
+        """
+        if self.time_format == ISO8601:
+            return self.parse_iso8601(value)
+        elif self.time_format == AUTO and is_string(value) and not NUMBER_RE.match(value):
+            return self.parse_iso8601(value)
+        elif is_string(value):
+            value = float(value) if '.' in value else int(value)
+        elif not is_number(value):
+            raise ValueError("Unable to parse timestamp {!r}".format(value))
+        return self.parse_number(value)
+
+    def parse_number(self, value, time_format=None):
+        """Convert a numeric timestamp to the time unit.
+
+        :param int|float value: The number of seconds, milliseconds, microseconds, nanoseconds or FileTime ticks
+        :param str time_format: The format of the number, instead of the format of the parser
+        :rtype: int
+        """
+        time_format = time_format or self.time_format
+        if time_format == AUTO:
+            time_format = EPOCH_NANOSECONDS
+            for bound, range_format in AUTO_RANGES:
+                if abs(value) < bound:
+                    time_format = range_format
+                    break
+
+        units = NUMERIC_UNITS[time_format]
+        if isinstance(value, float):
+            ticks = int(round(value * self.time_unit / units))
+        else:
+            ticks = value * self.time_unit // units
+
+        if time_format != FILETIME:
+            ticks += UNIX_EPOCH_SECONDS * self.time_unit
+        return ticks
+
+    def parse_iso8601(self, value):
+        """Convert an ISO-8601 timestamp to the time unit, with UTC for timestamps without a timezone.
+
+        :param str value: The timestamp, such as ``2019-06-01T12:30:15.25Z``
+        :rtype: int
+        """
+        if not is_string(value):
+            raise ValueError("Unable to parse timestamp {!r}".format(value))
+
+        # The prefix is at most the date and minute, so it's looked up before matching the regular expression
+        prefix = value[:16]
+        base = self._prefixes.get(prefix)
+
+        if base is None:
+            match = ISO8601_RE.match(value)
+            if match is None:
+                raise ValueError("Unable to parse timestamp {!r}".format(value))
+
+            self.misses += 1
+            prefix = value[:match.end()]
+            year, month, day, hour, minute = (int(part or 0) for part in match.groups())
+            delta = datetime.datetime(year, month, day, hour, minute) - EPOCH
+            base = (delta.days * 86400 + delta.seconds) * self.time_unit
+
+            if len(self._prefixes) >= self.cache_size:
+                self._prefixes.clear()
+            self._prefixes[prefix] = base
+        else:
+            self.hits += 1
+
+        match = SUFFIX_RE.match(value, len(prefix))
+        if match is None:
+            raise ValueError("Unable to parse timestamp {!r}".format(value))
+
+        seconds, fraction, _, sign, offset_hours, offset_minutes = match.groups()
+        ticks = base
+        if seconds:
+            ticks += int(seconds) * self.time_unit
+        if fraction:
+            ticks += int(fraction) * self.time_unit // 10 ** len(fraction)
+        if sign:
+            offset = (int(offset_hours) * 60 + int(offset_minutes)) * 60 * self.time_unit
+            ticks += -offset if sign == '+' else offset
+        return ticks
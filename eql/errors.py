@@ -29,6 +29,10 @@ class ParseError(EqlError):
         self.message = message
         super(ParseError, self).__init__(message)
 
+    def __reduce__(self):
+        """Pickle the error with the original arguments, so it can be sent between processes."""
+        return self.__class__, (self.error_msg, self.line, self.column, self.source)
+
 
 class SchemaError(ParseError):
     """Error for unknown event types."""
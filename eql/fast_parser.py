@@ -0,0 +1,409 @@
+"""Hand-written parser for the common subset of EQL, which avoids the overhead of the full grammar.
+
+Event queries, expressions and pipes are parsed with recursive descent and converted directly into the
+same syntax tree that :class:`~eql.parser.EqlWalker` builds. Everything else, including every error,
+is left to the full grammar, so that the syntax tree and error messages are always the same.
+"""
+import re
+
+from eql.ast import *  # noqa
+from eql.schema import EVENT_TYPE_ANY, check_event_name, find_type_mismatch
+
+
+__all__ = (
+    "START_RULES",
+    "fast_parse",
+)
+
+START_RULES = ('single_query', 'single_expression')
+KEYWORDS = frozenset(['and', 'by', 'const', 'in', 'join', 'macro', 'not', 'of', 'or', 'sequence', 'until', 'where',
+                      'with'])
+RESERVED = frozenset(['true', 'false', 'null'])
+COMPARATORS = {'<=': '<=', '<': '<', '==': '==', '=': '==', '!=': '!=', '>=': '>=', '>': '>'}
+
+# Use the same patterns as the grammar, so that tokens match exactly the same text
+TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+    | (?P<decimal>[-+]?(?:\d+\.\d*|\d*\.\d+)(?:[Ee][-+]?\d+)?)
+    | (?P<integer>[-+]?[0-9]+)
+    | (?P<ident>[a-zA-Z][a-zA-Z0-9_]*)
+    | (?P<op><=|>=|==|!=|[<>=()\[\],.|])
+    | (?P<quote>\??["'])
+""", re.VERBOSE)
+
+STRING_CONTENT_RE = {
+    '"': re.compile(r'(\\[btnfr"\'\\]|[^\r\n"\\])*'),
+    "'": re.compile(r'(\\[btnfr"\'\\]|[^\r\n\'\\])*'),
+    '?"': re.compile(r'(\\"|[^"])*'),
+    "?'": re.compile(r"(\\'|[^'])*"),
+}
+
+# Token types
+IDENT = 'ident'
+KEYWORD = 'keyword'
+OP = 'op'
+LITERAL = 'literal'
+END = 'end'
+
+
+class Unsupported(Exception):
+    """The text needs the full grammar, either for unsupported syntax or to get the error message."""
+
+
+def tokenize(text):
+    """Split text into a list of (type, value) tokens.
+
+    :param str text: EQL source text
+    :return: The tokens, and the positions of the integers without a sign
+    :rtype: (list[(str, object)], set[int])
+    """
+    tokens = []
+    unsigned = set()
+    position = 0
+    end = len(text)
+
+    while position < end:
+        match = TOKEN_RE.match(text, position)
+        if match is None:
+            raise Unsupported()
+
+        kind = match.lastgroup
+        value = match.group()
+        position = match.end()
+
+        if kind == 'ws':
+            continue
+        elif kind == 'decimal':
+            tokens.append((LITERAL, Number(float(value))))
+        elif kind == 'integer':
+            if value[0] not in '+-':
+                unsigned.add(len(tokens))
+            tokens.append((LITERAL, Number(int(value))))
+        elif kind == 'ident':
+            tokens.append((KEYWORD if value in KEYWORDS else IDENT, value))
+        elif kind == 'op':
+            tokens.append((OP, value))
+        else:
+            # Match the contents separately, since the grammar doesn't backtrack into the contents of a string
+            content = STRING_CONTENT_RE[value].match(text, position)
+            position = content.end()
+            if text[position:position + 1] != value[-1]:
+                raise Unsupported()
+            position += 1
+
+            if value.startswith('?'):
+                string = content.group().replace("\\" + value[-1], value[-1])
+            else:
+                string = String.unescape(content.group())
+            tokens.append((LITERAL, String(string)))
+
+    tokens.append((END, None))
+    return tokens, unsigned
+
+
+class FastParser(object):
+    """Recursive descent parser that builds an optimized syntax tree."""
+
+    def __init__(self, tokens, unsigned, preprocessor=None, implied_any=False, implied_base=False, pipes=True):
+        """Create a parser over a list of tokens.
+
+        :param list[(str, object)] tokens: The tokens from :func:`~tokenize`
+        :param set[int] unsigned: The positions of integers without a sign
+        :param PreProcessor preprocessor: Preprocessor to expand definitions and constants
+        :param bool implied_any: Allow for event queries to skip event type and WHERE
+        :param bool implied_base: Allow for queries to be built with only pipes
+        :param bool pipes: Toggle support for pipes
+        """
+        self.tokens = tokens
+        self.unsigned = unsigned
+        self.index = 0
+        self.preprocessor = preprocessor or PreProcessor()
+        self.implied_any = implied_any
+        self.implied_base = implied_base
+        self.pipes_enabled = pipes
+        self._eql_walker = AstWalker()
+        self.event_type = EVENT_TYPE_ANY
+
+    def peek(self, offset=0):
+        """Get the upcoming token."""
+        return self.tokens[min(self.index + offset, len(self.tokens) - 1)]
+
+    def next(self):
+        """Consume the next token."""
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def accept(self, kind, value):
+        """Consume the next token if it matches."""
+        if self.tokens[self.index] == (kind, value):
+            self.index += 1
+            return True
+        return False
+
+    def expect(self, kind, value=None):
+        """Consume the next token, which must match."""
+        token_kind, token_value = self.next()
+        if token_kind != kind or (value is not None and token_value != value):
+            raise Unsupported()
+        return token_value
+
+    def parse(self, start):
+        """Parse the tokens from a start rule of the grammar.
+
+        :param str start: Entry point for the EQL grammar
+        :rtype: EqlNode
+        """
+        if start == 'single_query':
+            node = self.piped_query()
+        elif start == 'single_expression':
+            node = self.expression()
+        else:
+            raise Unsupported()
+
+        self.expect(END)
+        return node
+
+    def piped_query(self):
+        """Parse an event query with optional pipes."""
+        if self.peek() == (OP, '|'):
+            if not self.implied_base:
+                raise Unsupported()
+            first = EventQuery(EVENT_TYPE_ANY, Boolean(True))
+        else:
+            first = self.event_query()
+
+        pipes = None
+        if self.peek() == (OP, '|'):
+            pipes = []
+            while self.accept(OP, '|'):
+                pipes.append(self.pipe())
+
+        return PipedQuery(first, pipes).optimize()
+
+    def event_query(self):
+        """Parse an event query, in the form ``<event-type> where <condition>``."""
+        if self.peek(0)[0] == IDENT and self.peek(1) == (KEYWORD, 'where'):
+            event_type = self.next()[1]
+            self.next()
+            if not check_event_name(event_type):
+                raise Unsupported()
+        elif self.peek(0) in ((KEYWORD, 'sequence'), (KEYWORD, 'join')) or not self.implied_any:
+            raise Unsupported()
+        else:
+            event_type = EVENT_TYPE_ANY
+
+        self.event_type = event_type
+        return EventQuery(event_type, self.expression()).optimize()
+
+    def pipe(self):
+        """Parse a pipe command and its arguments."""
+        if not self.pipes_enabled:
+            raise Unsupported()
+
+        name = self.expect(IDENT)
+        pipe_cls = PipeCommand.lookup.get(name)
+        if pipe_cls is None:
+            raise Unsupported()
+
+        if self.is_atom(0) and self.is_atom(self.atom_length(0)):
+            arguments = []
+            while self.is_atom(0):
+                arguments.append(self.atom())
+        elif self.peek() in ((END, None), (OP, '|')):
+            arguments = []
+        else:
+            arguments = self.expressions()
+
+        pipe = pipe_cls(arguments)
+        if pipe.minimum_args is not None and len(pipe.arguments) < pipe.minimum_args:
+            raise Unsupported()
+        elif pipe.maximum_args is not None and len(pipe.arguments) > pipe.maximum_args:
+            raise Unsupported()
+        elif pipe.validate() is not None:
+            raise Unsupported()
+        return pipe.optimize()
+
+    def is_atom(self, offset):
+        """Check if a literal or field (but not a function call) starts at an offset."""
+        kind, value = self.peek(offset)
+        if kind == LITERAL:
+            return True
+        return kind == IDENT and self.peek(offset + 1) != (OP, '(')
+
+    def atom_length(self, offset):
+        """Get the number of tokens in the atom at an offset."""
+        if self.peek(offset)[0] == LITERAL:
+            return offset + 1
+
+        offset += 1
+        while True:
+            if self.peek(offset) == (OP, '.') and self.peek(offset + 1)[0] == IDENT:
+                offset += 2
+            elif self.peek(offset) == (OP, '[') and self.is_index(offset + 1) and self.peek(offset + 2) == (OP, ']'):
+                offset += 3
+            else:
+                return offset
+
+    def is_index(self, offset):
+        """Check if the token at an offset is an unsigned integer."""
+        return self.index + offset in self.unsigned
+
+    def expressions(self):
+        """Parse a comma separated list of expressions, with an optional trailing comma."""
+        expressions = [self.expression()]
+        while self.accept(OP, ','):
+            if self.peek() in ((OP, ')'), (OP, '|'), (END, None)):
+                break
+            expressions.append(self.expression())
+        return expressions
+
+    def expression(self):
+        """Parse a boolean expression."""
+        terms = [self.subexpression()]
+        while self.accept(KEYWORD, 'or'):
+            terms.append(self.subexpression())
+
+        if len(terms) == 1:
+            return terms[0]
+        return Or(terms).optimize()
+
+    def subexpression(self):
+        """Parse terms joined by ``and``."""
+        terms = [self.term()]
+        while self.accept(KEYWORD, 'and'):
+            terms.append(self.term())
+
+        if len(terms) == 1:
+            return terms[0]
+        return And(terms).optimize()
+
+    def term(self):
+        """Parse a term with optional negation."""
+        if self.accept(KEYWORD, 'not'):
+            return Not(self.term()).optimize()
+
+        left = self.value()
+        kind, value = self.peek()
+
+        if kind == OP and value in COMPARATORS:
+            self.next()
+            comparator = COMPARATORS[value]
+            right = self.value()
+            if isinstance(left, Literal):
+                self.check_field_types(right, [left])
+            else:
+                self.check_field_types(left, [right])
+
+            # there is no special comparator for wildcards, just look for * in the string
+            if isinstance(right, String) and '*' in right.value:
+                if comparator == Comparison.EQ:
+                    return FunctionCall('wildcard', [left, right]).optimize()
+                elif comparator == Comparison.NE:
+                    return (~ FunctionCall('wildcard', [left, right])).optimize()
+            return Comparison(left, comparator, right).optimize()
+
+        elif self.accept(KEYWORD, 'in'):
+            self.expect(OP, '(')
+            container = self.expressions()
+            self.expect(OP, ')')
+            self.check_field_types(left, container)
+            return InSet(left, container).optimize()
+
+        return left
+
+    def check_field_types(self, expression, values):
+        """Leave comparisons that don't match the field types in the schema to the grammar for the error."""
+        if find_type_mismatch(self.event_type, expression, values) is not None:
+            raise Unsupported()
+
+    def value(self):
+        """Parse a function call, a parenthesized expression, a literal or a field."""
+        kind, value = self.peek()
+
+        if kind == IDENT and self.peek(1) == (OP, '('):
+            return self.function_call()
+        elif kind == IDENT and self.peek(1) == (KEYWORD, 'of'):
+            raise Unsupported()
+        elif self.accept(OP, '('):
+            expression = self.expression()
+            self.expect(OP, ')')
+            return expression
+        return self.atom()
+
+    def function_call(self):
+        """Parse a function call and expand macros."""
+        name = self.next()[1]
+        self.next()
+        arguments = []
+        if not self.accept(OP, ')'):
+            arguments = self.expressions()
+            self.expect(OP, ')')
+
+        if name in self.preprocessor.macros:
+            macro = self.preprocessor.macros[name]
+            return macro.expand(arguments, self._eql_walker).optimize()
+
+        return FunctionCall(name, arguments).optimize()
+
+    def atom(self):
+        """Parse a literal or a field."""
+        kind, value = self.next()
+        if kind == LITERAL:
+            return value.optimize()
+        elif kind != IDENT:
+            raise Unsupported()
+
+        path = []
+        while True:
+            if self.peek() == (OP, '.') and self.peek(1)[0] == IDENT:
+                self.next()
+                path.append(self.next()[1])
+            elif self.peek() == (OP, '[') and self.is_index(1) and self.peek(2) == (OP, ']'):
+                self.next()
+                path.append(self.next()[1].value)
+                self.next()
+            else:
+                break
+
+        if value in RESERVED:
+            if path:
+                raise Unsupported()
+            elif value == 'true':
+                return Boolean(True).optimize()
+            elif value == 'false':
+                return Boolean(False).optimize()
+            return Null().optimize()
+
+        if any(sub_field in RESERVED for sub_field in path):
+            raise Unsupported()
+
+        if not path and value in self.preprocessor.constants:
+            return self.preprocessor.constants[value].value.optimize()
+
+        return Field(value, path).optimize()
+
+
+def fast_parse(text, start, preprocessor=None, implied_any=False, implied_base=False, pipes=True):
+    """Parse the common subset of EQL without the full grammar.
+
+    :param str text: EQL source text, as unicode
+    :param str start: Entry point for the EQL grammar
+    :param PreProcessor preprocessor: Optional preprocessor to expand definitions and constants
+    :param bool implied_any: Allow for event queries to skip event type and WHERE
+    :param bool implied_base: Allow for queries to be built with only pipes
+    :param bool pipes: Toggle support for pipes
+    :return: The syntax tree, or None if the full grammar is needed
+    :rtype: EqlNode|None
+    """
+    if start not in START_RULES:
+        return
+
+    try:
+        tokens, unsigned = tokenize(text)
+        parser = FastParser(tokens, unsigned, preprocessor=preprocessor, implied_any=implied_any,
+                            implied_base=implied_base, pipes=pipes)
+        return parser.parse(start)
+    except Exception:
+        # Any failure is reparsed with the full grammar, which raises the same error as before
+        return
@@ -1,4 +1,20 @@
 """EQL functions."""
+import re
+from collections import OrderedDict
+
+from eql.utils import is_string, is_number, to_unicode
+
+
+__all__ = (
+    "FunctionInfo",
+    "builtins",
+    "get_function",
+    "get_functions",
+    "get_registry_version",
+    "memoize",
+    "register_function",
+)
+
 builtins = (
     "add",
     "arrayContains",
@@ -18,3 +34,244 @@ builtins = (
     "subtract",
     "wildcard",
 )
+
+_functions = {}  # type: dict[str, FunctionInfo]
+_registry_version = 0
+
+
+class FunctionInfo(object):
+    """A function that can be called from EQL, with metadata that allows calls to be optimized."""
+
+    __slots__ = 'name', 'func', 'pure', 'deterministic', 'batch', 'cost'
+
+    def __init__(self, name, func, pure=False, deterministic=False, batch=False, cost=None):
+        """Describe a function.
+
+        :param str name: The name of the function within EQL
+        :param callable func: The python function
+        :param bool pure: The result only depends on the arguments and there are no side effects, so calls with
+            literal arguments are evaluated once when an engine loads the query
+        :param bool deterministic: The same arguments always return the same result, so results can be memoized
+        :param bool batch: The function takes a list of argument tuples and returns a list of results, so it can be
+            called once for a batch of events
+        :param int cost: Relative cost of a call, on the same scale as :mod:`eql.optimizer`
+        """
+        self.name = name
+        self.func = func
+        self.pure = pure
+        self.deterministic = deterministic or pure
+        self.batch = batch
+        self.cost = cost
+
+    def __call__(self, *args):
+        """Call the python function."""
+        return self.func(*args)
+
+    def __repr__(self):
+        """Show the name, function and metadata."""
+        return "{}({!r}, {!r}, pure={}, deterministic={}, batch={}, cost={})".format(
+            type(self).__name__, self.name, self.func, self.pure, self.deterministic, self.batch, self.cost)
+
+
+def register_function(name, func=None, **metadata):
+    """Register a function globally, so that calls can be optimized when parsing. Also works as a decorator.
+
+    :param str name: The name of the function within EQL
+    :param callable|FunctionInfo func: The python function
+    :param metadata: Optional arguments to :class:`~FunctionInfo`
+    :rtype: FunctionInfo
+    """
+    if func is None:
+        def decorator(f):
+            register_function(name, f, **metadata)
+            return f
+        return decorator
+
+    global _registry_version
+
+    info = func if isinstance(func, FunctionInfo) else FunctionInfo(name, func, **metadata)
+    _functions[name] = info
+    _registry_version += 1
+    return info
+
+
+def get_function(name):
+    """Get a registered function by name.
+
+    :param str name: The name of the function within EQL
+    :rtype: FunctionInfo|None
+    """
+    return _functions.get(name)
+
+
+def get_functions():
+    """Get every registered function by name.
+
+    :rtype: dict[str, FunctionInfo]
+    """
+    return dict(_functions)
+
+
+def get_registry_version():
+    """Get a number that changes whenever a function is registered, so cached results can be invalidated.
+
+    :rtype: int
+    """
+    return _registry_version
+
+
+def memoize(func, size=1024):
+    """Wrap a function with a bounded least-recently-used cache of results.
+
+    :param callable func: A deterministic function with hashable arguments
+    :param int size: The maximum number of results to keep
+    :rtype: callable
+    """
+    results = OrderedDict()
+
+    def memoized(*args):
+        try:
+            result = results.pop(args)
+        except KeyError:
+            result = func(*args)
+            if len(results) >= size:
+                results.popitem(last=False)
+        except TypeError:
+            # Unhashable arguments can't be cached
+            return func(*args)
+
+        results[args] = result
+        return result
+
+    memoized.results = results
+    return memoized
+
+
+@register_function('length', pure=True, cost=1)
+def length(value):
+    """Get the length of a string or array, or 0 if the value is null."""
+    if value is None:
+        return 0
+    else:
+        return len(value)
+
+
+@register_function('match', pure=True, cost=20)
+def match(pattern, value):
+    """Check if a value matches a regular expression, ignoring case."""
+    return value is not None and re.match(pattern, value, re.IGNORECASE) is not None
+
+
+register_function('matchLite', match, pure=True, cost=20)
+
+
+@register_function('startsWith', pure=True, cost=5)
+def starts_with(a, b):  # type: (str, str) -> bool
+    """Check if a string starts with another string, ignoring case."""
+    return is_string(a) and is_string(b) and a.lower().startswith(b.lower())
+
+
+@register_function('endsWith', pure=True, cost=5)
+def ends_with(a, b):  # type: (str, str) -> bool
+    """Check if a string ends with another string, ignoring case."""
+    return is_string(a) and is_string(b) and a.lower().endswith(b.lower())
+
+
+@register_function('stringContains', pure=True, cost=5)
+def string_contains(a, b):  # type: (str, str) -> bool
+    """Check if a string contains another string, ignoring case."""
+    return is_string(a) and is_string(b) and b.lower() in a.lower()
+
+
+@register_function('indexOf', pure=True, cost=5)
+def index_of(a, b, start=0):  # type: (str, str, int) -> int
+    """Get the position of a substring, ignoring case, or null if it isn't found."""
+    if is_string(a) and is_string(b):
+        a = a.lower()
+        b = b.lower()
+        if b in a[start:]:
+            return a.index(b, start)
+
+
+@register_function('add', pure=True, cost=1)
+def add(a, b):  # type: (int|float, int|float) -> (int|float)
+    """Add two numbers, with null as 0."""
+    return (a or 0) + (b or 0)
+
+
+@register_function('subtract', pure=True, cost=1)
+def subtract(a, b):  # type: (int|float, int|float) -> (int|float)
+    """Subtract two numbers, with null as 0."""
+    return (a or 0) - (b or 0)
+
+
+@register_function('divide', pure=True, cost=1)
+def divide(a, b):  # type: (int|float, int|float) -> (int|float)
+    """Divide two numbers, or get NaN when dividing by 0."""
+    if not b:
+        return float('NaN')
+    return (a or 0) / b
+
+
+@register_function('multiply', pure=True, cost=1)
+def multiply(a, b):  # type: (int|float, int|float) -> (int|float)
+    """Multiply two numbers, with null as 0."""
+    return (a or 0) * (b or 0)
+
+
+@register_function('modulo', pure=True, cost=1)
+def modulo(a, b):  # type: (int|float, int|float) -> (int|float)
+    """Get the remainder of dividing two numbers, or NaN when dividing by 0."""
+    if not b:
+        return float('NaN')
+    return (a or 0) % b
+
+
+@register_function('substring', pure=True, cost=5)
+def substring(a, start=None, end=None):  # type: (str, int, int) -> str
+    """Get the part of a string between two positions."""
+    if is_string(a):
+        return a[start:end]
+
+
+@register_function('concat', pure=True, cost=5)
+def concat(*args):
+    """Convert the arguments to strings and join them together."""
+    return u"".join(to_unicode(arg) for arg in args)
+
+
+register_function('string', to_unicode, pure=True, cost=5)
+
+
+@register_function('number', pure=True, cost=5)
+def number(arg, base=10):  # type: (str, int) -> int|float
+    """Convert a string to a number, with a base of 16 for strings that start with 0x."""
+    if is_number(arg):
+        return arg
+    elif is_string(arg):
+        if '.' in arg:
+            return float(arg)
+        if arg.startswith('0x'):
+            arg = arg[2:]
+            base = 16
+        try:
+            return int(arg, base)
+        except ValueError:
+            return None
+
+
+@register_function('arrayContains', pure=True, cost=5)
+def array_contains(array, value):
+    """Check if an array contains a value, ignoring case for strings."""
+    if array is None:
+        return False
+
+    if is_string(value):
+        value = value.lower()
+
+    for item in array:
+        if item == value:
+            return True
+        elif is_string(item) and item.lower() == value:
+            return True
+    return False
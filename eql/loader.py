@@ -1,26 +1,186 @@
 """Serialize analytics to and from disk."""
-from eql.ast import EqlAnalytic  # noqa
-from eql.parser import parse_analytic, parse_analytics
-from eql.utils import load_dump, save_dump
+import multiprocessing
+import pickle
+
+from eql.ast import EqlAnalytic, PreProcessor  # noqa
+from eql.cache import ParseCache, get_parse_cache, set_parse_cache
+from eql.errors import EqlError
+from eql.schema import get_schema, use_schema
+from eql.utils import load_dump, save_dump, pack, unpack
+
+BUNDLE_EXTENSION = '.eqlb'
+BUNDLE_FORMAT = 'eql-bundle'
+BUNDLE_VERSION = 1
+
+_worker_state = {}
+
+
+def is_bundle(filename):
+    """Check if a file is a bundle of precompiled analytics."""
+    return filename.lower().endswith(BUNDLE_EXTENSION)
+
+
+def save_bundle(analytics, filename, preprocessor=None):
+    """Save analytics as a bundle of optimized syntax trees, which can be loaded without parsing.
+
+    :param list[EqlAnalytic] analytics: The analytics to save
+    :param str filename: The output path
+    :param PreProcessor preprocessor: Optional preprocessor to expand definitions before saving
+    """
+    from eql import __version__
+
+    preprocessor = preprocessor or PreProcessor()
+    bundle = {
+        'format': BUNDLE_FORMAT,
+        'version': BUNDLE_VERSION,
+        'eql_version': __version__,
+        'analytics': [preprocessor.expand(analytic) for analytic in analytics],
+    }
+
+    with open(filename, 'wb') as f:
+        f.write(pack(bundle))
+
+
+def load_bundle(filename):
+    """Load analytics from a bundle of precompiled syntax trees.
+
+    :param str filename: The path to the bundle
+    :rtype: list[EqlAnalytic]
+    """
+    with open(filename, 'rb') as f:
+        bundle = unpack(f.read())
+
+    if not isinstance(bundle, dict) or bundle.get('format') != BUNDLE_FORMAT:
+        raise ValueError("{} is not an EQL bundle".format(filename))
+    elif bundle['version'] > BUNDLE_VERSION:
+        raise ValueError("Unsupported bundle version {} in {}".format(bundle['version'], filename))
+    return bundle['analytics']
 
 
 def load_analytic(filename):
     """Load analytic."""
+    from eql.parser import parse_analytic
     analytic = load_dump(filename)
     return parse_analytic(analytic)
 
 
-def load_analytics(filename):
-    """Load analytics."""
+def _load_analytic_dicts(filename):
+    """Load the unparsed analytics from a file, or the syntax trees from a bundle."""
+    if is_bundle(filename):
+        return load_bundle(filename)
+
     analytics = load_dump(filename)
     if isinstance(analytics, dict):
         analytics = analytics['analytics']  # type: list
-    return parse_analytics(analytics)
+    return analytics
+
+
+def load_analytics(filename):
+    """Load analytics."""
+    if is_bundle(filename):
+        return load_bundle(filename)
+
+    from eql.parser import parse_analytics
+    return parse_analytics(_load_analytic_dicts(filename))
+
+
+def _init_worker(preprocessor, schema, cache_directory, kwargs):
+    """Set up the shared parsing state in a worker process."""
+    _worker_state.update(preprocessor=preprocessor, schema=schema, kwargs=kwargs)
+    if cache_directory is not None:
+        set_parse_cache(ParseCache(directory=cache_directory))
+
+
+def _parse_chunk(chunk):
+    """Parse a chunk of analytics and collect the errors instead of raising them."""
+    from eql.parser import parse_analytic
+
+    results = []
+    with use_schema(_worker_state['schema']):
+        for analytic_info in chunk:
+            if isinstance(analytic_info, EqlAnalytic):
+                results.append((analytic_info, None))
+                continue
+            try:
+                results.append((parse_analytic(analytic_info, preprocessor=_worker_state['preprocessor'],
+                                               **_worker_state['kwargs']), None))
+            except EqlError as e:
+                results.append((None, e))
+    return results
+
+
+def load_analytics_parallel(filenames, preprocessor=None, processes=None, chunk_size=50, **kwargs):
+    """Load and parse analytics from many files with a pool of processes.
+
+    Every worker parses with the same preprocessor and with the schema that is in use by the caller.
+    Errors are collected for each analytic, instead of stopping at the first error. Bundles are loaded without parsing.
+
+    :param list[str] filenames: The files with analytics to load
+    :param PreProcessor preprocessor: Optional preprocessor to expand definitions and constants
+    :param int processes: The number of worker processes, which defaults to the number of CPUs
+    :param int chunk_size: The number of analytics to send to a worker at a time
+    :param kwargs: Additional arguments to pass to :func:`~eql.parser.parse_query`
+    :return: The analytics in the order of the files, and a list of (filename, index, error) for each failure
+    :rtype: (list[EqlAnalytic], list[(str, int, EqlError)])
+    """
+    preprocessor = preprocessor or PreProcessor()
+    schema = get_schema().copy()
+    sources = []
+    analytic_dicts = []
+
+    for filename in filenames:
+        for index, analytic_info in enumerate(_load_analytic_dicts(filename)):
+            sources.append((filename, index))
+            analytic_dicts.append(analytic_info)
+
+    chunks = [analytic_dicts[i:i + chunk_size] for i in range(0, len(analytic_dicts), chunk_size)]
+    try:
+        pickle.dumps(preprocessor)
+    except Exception:
+        # Python macros can't be shared with other processes
+        processes = 1
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(chunks))
+
+    if processes <= 1:
+        _init_worker(preprocessor, schema, None, kwargs)
+        try:
+            chunk_results = [_parse_chunk(chunk) for chunk in chunks]
+        finally:
+            _worker_state.clear()
+    else:
+        # Workers share the on-disk parse cache, but not the in-memory one
+        cache = get_parse_cache()
+        init_args = (preprocessor, schema, cache.directory if cache is not None else None, kwargs)
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=init_args)
+        try:
+            chunk_results = pool.map(_parse_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    analytics = []
+    errors = []
+    results = [result for chunk in chunk_results for result in chunk]
+
+    for (filename, index), (analytic, error) in zip(sources, results):
+        if error is not None:
+            errors.append((filename, index, error))
+        else:
+            analytics.append(analytic)
+
+    return analytics, errors
 
 
 def save_analytics(analytics, filename):
     # type: (list[EqlAnalytic], str) -> None
     """Save analytics."""
+    if is_bundle(filename):
+        save_bundle(analytics, filename)
+        return
+
     rendered = [analytic.render() for analytic in analytics]
 
     save_dump({'analytics': rendered}, filename)
@@ -6,31 +6,35 @@ import glob
 import os
 import sys
 
-from eql.engines.build import render_engine
-from eql.engines.native import PythonEngine
-from eql.errors import EqlError
-from eql.loader import load_analytics, save_analytics
-from eql.parser import parse_query
-from eql.schema import use_schema
-from eql.utils import load_dump, stream_stdin_events, stream_file_events
-
 
 def build(args):
     """Convert an EQL engine with analytics to a target language."""
+    # Imported here so that the command line utility starts quickly
+    from eql.engines.build import render_engine
+    from eql.loader import load_analytics, load_analytics_parallel, save_analytics
+    from eql.schema import use_schema
+    from eql.utils import load_dump
+
     config = load_dump(args.config) if args.config else {}
 
     _, ext = os.path.splitext(args.output_file)
     ext = ext[len(os.extsep):]
 
     with use_schema(config.get('schema')):
-        if '*' in args.input_file:
+        if args.jobs is not None:
+            analytics, errors = load_analytics_parallel(sorted(glob.glob(args.input_file)), processes=args.jobs)
+            for filename, index, error in errors:
+                print("{} (analytic {:d}): {}".format(filename, index, error), file=sys.stderr)
+            if errors:
+                sys.exit(2)
+        elif '*' in args.input_file:
             analytics = []
             for input_file in glob.glob(args.input_file):
                 analytics.extend(load_analytics(input_file))
         else:
             analytics = load_analytics(args.input_file)
 
-    if ext in ('yml', 'yaml', 'json'):
+    if ext in ('yml', 'yaml', 'json', 'eqlb'):
         save_analytics(analytics, args.output_file)
     else:
         output = render_engine(analytics, engine_type=ext, config=config, analytics_only=args.analytics_only)
@@ -40,6 +44,11 @@ def build(args):
 
 def query(args):
     """Query over an input file."""
+    from eql.engines.native import PythonEngine
+    from eql.errors import EqlError
+    from eql.parser import parse_query
+    from eql.utils import load_dump, stream_stdin_events, stream_file_events
+
     if args.file:
         stream = stream_file_events(args.file, args.format, args.encoding)
     else:
@@ -74,6 +83,7 @@ def main(args=None):
     build_parser.add_argument('output_file', help='Output analytics engine file')
     build_parser.add_argument('--config', help='Engine configuration')
     build_parser.add_argument('--analytics-only', action='store_true', help='Skips core engine when building target')
+    build_parser.add_argument('--jobs', '-j', type=int, help='Parse the analytics in parallel with this many processes')
 
     query_parser = subparsers.add_parser('query', help='Query an EQL engine in a target language')
     query_parser.set_defaults(func=query)
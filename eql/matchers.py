@@ -0,0 +1,343 @@
+"""Linear-time matchers for wildcard patterns, and checks for combining regular expressions safely."""
+import re
+
+from eql.utils import is_string
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+__all__ = (
+    "AhoCorasick",
+    "PatternSet",
+    "compile_wildcard",
+    "match_wildcard",
+    "has_nested_quantifiers",
+    "combine_regexes",
+)
+
+WILDCARD = '*'
+
+# Backreferences, named groups and global flags change meaning when regular expressions are combined
+UNSAFE_ALTERNATION = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)')
+
+
+def _get_segments_matcher(segments):
+    """Get a matcher for a pattern with multiple wildcards, that finds each literal segment in order."""
+    prefix = segments[0]
+    suffix = segments[-1]
+    middle = [segment for segment in segments[1:-1] if segment]
+    min_length = len(prefix) + len(suffix) + sum(len(segment) for segment in middle)
+
+    def match_segments(text):
+        if len(text) < min_length or not text.startswith(prefix) or not text.endswith(suffix):
+            return False
+
+        # Matching each segment at its leftmost position never rules out a match, so there's no backtracking
+        position = len(prefix)
+        end = len(text) - len(suffix)
+        for segment in middle:
+            position = text.find(segment, position, end)
+            if position < 0:
+                return False
+            position += len(segment)
+        return True
+
+    return match_segments
+
+
+def _classify(pattern):
+    """Get the kind of matcher for a lowercase wildcard pattern, and the literal text it checks for."""
+    segments = pattern.split(WILDCARD)
+    if len(segments) == 1:
+        return PatternSet.EXACT, segments[0]
+    elif len(segments) == 2 and not segments[1]:
+        return PatternSet.PREFIX, segments[0]
+    elif len(segments) == 2 and not segments[0]:
+        return PatternSet.SUFFIX, segments[1]
+    elif len(segments) == 3 and not segments[0] and not segments[2]:
+        return PatternSet.SUBSTRING, segments[1]
+    return PatternSet.WILDCARD, pattern
+
+
+def compile_wildcard(patterns):
+    """Compile wildcard patterns into a case-insensitive function that checks if a string matches any of them.
+
+    Patterns without a wildcard are checked with a set lookup, patterns that start or end with one are checked with
+    ``startswith`` and ``endswith``, and ``*text*`` is checked by searching for a substring. Any other pattern finds
+    its literal segments in order.
+
+    :param list[str] patterns: Patterns where ``*`` matches any sequence of characters
+    :rtype: (str) -> bool
+    """
+    exact = set()
+    prefixes = []
+    suffixes = []
+    substrings = []
+    checks = []
+
+    for pattern in patterns:
+        kind, text = _classify(pattern.lower())
+        if kind == PatternSet.EXACT:
+            exact.add(text)
+        elif kind == PatternSet.PREFIX:
+            prefixes.append(text)
+        elif kind == PatternSet.SUFFIX:
+            suffixes.append(text)
+        elif kind == PatternSet.SUBSTRING:
+            substrings.append(text)
+        else:
+            checks.append(_get_segments_matcher(text.split(WILDCARD)))
+
+    if substrings:
+        substrings = tuple(substrings)
+        checks.insert(0, lambda text: any(substring in text for substring in substrings))
+    if suffixes:
+        suffixes = tuple(suffixes)
+        checks.insert(0, lambda text: text.endswith(suffixes))
+    if prefixes:
+        prefixes = tuple(prefixes)
+        checks.insert(0, lambda text: text.startswith(prefixes))
+    if exact:
+        exact = frozenset(exact)
+        checks.insert(0, exact.__contains__)
+
+    if len(checks) == 1:
+        check = checks[0]
+
+        def match_wildcards(text):
+            return is_string(text) and check(text.lower())
+    else:
+        def match_wildcards(text):
+            if not is_string(text):
+                return False
+            text = text.lower()
+            return any(check(text) for check in checks)
+
+    return match_wildcards
+
+
+def match_wildcard(text, *patterns):
+    """Check if a string matches any of the wildcard patterns, ignoring case.
+
+    :param str text: The string to check
+    :param str patterns: Patterns where ``*`` matches any sequence of characters
+    :rtype: bool
+    """
+    return compile_wildcard(patterns)(text)
+
+
+class AhoCorasick(object):
+    """Automaton that finds every occurrence of many substrings with a single scan of the text."""
+
+    def __init__(self, patterns):
+        """Build the automaton.
+
+        :param list[(object, str)] patterns: The substrings to search for, with a key that's returned for each
+        """
+        self.transitions = [{}]  # type: list[dict[str, int]]
+        self.outputs = [[]]  # type: list[list[object]]
+        failures = [0]
+
+        for key, pattern in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self.transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][char] = next_state
+                    self.transitions.append({})
+                    self.outputs.append([])
+                    failures.append(0)
+                state = next_state
+            self.outputs[state].append(key)
+
+        # Link every state to the longest proper suffix that's also in the trie, breadth first
+        queue = list(self.transitions[0].values())
+        for state in queue:
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                failure = failures[state]
+                while failure and char not in self.transitions[failure]:
+                    failure = failures[failure]
+                failure = self.transitions[failure].get(char, 0)
+                failures[next_state] = failure if failure != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[failures[next_state]]
+
+        self.failures = failures
+
+    def search(self, text):
+        """Get the keys of every pattern that occurs in the text.
+
+        :param str text: The text to scan
+        :rtype: set
+        """
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+        found = set(outputs[0])
+        state = 0
+
+        for char in text:
+            while state and char not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+
+class PatternSet(object):
+    """Case-insensitive patterns for a single field, so that each value is scanned once for every pattern."""
+
+    EXACT = 'exact'
+    PREFIX = 'prefix'
+    SUFFIX = 'suffix'
+    SUBSTRING = 'substring'
+    WILDCARD = 'wildcard'
+
+    def __init__(self):
+        """Create an empty set of patterns."""
+        self.patterns = []  # type: list[(str, str)]
+        self._ids = {}  # type: dict[(str, str), int]
+        self._compiled = None
+        self._last_text = None
+        self._last_matches = frozenset()
+
+    def __len__(self):
+        """Get the number of distinct patterns."""
+        return len(self.patterns)
+
+    def add(self, kind, text):
+        """Add a pattern and get its identifier, which is shared by equivalent patterns.
+
+        :param str kind: The type of pattern
+        :param str text: The literal text or wildcard pattern
+        :rtype: int
+        """
+        key = kind, text.lower()
+        if key not in self._ids:
+            self._ids[key] = len(self.patterns)
+            self.patterns.append(key)
+            self._compiled = None
+            self._last_text = None
+        return self._ids[key]
+
+    def add_wildcard(self, pattern):
+        """Add a wildcard pattern and get its identifier.
+
+        :param str pattern: Pattern where ``*`` matches any sequence of characters
+        :rtype: int
+        """
+        return self.add(*_classify(pattern.lower()))
+
+    def _compile(self):
+        exact = {}
+        prefixes = {}
+        suffixes = {}
+        substrings = []
+        wildcards = []
+
+        for identifier, (kind, text) in enumerate(self.patterns):
+            if kind == self.EXACT:
+                exact.setdefault(text, []).append(identifier)
+            elif kind == self.PREFIX:
+                prefixes.setdefault(len(text), {}).setdefault(text, []).append(identifier)
+            elif kind == self.SUFFIX:
+                suffixes.setdefault(len(text), {}).setdefault(text, []).append(identifier)
+            elif kind == self.SUBSTRING:
+                substrings.append((identifier, text))
+            else:
+                wildcards.append((identifier, _get_segments_matcher(text.split(WILDCARD))))
+
+        automaton = AhoCorasick(substrings) if substrings else None
+        self._compiled = (exact, sorted(prefixes.items()), sorted(suffixes.items()), automaton, wildcards)
+
+    def match(self, text):
+        """Get the identifiers of every pattern that matches a value, which is remembered for the next lookup.
+
+        :param str text: The value of the field
+        :rtype: frozenset[int]
+        """
+        if text == self._last_text and self._last_text is not None:
+            return self._last_matches
+        elif not is_string(text):
+            return frozenset()
+        elif self._compiled is None:
+            self._compile()
+
+        exact, prefixes, suffixes, automaton, wildcards = self._compiled
+        lowered = text.lower()
+        matches = set(exact.get(lowered, ()))
+
+        for length, lookup in prefixes:
+            if length > len(lowered):
+                break
+            matches.update(lookup.get(lowered[:length], ()))
+
+        for length, lookup in suffixes:
+            if length > len(lowered):
+                break
+            matches.update(lookup.get(lowered[len(lowered) - length:], ()))
+
+        if automaton is not None:
+            matches.update(automaton.search(lowered))
+
+        matches.update(identifier for identifier, matcher in wildcards if matcher(lowered))
+
+        self._last_text = text
+        self._last_matches = frozenset(matches)
+        return self._last_matches
+
+
+def _has_nested_repeat(items, repeated):
+    """Walk a parsed regular expression and check for an unbounded repeat inside of another repeat."""
+    for op, value in items:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, body = value
+            unbounded = high == sre_parse.MAXREPEAT
+            if repeated and unbounded:
+                return True
+            if _has_nested_repeat(body, repeated or high > 1):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if _has_nested_repeat(value[-1], repeated):
+                return True
+        elif op == sre_parse.BRANCH:
+            if any(_has_nested_repeat(branch, repeated) for branch in value[1]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if _has_nested_repeat(value[1], repeated):
+                return True
+    return False
+
+
+def has_nested_quantifiers(pattern):
+    """Check if a regular expression has a quantifier nested within another, such as ``(a+)+``.
+
+    Nested quantifiers can backtrack for exponential time when a match fails, so this is a conservative check for
+    patterns that may be catastrophically slow.
+
+    :param str pattern: The regular expression
+    :rtype: bool
+    """
+    return _has_nested_repeat(sre_parse.parse(pattern), False)
+
+
+def combine_regexes(patterns):
+    """Combine regular expressions into a single alternation, or None if they can't be safely combined.
+
+    :param list[str] patterns: The regular expressions
+    :rtype: str|None
+    """
+    if any(UNSAFE_ALTERNATION.search(pattern) for pattern in patterns):
+        return
+
+    combined = '|'.join('(?:{})'.format(pattern) for pattern in patterns)
+    try:
+        re.compile(combined)
+    except re.error:
+        return
+    return combined
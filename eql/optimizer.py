@@ -0,0 +1,351 @@
+"""Cost-based ordering of boolean terms, so that cheap and selective checks short-circuit expensive ones."""
+from collections import defaultdict
+from timeit import default_timer
+
+from eql.ast import *  # noqa
+from eql.functions import get_function
+from eql.utils import is_string
+
+
+__all__ = (
+    "AdaptiveTerms",
+    "FieldStatistics",
+    "get_cost",
+    "get_selectivity",
+    "order_terms",
+    "reorder_predicates",
+)
+
+STRING_FUNCTIONS = frozenset(['startsWith', 'endsWith', 'stringContains', 'arrayContains'])
+REGEX_FUNCTIONS = frozenset(['wildcard', 'match', 'matchLite'])
+
+# Functions that return a value for any input, so evaluating them out of order never raises new errors
+SAFE_FUNCTIONS = STRING_FUNCTIONS | REGEX_FUNCTIONS
+
+FIELD_COST = 1
+COMPARISON_COST = 1
+SET_COST = 2
+STRING_COST = 5
+FUNCTION_COST = 10
+REGEX_COST = 20
+SUBQUERY_COST = 50
+
+DEFAULT_SELECTIVITY = 0.5
+MIN_PROBABILITY = 0.001
+
+
+class FieldStatistics(object):
+    """Frequencies of field values within a sample of events, to estimate how often comparisons are true."""
+
+    def __init__(self, max_values=256):
+        """Create empty statistics.
+
+        :param int max_values: The maximum number of distinct values to count for each field
+        """
+        self.max_values = max_values
+        self.total = 0
+        self.counts = defaultdict(dict)  # type: dict[tuple, dict[object, int]]
+        self.overflow = set()
+
+    def add_event(self, event):
+        """Count the values within an event.
+
+        :param Event|dict event: An event or its data
+        """
+        self.total += 1
+        self._add_values((), getattr(event, 'data', event))
+
+    def add_events(self, events):
+        """Count the values within a sample of events.
+
+        :param list[Event|dict] events: The sampled events
+        """
+        for event in events:
+            self.add_event(event)
+
+    def _add_values(self, path, value):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                self._add_values(path + (key, ), child)
+            return
+        elif isinstance(value, (list, tuple)) or path in self.overflow:
+            return
+
+        if is_string(value):
+            value = value.lower()
+
+        counts = self.counts[path]
+        if value in counts:
+            counts[value] += 1
+        elif len(counts) < self.max_values:
+            counts[value] = 1
+        else:
+            self.overflow.add(path)
+
+    def get_frequency(self, field, value):
+        """Get the fraction of sampled events where a field has a value, or None if it's unknown.
+
+        :param Field field: The field to look up
+        :param object value: The literal value to compare against
+        :rtype: float|None
+        """
+        path = (field.base, ) + tuple(field.path)
+        if not self.total or value is None or path in self.overflow:
+            return
+
+        if is_string(value):
+            value = value.lower()
+        return float(self.counts.get(path, {}).get(value, 0)) / self.total
+
+
+def get_cost(node):
+    """Estimate the relative cost of evaluating an expression.
+
+    :param Expression node: The expression to evaluate
+    :rtype: int
+    """
+    if isinstance(node, Literal):
+        return 0
+    elif isinstance(node, Field):
+        return FIELD_COST
+    elif isinstance(node, Comparison):
+        return COMPARISON_COST + get_cost(node.left) + get_cost(node.right)
+    elif isinstance(node, InSet):
+        return SET_COST + get_cost(node.expression) + sum(get_cost(item) for item in node.container)
+    elif isinstance(node, FunctionCall):
+        if node.name in STRING_FUNCTIONS:
+            cost = STRING_COST
+        elif node.name in REGEX_FUNCTIONS:
+            cost = REGEX_COST + len(node.arguments)
+        else:
+            info = get_function(node.name)
+            cost = info.cost if info is not None and info.cost is not None else FUNCTION_COST
+        return cost + sum(get_cost(argument) for argument in node.arguments)
+    elif isinstance(node, NamedSubquery):
+        return SUBQUERY_COST
+    elif isinstance(node, Not):
+        return get_cost(node.term)
+    elif isinstance(node, (And, Or)):
+        return sum(get_cost(term) for term in node.terms)
+    return FUNCTION_COST
+
+
+def get_selectivity(node, statistics=None):
+    """Estimate the probability that an expression is true.
+
+    :param Expression node: The expression to evaluate
+    :param FieldStatistics statistics: Optional frequencies of field values
+    :rtype: float
+    """
+    if isinstance(node, Boolean):
+        return 1.0 if node.value else 0.0
+    elif isinstance(node, Not):
+        return 1.0 - get_selectivity(node.term, statistics)
+    elif isinstance(node, And):
+        probability = 1.0
+        for term in node.terms:
+            probability *= get_selectivity(term, statistics)
+        return probability
+    elif isinstance(node, Or):
+        probability = 1.0
+        for term in node.terms:
+            probability *= 1.0 - get_selectivity(term, statistics)
+        return 1.0 - probability
+    elif statistics is None:
+        return DEFAULT_SELECTIVITY
+
+    frequency = None
+    if isinstance(node, Comparison) and node.comparator in (Comparison.EQ, Comparison.NE):
+        field, value = node.left, node.right
+        if isinstance(field, Literal):
+            field, value = value, field
+        if isinstance(field, Field) and isinstance(value, Literal):
+            frequency = statistics.get_frequency(field, value.value)
+            if frequency is not None and node.comparator == Comparison.NE:
+                frequency = 1.0 - frequency
+
+    elif isinstance(node, InSet) and isinstance(node.expression, Field):
+        if all(isinstance(item, Literal) for item in node.container):
+            frequencies = [statistics.get_frequency(node.expression, item.value) for item in node.container]
+            if None not in frequencies:
+                frequency = min(1.0, sum(frequencies))
+
+    return DEFAULT_SELECTIVITY if frequency is None else frequency
+
+
+def is_reorderable(node):
+    """Check that an expression can be evaluated in any order without raising new errors.
+
+    :param Expression node: The expression to check
+    :rtype: bool
+    """
+    if isinstance(node, (Literal, Field, NamedSubquery)):
+        return True
+    elif isinstance(node, Comparison):
+        return is_reorderable(node.left) and is_reorderable(node.right)
+    elif isinstance(node, InSet):
+        return is_reorderable(node.expression) and all(is_reorderable(item) for item in node.container)
+    elif isinstance(node, FunctionCall):
+        return node.name in SAFE_FUNCTIONS and all(is_reorderable(arg) for arg in node.arguments)
+    elif isinstance(node, Not):
+        return is_reorderable(node.term)
+    elif isinstance(node, (And, Or)):
+        return all(is_reorderable(term) for term in node.terms)
+    return False
+
+
+def order_terms(node, statistics=None):
+    """Order the terms of an ``and`` or ``or`` so that the ones most likely to short-circuit are checked first.
+
+    Terms that may raise errors, such as user-defined functions, stay in place and are never reordered around.
+
+    :param And|Or node: The boolean expression
+    :param FieldStatistics statistics: Optional frequencies of field values
+    :rtype: list[Expression]
+    """
+    def get_rank(term):
+        probability = get_selectivity(term, statistics)
+        if isinstance(node, And):
+            probability = 1.0 - probability
+        return (get_cost(term) or MIN_PROBABILITY) / max(probability, MIN_PROBABILITY)
+
+    ordered = []
+    segment = []
+    for term in node.terms:
+        if is_reorderable(term):
+            segment.append(term)
+        else:
+            ordered.extend(sorted(segment, key=get_rank))
+            ordered.append(term)
+            segment = []
+
+    ordered.extend(sorted(segment, key=get_rank))
+    return ordered
+
+
+def reorder_predicates(node, statistics=None):
+    """Reorder every ``and`` and ``or`` within a syntax tree, without changing its results.
+
+    :param BaseNode node: The syntax tree
+    :param FieldStatistics statistics: Optional frequencies of field values
+    :rtype: BaseNode
+    """
+    def callback(transformed, _):
+        if isinstance(transformed, (And, Or)):
+            terms = order_terms(transformed, statistics)
+            if any(a is not b for a, b in zip(terms, transformed.terms)):
+                return type(transformed)(terms)
+        return transformed
+
+    return AstWalker().transform(node, callback, optimize=False, copy=False)
+
+
+class AdaptiveTerms(object):
+    """Runtime counters for the terms of an ``and`` or ``or``, used to periodically reorder them by observed cost.
+
+    A sample of evaluations is timed, and every reorderable term is evaluated during a sample so that its pass rate
+    doesn't depend on the current order.
+    """
+
+    def __init__(self, node, terms, callbacks, sample_rate=32, interval=64):
+        """Track the terms of a boolean expression.
+
+        :param And|Or node: The boolean expression
+        :param list[Expression] terms: The terms in their initial order
+        :param list[callable] callbacks: The evaluator for each term
+        :param int sample_rate: Time one out of this many evaluations
+        :param int interval: Reorder the terms after this many samples
+        """
+        self.node = node
+        self.terms = terms
+        self.callbacks = callbacks
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.stop = isinstance(node, Or)
+        self.countdown = sample_rate
+        self.samples = 0
+        self.reorders = 0
+        self.measured = [0] * len(terms)
+        self.passed = [0] * len(terms)
+        self.elapsed = [0.0] * len(terms)
+
+        # Consecutive reorderable terms are grouped together, and terms that may raise errors are left on their own
+        self.segments = []  # type: list[(bool, list[int])]
+        for index, term in enumerate(terms):
+            movable = is_reorderable(term)
+            if movable and self.segments and self.segments[-1][0]:
+                self.segments[-1][1].append(index)
+            else:
+                self.segments.append((movable, [index]))
+
+        self.order = [index for _, indexes in self.segments for index in indexes]
+        self.ordered = [callbacks[index] for index in self.order]
+
+    @property
+    def evaluations(self):
+        """Get the number of times the expression was evaluated."""
+        return self.samples * self.sample_rate + self.sample_rate - self.countdown
+
+    def measure(self, scope):
+        """Evaluate every reorderable term and record the pass rates and elapsed time."""
+        self.countdown = self.sample_rate
+        self.samples += 1
+        result = not self.stop
+
+        for movable, indexes in self.segments:
+            if not movable:
+                if bool(self.callbacks[indexes[0]](scope)) == self.stop:
+                    result = self.stop
+                    break
+                continue
+
+            for index in indexes:
+                start = default_timer()
+                value = bool(self.callbacks[index](scope))
+                self.elapsed[index] += default_timer() - start
+                self.measured[index] += 1
+                self.passed[index] += value
+                if value == self.stop:
+                    result = self.stop
+
+            if result == self.stop:
+                break
+
+        if self.samples % self.interval == 0:
+            self.reorder()
+        return result
+
+    def get_rank(self, index):
+        """Get the expected cost of a term, relative to the chance that it short-circuits."""
+        probability = float(self.passed[index]) / self.measured[index]
+        if not self.stop:
+            probability = 1.0 - probability
+        return (self.elapsed[index] / self.measured[index]) / max(probability, MIN_PROBABILITY)
+
+    def reorder(self):
+        """Sort the reorderable terms by their observed cost and pass rate."""
+        for movable, indexes in self.segments:
+            # Terms in a segment are always measured together, unless an earlier segment short-circuits
+            if movable and self.measured[indexes[0]]:
+                indexes.sort(key=self.get_rank)
+
+        order = [index for _, indexes in self.segments for index in indexes]
+        if order != self.order:
+            self.reorders += 1
+            self.order = order
+            self.ordered[:] = [self.callbacks[index] for index in order]
+
+    def get_stats(self):
+        """Get the counters and current order of the terms.
+
+        :rtype: dict
+        """
+        return {
+            'expression': self.node.render(),
+            'order': [self.terms[index].render() for index in self.order],
+            'pass_rates': [float(self.passed[index]) / self.measured[index] if self.measured[index] else None
+                           for index in self.order],
+            'evaluations': self.evaluations,
+            'samples': self.samples,
+            'reorders': self.reorders,
+        }
@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import datetime
+import hashlib
 from collections import OrderedDict
 
 import tatsu
@@ -11,9 +12,11 @@ import tatsu.semantics
 import tatsu.walkers
 
 from eql.ast import *  # noqa: F401
+from eql.cache import get_parse_cache
 from eql.errors import ParseError, SchemaError
 from eql.etc import get_etc_file
-from eql.schema import EVENT_TYPE_ANY, check_event_name
+from eql.fast_parser import fast_parse
+from eql.schema import EVENT_TYPE_ANY, check_event_name, find_type_mismatch
 from eql.utils import is_string, to_unicode
 
 
@@ -48,6 +51,41 @@ GRAMMAR = None
 tatsu_parser = None
 
 
+def _load_generated_parser(grammar):
+    """Load the parser generated from the grammar at build time, if it's current."""
+    try:
+        from eql.etc import eql_parser
+    except ImportError:
+        return
+
+    grammar_hash = hashlib.sha256(grammar.encode('utf-8')).hexdigest()
+    if eql_parser.GRAMMAR_SHA256 != grammar_hash or eql_parser.TATSU_VERSION != tatsu.__version__:
+        return
+
+    class GeneratedParser(object):
+        """Wrapper for the generated parser, since the parser holds the state for a single parse."""
+
+        @staticmethod
+        def parse(text, rule_name, **kwargs):
+            parser = eql_parser.EQLParser(semantics=tatsu.semantics.ModelBuilderSemantics())
+            return parser.parse(text, rule_name=rule_name, **kwargs)
+
+    return GeneratedParser()
+
+
+def get_tatsu_parser():
+    """Get the tatsu parser for the EQL grammar, and only compile the grammar if there's no generated parser."""
+    global GRAMMAR, tatsu_parser
+
+    if tatsu_parser is None:
+        GRAMMAR = get_etc_file('eql.ebnf')
+        tatsu_parser = _load_generated_parser(GRAMMAR)
+        if tatsu_parser is None:
+            tatsu_parser = tatsu.compile(GRAMMAR, parseinfo=True, semantics=tatsu.semantics.ModelBuilderSemantics())
+
+    return tatsu_parser
+
+
 class EqlWalker(tatsu.walkers.NodeWalker):
     """Walker of Tatsu semantic model to convert it into a EQL AST."""
 
@@ -67,6 +105,7 @@ class EqlWalker(tatsu.walkers.NodeWalker):
         self._eql_walker = AstWalker()
         self._subqueries_enabled = subqueries
         self._pipes_enabled = pipes
+        self._event_type = EVENT_TYPE_ANY
 
     @staticmethod
     def _error(node, message, end=False, cls=ParseError):
@@ -84,6 +123,16 @@ class EqlWalker(tatsu.walkers.NodeWalker):
         pos = node.parseinfo.endpos if end else node.parseinfo.pos
         return cls(message, line_number, pos, bad_line)
 
+    def _check_field_types(self, node, expression, values):
+        """Raise an error when a field is compared to a literal that doesn't match its type in the schema."""
+        mismatch = find_type_mismatch(self._event_type, expression, values)
+        if mismatch is not None:
+            field_type, value = mismatch
+            if isinstance(field_type, frozenset):
+                field_type = "one of " + ", ".join(sorted(field_type))
+            message = "Unable to compare {} to {}, expected {}".format(expression.render(), value.render(), field_type)
+            raise self._error(node, message.replace("{", "{{").replace("}", "}}"), cls=SchemaError)
+
     def _walk_default(self, node, *args, **kwargs):
         """Callback function to walk the AST."""
         if isinstance(node, list):
@@ -167,6 +216,11 @@ class EqlWalker(tatsu.walkers.NodeWalker):
         right = self.walk(node.right)
         op = self.walk(node.op)
 
+        if isinstance(left, Literal):
+            self._check_field_types(node, right, [left])
+        else:
+            self._check_field_types(node, left, [right])
+
         # there is no special comparator for wildcards, just look for * in the string
         if isinstance(right, String) and '*' in right.value:
             if op == Comparison.EQ:
@@ -197,6 +251,7 @@ class EqlWalker(tatsu.walkers.NodeWalker):
         """Callback function to walk the AST."""
         expr = self.walk(node.expr)
         container = self.walk(node.container)  # type: list[Expression]
+        self._check_field_types(node, expr, container)
         return InSet(expr, container)
 
     def walk__function_call(self, node):
@@ -221,7 +276,12 @@ class EqlWalker(tatsu.walkers.NodeWalker):
             if not check_event_name(event_type):
                 raise self._error(node, "Invalid event type: {event_type}", cls=SchemaError)
 
-        return EventQuery(event_type, self.walk(node.cond))
+        # Field types depend on the event type, so keep track of it while walking the condition
+        previous_type, self._event_type = self._event_type, event_type
+        try:
+            return EventQuery(event_type, self.walk(node.cond))
+        finally:
+            self._event_type = previous_type
 
     def walk__pipe(self, node):
         """Callback function to walk the AST."""
@@ -418,23 +478,37 @@ def _parse(text, start=None, preprocessor=None, implied_any=False, implied_base=
     :param PreProcessor preprocessor: Optional preprocessor to expand definitions and constants
     :rtype: EqlNode
     """
-    global GRAMMAR, tatsu_parser
-
-    if tatsu_parser is None:
-        GRAMMAR = get_etc_file('eql.ebnf')
-        tatsu_parser = tatsu.compile(GRAMMAR, parseinfo=True, semantics=tatsu.semantics.ModelBuilderSemantics())
-
     if not text.strip():
         raise ParseError("No text specified", 0, 0, text)
 
     # Convert everything to unicode
     text = to_unicode(text)
+    cache = get_parse_cache()
+    cache_key = None
+
+    if cache is not None:
+        cache_key = cache.get_key(text, start, preprocessor=preprocessor, implied_any=implied_any,
+                                  implied_base=implied_base, pipes=pipes, subqueries=subqueries)
+        if cache_key is not None:
+            eql_node = cache.get(cache_key)
+            if eql_node is not None:
+                return eql_node
+
+    eql_node = fast_parse(text, start, preprocessor=preprocessor, implied_any=implied_any,
+                          implied_base=implied_base, pipes=pipes)
+    if eql_node is not None:
+        if cache_key is not None:
+            cache.set(cache_key, eql_node)
+        return eql_node
+
     walker = EqlWalker(implied_any=implied_any, implied_base=implied_base,
                        preprocessor=preprocessor, pipes=pipes, subqueries=subqueries)
 
     try:
-        model = tatsu_parser.parse(text, rule_name=start, start=start, parseinfo=True)
+        model = get_tatsu_parser().parse(text, rule_name=start, start=start, parseinfo=True)
         eql_node = walker.walk(model)
+        if cache_key is not None:
+            cache.set(cache_key, eql_node)
         return eql_node
     except tatsu.exceptions.FailedParse as e:
         info = e.buf.line_info(e.pos)
@@ -1,29 +1,125 @@
 """Eventing data schemas."""
+from eql.ast import Field, Literal
 from eql.etc import get_etc_path
-from eql.utils import load_dump
+from eql.utils import is_number, is_string, load_dump
 import contextlib
+import hashlib
+import json
 
 
 SCHEMA_FILE = get_etc_path('schema.json')
 _schema = {}
+_schema_fingerprint = None
+_schema_loaded = False
 
 EVENT_TYPE_ANY = 'any'
 EVENT_TYPE_GENERIC = 'generic'
 
+FIELD_TYPE_BOOLEAN = 'boolean'
+FIELD_TYPE_NUMBER = 'number'
+FIELD_TYPE_STRING = 'string'
+
 
 def reset_schema():
     """Reset the schema to the default."""
-    global _schema
     update_schema(load_dump(SCHEMA_FILE))
 
 
+def get_schema():
+    """Get the current schema, and only load the default schema when it's first needed."""
+    if not _schema_loaded:
+        reset_schema()
+    return _schema
+
+
 def check_event_name(name):
     """Check if an event is recognized by the schema."""
-    return name in (EVENT_TYPE_ANY, EVENT_TYPE_GENERIC) or name in _schema['event_types']
+    return name in (EVENT_TYPE_ANY, EVENT_TYPE_GENERIC) or name in get_schema()['event_types']
+
+
+def get_field_type(event_type, field, schema=None):
+    """Get the type of a field declared by the schema, or None if it's unknown.
+
+    Field types are declared per event type, with the field in the same syntax as a query::
+
+        {"field_types": {"process": {"pid": "number", "process_name": "string", "opcode": ["start", "stop"]}}}
+
+    A type is ``string``, ``number``, ``boolean``, or a list of the allowed strings for an enum.
+
+    :param str event_type: The event type of the query
+    :param Field field: The field to look up
+    :param dict schema: Use a schema other than the current one
+    :rtype: str|frozenset[str]|None
+    """
+    if schema is None:
+        schema = get_schema()
+
+    field_types = schema.get('field_types', {}).get(event_type)
+    if not field_types:
+        return
+
+    field_type = field_types.get(field.render())
+    if isinstance(field_type, (list, tuple)):
+        return frozenset(value.lower() for value in field_type)
+    return field_type
+
+
+def is_compatible(field_type, value):
+    """Check if a literal value can ever equal a field of a declared type.
+
+    :param str|frozenset[str] field_type: The declared type
+    :param object value: The python value of the literal
+    :rtype: bool
+    """
+    if value is None:
+        return True
+    elif field_type == FIELD_TYPE_STRING:
+        return is_string(value)
+    elif field_type == FIELD_TYPE_NUMBER:
+        return is_number(value) and not isinstance(value, bool)
+    elif field_type == FIELD_TYPE_BOOLEAN:
+        return isinstance(value, bool)
+    elif isinstance(field_type, frozenset):
+        # Wildcards are compared later with the wildcard function
+        return is_string(value) and ('*' in value or value.lower() in field_type)
+    return True
+
+
+def find_type_mismatch(event_type, expression, values):
+    """Find a literal that's compared to a field of a different type, which could never match.
+
+    :param str event_type: The event type of the query
+    :param Expression expression: The compared expression
+    :param list[Expression] values: The values it's compared to
+    :return: The declared type and the mismatched literal, or None
+    :rtype: (str|frozenset[str], Literal)|None
+    """
+    if not isinstance(expression, Field):
+        return
+
+    field_type = get_field_type(event_type, expression)
+    if field_type is None:
+        return
+
+    for value in values:
+        if isinstance(value, Literal) and not is_compatible(field_type, value.value):
+            return field_type, value
+
+
+def get_schema_fingerprint():
+    """Get a hash of the current schema."""
+    global _schema_fingerprint
+    if _schema_fingerprint is None:
+        encoded = json.dumps(get_schema(), sort_keys=True, default=repr).encode('utf-8')
+        _schema_fingerprint = hashlib.sha256(encoded).hexdigest()
+    return _schema_fingerprint
 
 
 def update_schema(schema):
     """Update the eventing schema."""
+    global _schema_fingerprint, _schema_loaded
+    _schema_fingerprint = None
+    _schema_loaded = True
     _schema.clear()
     _schema.update(schema)
 
@@ -31,7 +127,7 @@ def update_schema(schema):
 @contextlib.contextmanager
 def use_schema(schema=None):
     """Context manager for using python's `with` syntax for using a schema when parsing."""
-    current_schema = _schema.copy()
+    current_schema = get_schema().copy()
     if schema is not None:
         try:
             update_schema(schema)
@@ -41,6 +137,3 @@ def use_schema(schema=None):
 
     else:
         yield
-
-
-reset_schema()
@@ -5,17 +5,8 @@ import io
 import json
 import os
 import sys
-
-# Lazy load dynamic loaders
-try:
-    import yaml
-except ImportError:
-    yaml = None
-
-try:
-    import toml
-except ImportError:
-    toml = None
+import zlib
+from collections import OrderedDict, deque
 
 # Python2 and Python3 compatible type checking
 unicode_t = type(u"")
@@ -98,10 +89,34 @@ def get_type_converter(items):
         return convert_types
 
 
-if yaml is not None:
-    yaml.add_representer(str, str_presenter)
-    if str != unicode_t:
-        yaml.add_representer(unicode_t, str_presenter)
+_loaders = {}
+
+
+def _get_yaml():
+    """Lazy load PyYAML, which is slow to import."""
+    if 'yaml' not in _loaders:
+        try:
+            import yaml
+        except ImportError:
+            yaml = None
+
+        if yaml is not None:
+            yaml.add_representer(str, str_presenter)
+            if str != unicode_t:
+                yaml.add_representer(unicode_t, str_presenter)
+        _loaders['yaml'] = yaml
+    return _loaders['yaml']
+
+
+def _get_toml():
+    """Lazy load the TOML module."""
+    if 'toml' not in _loaders:
+        try:
+            import toml
+        except ImportError:
+            toml = None
+        _loaders['toml'] = toml
+    return _loaders['toml']
 
 
 def load_dump(filename):
@@ -110,9 +125,11 @@ def load_dump(filename):
 
     with open(filename) as f:
         if extension in ('yml', 'yaml'):
+            yaml = _get_yaml()
             assert yaml, "PyYAML module not found"
             return yaml.safe_load(f)
         elif extension == 'toml':
+            toml = _get_toml()
             assert toml, "TOML module not found"
             return toml.load(f)
         elif extension == 'json':
@@ -127,11 +144,13 @@ def save_dump(contents, filename):
 
     with open(filename, 'w') as f:
         if extension in ('yml', 'yaml'):
+            yaml = _get_yaml()
             assert yaml, "PyYAML module not found"
             yaml.dump(contents, stream=f, explicit_start=True, allow_unicode=True, default_flow_style=False, indent=2)
         elif extension == 'json':
             json.dump(contents, fp=f, indent=2, sort_keys=True)
         elif extension == 'toml':
+            toml = _get_toml()
             assert toml, "TOML module not found"
             toml.dump(contents, f)
         else:
@@ -204,3 +223,96 @@ def stream_events(fileobj, file_format="json"):
         return json.load(fileobj)
 
     raise NotImplementedError("Unexpected format: {}".format(file_format))
+
+
+PACK_MAGIC = b'EQL\x01'
+_packers = OrderedDict()  # type: dict[type, (str, callable)]
+_unpackers = {}  # type: dict[str, callable]
+
+
+def register_packable(tag, cls, to_args, from_args):
+    """Register a custom type so that it can be converted with :func:`~pack` and :func:`~unpack`.
+
+    :param str tag: Unique name for the type within packed data
+    :param type cls: The python class to register
+    :param (object) -> object to_args: Convert an instance to packable values
+    :param (object) -> object from_args: Create an instance from the unpacked values
+    """
+    _packers[cls] = (tag, to_args)
+    _unpackers[tag] = from_args
+
+
+def _get_packer(cls):
+    """Find the registered packer for a class or any of its base classes."""
+    if cls in _packers:
+        return _packers[cls]
+
+    for base in cls.__mro__[1:]:
+        if base in _packers:
+            return _packers[base]
+
+
+def _encode(obj):
+    """Convert an object to JSON serializable values, with tags for the types that JSON can't represent."""
+    if obj is None or isinstance(obj, strings + numbers):
+        return obj
+
+    packer = _get_packer(type(obj))
+    if packer is not None:
+        tag, to_args = packer
+        return {'x': [tag, _encode(to_args(obj))]}
+    elif isinstance(obj, dict):
+        return {'o' if isinstance(obj, OrderedDict) else 'd': [[_encode(k), _encode(v)] for k, v in obj.items()]}
+    elif isinstance(obj, (list, deque)):
+        return [_encode(v) for v in obj]
+    elif isinstance(obj, tuple):
+        return {'t': [_encode(v) for v in obj]}
+    elif isinstance(obj, (set, frozenset)):
+        return {'s': [_encode(v) for v in obj]}
+
+    raise TypeError("Unable to pack {}".format(type(obj).__name__))
+
+
+def _decode(obj):
+    """Convert tagged JSON values back to the original python objects."""
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    elif isinstance(obj, dict):
+        (tag, value), = obj.items()
+        if tag == 'd':
+            return {_decode(k): _decode(v) for k, v in value}
+        elif tag == 'o':
+            return OrderedDict((_decode(k), _decode(v)) for k, v in value)
+        elif tag == 't':
+            return tuple(_decode(v) for v in value)
+        elif tag == 's':
+            return set(_decode(v) for v in value)
+        elif tag == 'x':
+            name, args = value
+            return _unpackers[name](_decode(args))
+        raise ValueError("Unknown tag {}".format(tag))
+    return obj
+
+
+def pack(obj):
+    """Serialize python objects to compact binary.
+
+    Supports JSON values, tuples, sets, ordered dictionaries, dictionaries with non-string keys
+    and any types registered with :func:`~register_packable`.
+
+    :param object obj: The object to serialize
+    :rtype: bytes
+    """
+    encoded = json.dumps(_encode(obj), separators=(',', ':'))
+    return PACK_MAGIC + zlib.compress(encoded.encode('utf-8'))
+
+
+def unpack(data):
+    """Deserialize python objects that were serialized with :func:`~pack`.
+
+    :param bytes data: The packed data
+    :rtype: object
+    """
+    if data[:len(PACK_MAGIC)] != PACK_MAGIC:
+        raise ValueError("Unrecognized packed data")
+    return _decode(json.loads(zlib.decompress(data[len(PACK_MAGIC):]).decode('utf-8')))
@@ -3,6 +3,7 @@
 """Perform setup of the package for build."""
 import sys
 import glob
+import hashlib
 import os
 import re
 import io
@@ -13,6 +14,8 @@ except ImportError:  # for pip <= 9.0.3
     from pip.req import parse_requirements
 
 from setuptools import setup, Command, find_packages
+from setuptools.command.build_py import build_py
+from setuptools.command.develop import develop
 from setuptools.command.test import test as TestCommand
 
 
@@ -50,6 +53,57 @@ class Lint(Command):
         flake8cmd.run()
 
 
+class BuildParser(Command):
+    """Generate a static python parser from the EQL grammar, so the grammar isn't compiled at runtime."""
+
+    description = 'Generate the EQL parser'
+    user_options = []
+    grammar_path = os.path.join('eql', 'etc', 'eql.ebnf')
+    parser_path = os.path.join('eql', 'etc', 'eql_parser.py')
+
+    def initialize_options(self):
+        """Initialize options."""
+
+    def finalize_options(self):
+        """Finalize options."""
+
+    def run(self):
+        """Generate the parser with TatSu and record the grammar it was generated from."""
+        try:
+            import tatsu
+        except ImportError:
+            self.warn("TatSu not found, the grammar will be compiled at runtime")
+            return
+
+        with io.open(self.grammar_path, 'rt', encoding='utf8') as f:
+            grammar = f.read()
+
+        source = tatsu.to_python_sourcecode(grammar, name='EQL')
+        source += '\n\nGRAMMAR_SHA256 = {!r}\nTATSU_VERSION = {!r}\n'.format(
+            str(hashlib.sha256(grammar.encode('utf8')).hexdigest()), str(tatsu.__version__))
+
+        with io.open(self.parser_path, 'wt', encoding='utf8') as f:
+            f.write(source if isinstance(source, type(u'')) else source.decode('utf8'))
+
+
+class BuildPy(build_py):
+    """Generate the parser before building."""
+
+    def run(self):
+        """Build the parser, then the package."""
+        self.run_command('build_parser')
+        build_py.run(self)
+
+
+class Develop(develop):
+    """Generate the parser for development installs."""
+
+    def run(self):
+        """Build the parser, then install in development mode."""
+        self.run_command('build_parser')
+        develop.run(self)
+
+
 class Test(TestCommand):
     """Use pytest (http://pytest.org/latest/) in place of the standard unittest library."""
 
@@ -81,6 +135,9 @@ setup(
     install_requires=install_requires,
     tests_require=test_requires,
     cmdclass={
+        'build_parser': BuildParser,
+        'build_py': BuildPy,
+        'develop': Develop,
         'lint': Lint,
         'test': Test
     },
@@ -2,17 +2,21 @@
 import io
 import json
 import os
+import pickle
+import subprocess
+import sys
+import unittest
 import uuid
 
 import mock
 
 from .base import TestEngine
-from eql.errors import SchemaError
-from eql.loader import save_analytics
+from eql.errors import ParseError, SchemaError
+from eql.loader import load_analytics, load_analytics_parallel, save_analytics
 from eql.main import main
-from eql.parser import parse_analytics
+from eql.parser import get_preprocessor, parse_analytics
 from eql.schema import use_schema
-from eql.utils import save_dump
+from eql.utils import pack, save_dump
 
 
 build_analytics = parse_analytics([
@@ -87,6 +91,76 @@ class TestEqlCommand(TestEngine):
 
         os.remove(analytics_file)
 
+    @mock.patch('sys.stderr')
+    def test_build_parallel(self, mock_stderr):
+        """Test loading and building analytics from many files in parallel."""
+        schema = {'event_types': {'magic': 1, 'process': 2, 'file': 3}}
+        queries = ["magic where x == {:d}".format(i) for i in range(20)] + [
+            "sequence [process where MACRO(pid)] [file where x == CONSTANT]",
+        ]
+        preprocessor = get_preprocessor("macro MACRO(x) x > 100  const CONSTANT = 4")
+        analytic_files = [os.path.abspath('analytics-{:d}.tmp.json'.format(i)) for i in range(3)]
+        target_file = os.path.abspath('analytics-saved.tmp.json')
+
+        for i, analytic_file in enumerate(analytic_files):
+            save_dump({'analytics': [{'query': q, 'metadata': {'id': 'analytic-{:d}-{:d}'.format(i, j)}}
+                                     for j, q in enumerate(queries)]}, analytic_file)
+
+        with use_schema(schema):
+            expected = []
+            for analytic_file in analytic_files:
+                with open(analytic_file, 'r') as f:
+                    expected.extend(parse_analytics(json.load(f)['analytics'], preprocessor=preprocessor))
+
+            analytics, errors = load_analytics_parallel(analytic_files, preprocessor=preprocessor, processes=2,
+                                                        chunk_size=8)
+            self.assertEqual(errors, [])
+            self.assertEqual([a.render() for a in analytics], [a.render() for a in expected])
+
+            main(['build', os.path.abspath('analytics-*.tmp.json'), target_file, '--jobs', '2'])
+            with open(target_file, 'r') as f:
+                self.assertEqual(len(json.load(f)['analytics']), len(queries) * len(analytic_files))
+
+        # Errors are collected for every analytic, without stopping at the first one
+        analytics, errors = load_analytics_parallel(analytic_files, preprocessor=preprocessor, processes=2)
+        self.assertEqual(len(analytics), len(analytic_files))
+        self.assertEqual([(f, index) for f, index, _ in errors],
+                         [(f, index) for f in analytic_files for index in range(len(queries) - 1)])
+        self.assertTrue(all(isinstance(error, SchemaError) for _, _, error in errors))
+
+        with self.assertRaises(SystemExit):
+            main(['build', os.path.abspath('analytics-*.tmp.json'), target_file, '--jobs', '2'])
+
+        error = pickle.loads(pickle.dumps(ParseError("message", 1, 2, "source")))
+        self.assertEqual((error.error_msg, error.line, error.column, error.source), ("message", 1, 2, "source"))
+
+        for path in analytic_files + [target_file]:
+            os.remove(path)
+
+    def test_build_bundle(self):
+        """Test building a bundle of precompiled analytics and loading it without the parser."""
+        analytics_file = os.path.abspath('analytics.tmp.json')
+        bundle_file = os.path.abspath('analytics.tmp.eqlb')
+        save_analytics(build_analytics, analytics_file)
+
+        main(['build', analytics_file, bundle_file])
+        loaded = load_analytics(bundle_file)
+        self.assertEqual(loaded, build_analytics)
+        self.assertEqual([a.render() for a in loaded], [a.render() for a in build_analytics])
+
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = "import sys, eql.loader; eql.loader.load_analytics({!r}); print('tatsu' in sys.modules)"
+        output = subprocess.check_output([sys.executable, '-c', code.format(bundle_file)], cwd=root_dir)
+        self.assertEqual(output.decode('utf-8').strip(), 'False')
+
+        # Newer bundle versions are rejected
+        with open(bundle_file, 'wb') as f:
+            f.write(pack({'format': 'eql-bundle', 'version': 1000, 'analytics': []}))
+        self.assertRaises(ValueError, load_analytics, bundle_file)
+
+        os.remove(analytics_file)
+        os.remove(bundle_file)
+
     @mock.patch('eql.engines.native.PythonEngine.print_event')
     @mock.patch('sys.stdin', new=stdin_patch())
     def test_query_eql_stdin(self, mock_print_event):
@@ -139,3 +213,20 @@ class TestEqlCommand(TestEngine):
         expected = [8]
         actual_event_ids = [args[0][0].data['serial_event_id'] for args in mock_print_event.call_args_list]
         self.assertEqual(expected, actual_event_ids, "Event IDs didn't match expected.")
+
+    @unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires Python 3.7")
+    def test_import_time(self):
+        """Check that the command line utility starts without importing the heavy modules."""
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-X', 'importtime', '-m', 'eql', '--version'],
+                                         stderr=subprocess.STDOUT, cwd=root_dir).decode('utf-8')
+
+        imported = {}
+        for line in output.splitlines():
+            if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+                _, cumulative, name = line[len('import time:'):].split('|')
+                imported[name.strip()] = int(cumulative)
+
+        self.assertIn('eql.main', imported)
+        for module in ('tatsu', 'yaml', 'toml', 'eql.parser', 'eql.engines', 'eql.ast'):
+            self.assertNotIn(module, imported)
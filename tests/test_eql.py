@@ -1,14 +1,21 @@
 """Test case."""
 import datetime
 import os
+import shutil
 import sys
+import tempfile
 import traceback
+import types
 import unittest
 from collections import OrderedDict
 
+import mock
+
 from eql.ast import *  # noqa
+from eql.cache import ParseCache, use_parse_cache
 from eql.engines.base import BaseEngine, TextEngine
 from eql.errors import ParseError, SchemaError
+from eql.fast_parser import fast_parse
 from eql.parser import (
     parse_query, parse_expression, parse_definition, parse_definitions, parse_analytic, get_preprocessor
 )
@@ -253,6 +260,36 @@ class TestEql(unittest.TestCase):
         for query in invalid:
             self.assertRaises(SchemaError, parse_query, query)
 
+    def test_schema_field_types(self):
+        """Test that comparisons to literals of the wrong type for a field are rejected when parsing."""
+        schema = {
+            'event_types': {'process': 1, 'file': 2},
+            'field_types': {'process': {'pid': 'number', 'process_name': 'string', 'opcode': ['start', 'stop']}},
+        }
+        valid = [
+            'process where pid == 4 and process_name == "cmd.exe" and opcode == "START"',
+            'process where pid != null and opcode in ("start", "stop") and opcode == "st*"',
+            'process where 4 < pid and process_name in ("a", "b")',
+            'file where pid == "4"',
+            'sequence [file where pid == "4"] [process where pid == 4]',
+        ]
+        invalid = [
+            'process where pid == "4"',
+            'process where "cmd.exe" == pid',
+            'process where process_name == 4',
+            'process where pid == "*"',
+            'process where opcode == "restart"',
+            'process where opcode in ("start", "restart")',
+            'process where pid in (1, 2, "3")',
+            'sequence [file where pid == "4"] [process where pid == "4"]',
+        ]
+
+        with use_schema(schema):
+            for query in valid:
+                parse_query(query)
+            for query in invalid:
+                self.assertRaises(SchemaError, parse_query, query)
+
     def test_invalid_queries(self):
         """Test that invalid queries throw the proper error."""
         invalid = [
@@ -692,3 +729,247 @@ class TestEql(unittest.TestCase):
 
         query_text = "process where // true"
         self.assertRaises(ParseError, parse_query, query_text)
+
+    def test_parse_cache(self):
+        """Test that parsed queries are cached and invalidated when the inputs change."""
+        query = 'process where process_name == "cmd.exe" and MY_MACRO(pid) | unique pid'
+        preprocessor = get_preprocessor('macro MY_MACRO(x) x > 4')
+        expected = parse_query(query, preprocessor=preprocessor)
+
+        with use_parse_cache() as cache:
+            first = parse_query(query, preprocessor=preprocessor)
+            second = parse_query(query, preprocessor=preprocessor)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(first, expected)
+            self.assertEqual(second, expected)
+
+            # Each hit returns a new copy of the tree
+            self.assertIsNot(first, second)
+            second.first.query.terms.append(Boolean(False))
+            self.assertEqual(parse_query(query, preprocessor=preprocessor), expected)
+
+            # Different flags, definitions and schemas are cached separately
+            parse_query(query, preprocessor=preprocessor, implied_any=True)
+            self.assertEqual(cache.misses, 2)
+
+            preprocessor.add_definitions(parse_definitions('macro MY_MACRO(x) x < 4'))
+            self.assertEqual(parse_query(query, preprocessor=preprocessor).render(),
+                             'process where process_name == "cmd.exe" and pid < 4\n| unique pid')
+            self.assertEqual(cache.misses, 4)
+
+            with use_schema({'event_types': {'process': 1, 'file': 2}}):
+                parse_query(query, preprocessor=preprocessor)
+            self.assertEqual(cache.misses, 5)
+
+            # Registering a function invalidates trees that were parsed with the previous functions
+            from eql import functions
+            info = functions.get_function('length')
+            functions.register_function('length', info)
+            parse_query(query, preprocessor=preprocessor)
+            self.assertEqual(cache.misses, 6)
+
+            # Python macros can't be fingerprinted, so those parses aren't cached
+            preprocessor.add_definition(CustomMacro('CUSTOM', lambda args, walker: Boolean(True)))
+            parse_query(query, preprocessor=preprocessor)
+            parse_query(query, preprocessor=preprocessor)
+            self.assertEqual(cache.misses, 6)
+
+        # The on-disk store is shared across processes
+        directory = tempfile.mkdtemp()
+        try:
+            with use_parse_cache(ParseCache(directory=directory)):
+                parse_query(query)
+            with use_parse_cache(ParseCache(directory=directory)) as cache:
+                self.assertEqual(parse_query(query), parse_query(query))
+                self.assertEqual((cache.hits, cache.misses), (2, 0))
+                cache.clear()
+                self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+        # Errors are still raised every time
+        with use_parse_cache():
+            self.assertRaises(ParseError, parse_query, 'process where')
+            self.assertRaises(ParseError, parse_query, 'process where')
+
+    def test_generated_parser(self):
+        """Test that the parser generated at build time is only used when it matches the grammar."""
+        from eql.etc import get_etc_file
+        from eql.parser import _load_generated_parser
+        grammar = get_etc_file('eql.ebnf')
+
+        stale_module = types.ModuleType('eql.etc.eql_parser')
+        stale_module.GRAMMAR_SHA256 = 'stale'
+        stale_module.TATSU_VERSION = 'stale'
+        with mock.patch.dict(sys.modules, {'eql.etc.eql_parser': stale_module}), \
+                mock.patch('eql.etc.eql_parser', stale_module, create=True):
+            self.assertIsNone(_load_generated_parser(grammar))
+
+        generated = _load_generated_parser(grammar)
+        if generated is None:
+            return
+
+        # The generated parser must build the same trees as the compiled grammar
+        import tatsu
+        import tatsu.semantics
+        from eql.parser import EqlWalker
+
+        compiled = tatsu.compile(grammar, parseinfo=True, semantics=tatsu.semantics.ModelBuilderSemantics())
+        queries = [
+            'process where process_name == "cmd.exe" and not (pid in (1, 2, 3) or length(command_line) > 4)',
+            'sequence by pid [process where true] [file where file_name == "*.exe"] until [file where a]',
+            'join [process where true] by pid [file where true] by pid | unique pid | head 5',
+            'file where descendant of [process where true] | count file_name, pid',
+        ]
+        for query in queries:
+            expected = EqlWalker().walk(compiled.parse(query, rule_name='single_query', parseinfo=True))
+            actual = EqlWalker().walk(generated.parse(query, rule_name='single_query', parseinfo=True))
+            self.assertEqual(actual, expected)
+
+    def test_fast_parser(self):
+        """Test that the fast parser builds the same trees as the full grammar, and leaves errors to the grammar."""
+        import json
+        from eql.parser import EqlWalker, get_tatsu_parser
+        from tests.base import TestEngine
+
+        with open(TestEngine.QUERIES_FILE, 'r') as f:
+            queries = [q['query'] for q in json.load(f)]
+
+        queries.extend([
+            'process where process_name in ("cmd.exe", "net.exe",) and command_line == "* -enc *"',
+            'file where not file_path != "*.exe" and length(file_name) >= 5 or bytes_written < -1.5e3',
+            'network where a.b[0].c == ?"C:\\windows\\" and d == \'x\\ty\' or MACRO(e) and f == CONSTANT',
+            'any where true | unique a b | count a, b, | head 5',
+            '| tail 4',
+            'process_name == "cmd.exe"',
+            'registry where x[+1] == 1',
+            'process where a == ?"b\\"',
+            'process where true.x == 1',
+            'process where x.false == 1',
+            'process where MACRO(1, 2)',
+            'bad where true',
+            'process where x | unknown',
+            'process where x | head 5, 6',
+            'process where a == 1 or',
+            'process where a == /* comment */ 1',
+        ])
+        preprocessor = get_preprocessor("macro MACRO(x) x == 1  const CONSTANT = 5")
+        tatsu_parser = get_tatsu_parser()
+        fast_count = 0
+
+        for text in queries:
+            for start in ('single_query', 'single_expression'):
+                for implied_any, implied_base in ((False, False), (True, True)):
+                    try:
+                        walker = EqlWalker(implied_any=implied_any, implied_base=implied_base,
+                                           preprocessor=preprocessor)
+                        expected = walker.walk(tatsu_parser.parse(text, rule_name=start, start=start, parseinfo=True))
+                    except Exception:
+                        expected = None
+
+                    actual = fast_parse(text, start, preprocessor=preprocessor, implied_any=implied_any,
+                                        implied_base=implied_base)
+                    if actual is not None:
+                        fast_count += 1
+                        self.assertIsNotNone(expected, "Fast parser accepted invalid text {}".format(text))
+                        self.assertEqual(repr(actual), repr(expected))
+
+        self.assertGreater(fast_count, 0)
+
+        # Anything that's unsupported or invalid is left to the full grammar
+        self.assertIsNone(fast_parse('sequence [process where true] [file where true]', 'single_query'))
+        self.assertIsNone(fast_parse('file where descendant of [process where true]', 'single_query'))
+        self.assertIsNone(fast_parse('macro A(x) x', 'single_definition'))
+        self.assertIsNone(fast_parse('process where true | head 1', 'single_query', pipes=False))
+        self.assertRaises(ParseError, parse_query, 'process where a == 1 or')
+        self.assertRaises(SchemaError, parse_query, 'bad where true')
+
+    def test_structural_hash(self):
+        """Test that equivalent syntax trees hash the same, and can be interned into shared nodes."""
+        import pickle
+
+        first = parse_query('process where process_name == "cmd.exe" and (pid == 4 or ppid in (1, 2))')
+        second = parse_query('process where process_name == "cmd.exe" and (pid == 4 or ppid in (1, 2))')
+        other = parse_query('process where process_name == "cmd.exe" and (pid == 4 or ppid in (1, 3))')
+
+        self.assertIsNot(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(len({first, second, other}), 2)
+        self.assertEqual({first: 'a'}[second], 'a')
+
+        # Hashes are only cached for interned nodes, since other nodes may still be edited in place
+        self.assertNotIn('_hash', first.__dict__)
+        a = parse_analytic({'metadata': {'id': 'a'}, 'query': 'process where x == 1'})
+        b = parse_analytic({'metadata': {'id': 'b'}, 'query': 'process where x == 1'})
+        self.assertNotEqual(a, b)
+        a.metadata['id'] = 'b'
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        terms = And([Field('a')])
+        self.assertNotEqual(terms, And([Field('a'), Field('b')]))
+        terms.terms.append(Field('b'))
+        self.assertEqual(terms, And([Field('a'), Field('b')]))
+
+        # Distinct literals aren't merged, even though they compare equal
+        self.assertEqual(Number(1), Number(1.0))
+        table = InternTable()
+        self.assertIsNot(table.intern(Number(1)), table.intern(Number(1.0)))
+
+        table = InternTable()
+        interned = table.intern(first)
+        self.assertIs(interned, first)
+
+        # The cached hash isn't pickled, since string hashes can vary between processes
+        hash(interned)
+        self.assertIn('_hash', interned.__dict__)
+        restored = pickle.loads(pickle.dumps(interned, 2))
+        self.assertNotIn('_hash', restored.__dict__)
+        self.assertEqual(restored, interned)
+        self.assertIs(table.intern(second), interned)
+        self.assertIs(table.intern(first.first.query), interned.first.query)
+
+        interned_other = table.intern(other)
+        self.assertIsNot(interned_other, interned)
+        self.assertIs(interned_other.first.query.terms[0], interned.first.query.terms[0])
+        self.assertNotEqual(interned_other, interned)
+        self.assertEqual(interned_other, other)
+
+        # Flattening boolean terms builds new nodes, so shared subtrees are never modified
+        left = And([Field('a'), Field('b')])
+        combined = left & Field('c') & And([Field('d')])
+        self.assertEqual(left, And([Field('a'), Field('b')]))
+        self.assertEqual(combined, And([Field('a'), Field('b'), Field('c'), Field('d')]))
+        either = Or([Field('a')])
+        self.assertEqual(either | Or([Field('b')]), Or([Field('a'), Field('b')]))
+        self.assertEqual(either, Or([Field('a')]))
+
+    def test_shared_expansion(self):
+        """Test that expansion reuses the subtrees without any macros, and memoizes macro calls."""
+        preprocessor = get_preprocessor("""
+        macro IS_CMD(name) name == "cmd.exe"
+        const MAGIC = 100
+        """)
+        query = parse_query('process where pid == 4 and (IS_CMD(process_name) or IS_CMD(process_name))')
+
+        expanded = preprocessor.expand(query)
+        self.assertEqual(expanded, parse_query('process where pid == 4 and '
+                                               '(process_name == "cmd.exe" or process_name == "cmd.exe")'))
+        self.assertIs(expanded.first.query.terms[0], query.first.query.terms[0])
+        left, right = expanded.first.query.terms[1].terms
+        self.assertIs(left, right)
+
+        # A tree without any macros or constants is returned as-is
+        unchanged = parse_query('process where pid == 4 and ppid in (1, 2) | unique ppid')
+        self.assertIs(preprocessor.expand(unchanged), unchanged)
+        self.assertIsNot(preprocessor.walker.copy(unchanged), unchanged)
+
+        # Calls with equivalent arguments share an expansion, until the definitions change
+        first = preprocessor.expand(parse_expression('IS_CMD(a.b)'))
+        self.assertIs(preprocessor.expand(parse_expression('IS_CMD(a.b)')), first)
+        self.assertIsNot(preprocessor.expand(parse_expression('IS_CMD(a.c)')), first)
+        self.assertEqual(preprocessor.expand(parse_expression('IS_CMD(MAGIC)')), Boolean(False))
+
+        preprocessor.add_definition(parse_definition('const OTHER = 1'))
+        self.assertIsNot(preprocessor.expand(parse_expression('IS_CMD(a.b)')), first)
@@ -1,13 +1,16 @@
 """Test Python Engine for EQL."""
+import os
 import random
 import uuid
 from collections import defaultdict
 
+import mock
+
 from eql.engines.base import Event, AnalyticOutput
 from eql.engines.build import get_reducer, get_engine, get_post_processor
 from eql.engines.native import PythonEngine
 from eql.parser import parse_query, parse_analytic
-from eql.schema import EVENT_TYPE_GENERIC
+from eql.schema import EVENT_TYPE_GENERIC, use_schema
 from .base import TestEngine
 
 
@@ -456,3 +459,801 @@ class TestPythonEngine(TestEngine):
         output = self.get_output(queries=[parse_query(query)], config=config, events=events)
         event_ids = [event.data['unique_pid'] for event in output]
         self.validate_results(event_ids, ['host1-1003'], "Relationships failed due to pid collision")
+
+    def test_merge_pipe_states(self):
+        """Test that partial pipe state from multiple engines can be serialized and combined."""
+        events = [Event.from_data({'event_type': 'process', 'hostname': 'host{}'.format(i % 3),
+                                   'process_name': 'proc{}.exe'.format(i % 4), 'pid': i, 'serial_event_id': i})
+                  for i in range(40)]
+        queries = [
+            'process where true | count',
+            'process where true | count process_name',
+            'process where true | unique_count hostname',
+            'process where true | sort pid | tail 5',
+        ]
+        config = {'flatten': True}
+
+        for query_text in queries:
+            query = parse_query(query_text)
+            expected = self.get_output(queries=[query], events=events, config=config)
+
+            # Map across multiple workers, and ship the partial state instead of results
+            packed_states = []
+            for worker in range(4):
+                worker_engine = PythonEngine(config)
+                worker_engine.add_query(query)
+                worker_engine.stream_events(events[worker::4], finalize=False)
+                packed_states.append(worker_engine.dump_pipe_states())
+
+            # Combine the partial state within an engine
+            results = []
+            engine = PythonEngine(config)
+            engine.add_query(query)
+            engine.add_output_hook(results.append)
+            for packed in packed_states:
+                engine.merge_pipe_states(packed)
+            engine.finalize()
+
+            # Combine the serialized state directly and restore it
+            combined_results = []
+            combined_engine = PythonEngine(config)
+            combined_engine.add_query(query)
+            combined_engine.add_output_hook(combined_results.append)
+            combined_engine.load_pipe_states(PythonEngine.combine_pipe_states(*packed_states))
+            combined_engine.finalize()
+
+            if 'unique_count' in query_text:
+                # The event that represents each key depends on how events were partitioned
+                def summarize(output):
+                    return sorted((e.data['hosts'], e.data['count'], e.data['percent']) for e in output)
+            else:
+                def summarize(output):
+                    return [e.data for e in output]
+
+            self.assertEqual(summarize(results), summarize(expected), query_text)
+            self.assertEqual(summarize(combined_results), summarize(expected), query_text)
+
+        # Keys that were seen by any worker are no longer unique
+        query = parse_query('process where true | unique process_name')
+        packed_states = []
+        for worker in range(2):
+            worker_engine = PythonEngine(config)
+            worker_engine.add_query(query)
+            worker_engine.stream_events(events[worker::2], finalize=False)
+            packed_states.append(worker_engine.dump_pipe_states())
+
+        engine = PythonEngine(config)
+        engine.add_query(query)
+        for packed in packed_states:
+            engine.merge_pipe_states(packed)
+        self.assertEqual(self.get_output(queries=[query], events=events, config=config)[0].data, events[0].data)
+
+        results = []
+        engine.add_output_hook(results.append)
+        engine.stream_events(events)
+        self.assertEqual(results, [])
+
+        # State must line up with the same queries
+        engine = PythonEngine()
+        engine.add_query(parse_query('process where true | count'))
+        self.assertRaises(ValueError, engine.merge_pipe_states, packed_states[0])
+
+    def test_snapshot_restore(self):
+        """Test that the state of stateful operators is checkpointed and restored."""
+        events = []
+        for i in range(60):
+            pid = 100 + i // 3
+            events.append(Event.from_data({'event_type': 'process', 'subtype': 'create', 'pid': pid, 'ppid': pid - 1,
+                                           'process_name': 'proc{}.exe'.format(i % 5), 'serial_event_id': len(events),
+                                           'timestamp': len(events)}))
+            events.append(Event.from_data({'event_type': 'file', 'pid': pid, 'file_name': 'file{}.txt'.format(i % 7),
+                                           'serial_event_id': len(events), 'timestamp': len(events)}))
+
+        analytics = [parse_analytic({'query': query, 'metadata': {'id': 'analytic-{}'.format(i)}}) for i, query in
+                     enumerate([
+                         'sequence by pid [process where process_name == "proc1.exe"] [file where true]',
+                         'join by pid [file where file_name == "file3.txt"] [process where true]',
+                         'file where descendant of [process where process_name == "proc2.exe"]',
+                         'file where true | count file_name',
+                         'process where true | unique_count process_name | tail 2',
+                     ])]
+
+        def get_engine():
+            engine = PythonEngine({'flatten': True})
+            engine.add_analytics(analytics)
+            output = []
+            engine.add_output_hook(output.append)
+            return engine, output
+
+        expected_engine, expected = get_engine()
+        expected_engine.stream_events(events)
+
+        snapshot_file = 'snapshot.tmp.bin'
+        first_engine, first_output = get_engine()
+        first_engine.stream_events(events[:50], finalize=False)
+        first_engine.snapshot(snapshot_file)
+        full_size = os.path.getsize(snapshot_file)
+
+        # Only analytics that received events since the previous snapshot are written again
+        first_engine.snapshot(snapshot_file)
+        self.assertLess(os.path.getsize(snapshot_file) - full_size, full_size // 2)
+
+        first_engine.stream_events(events[50:90], finalize=False)
+        first_engine.snapshot(snapshot_file)
+
+        # Resume in a new engine, after a restart
+        resumed_engine, resumed_output = get_engine()
+        resumed_engine.restore(snapshot_file)
+        resumed_engine.stream_events(events[90:])
+
+        self.assertGreater(len(expected), 0)
+        self.assertEqual([e.data for e in first_output + resumed_output], [e.data for e in expected])
+
+        # State for an analytic that changed is skipped
+        changed = parse_analytic({'query': 'file where true | count pid', 'metadata': {'id': 'analytic-3'}})
+        changed_engine = PythonEngine({'flatten': True})
+        changed_engine.add_analytic(changed)
+        changed_output = []
+        changed_engine.add_output_hook(changed_output.append)
+        changed_engine.restore(snapshot_file)
+        changed_engine.finalize()
+        self.assertEqual(changed_output, [])
+        os.remove(snapshot_file)
+
+    def test_reorder_predicates(self):
+        """Test that boolean terms are ordered by cost and selectivity, without changing the results."""
+        from eql.ast import Field
+        from eql.optimizer import FieldStatistics, order_terms, reorder_predicates
+        from eql.parser import parse_expression
+
+        node = parse_expression('wildcard(command_line, "*foo*") and descendant of [process where true] and '
+                                'process_name in ("a", "b") and pid == 4')
+        self.assertEqual([term.render() for term in order_terms(node)],
+                         ['pid == 4', 'process_name in ("a", "b")', 'command_line == "*foo*"',
+                          'descendant of [process where true]'])
+
+        # Functions that may raise errors are never moved, and terms aren't moved around them
+        node = parse_expression('match(a, ".*") and pid == 4 and custom(a) and b == 1 and length(c) > 1')
+        self.assertEqual([term.render() for term in order_terms(node)],
+                         ['pid == 4', 'match(a, ".*")', 'custom(a)', 'b == 1', 'length(c) > 1'])
+
+        # Statistics put the term most likely to short-circuit first
+        statistics = FieldStatistics()
+        statistics.add_events([{'a': 'common', 'b': 'common' if i % 10 else 'rare'} for i in range(100)])
+        node = parse_expression('a == "COMMON" and b == "rare"')
+        self.assertEqual(statistics.get_frequency(Field('a'), 'Common'), 1.0)
+        self.assertEqual(statistics.get_frequency(Field('b'), 'rare'), 0.1)
+        self.assertEqual([term.render() for term in order_terms(node, statistics)], ['b == "rare"', 'a == "COMMON"'])
+        node = parse_expression('a == "rare" or b == "rare" or a == "common"')
+        self.assertEqual([term.render() for term in order_terms(node, statistics)],
+                         ['a == "common"', 'b == "rare"', 'a == "rare"'])
+
+        unchanged = parse_expression('a == 1 and b == 2')
+        self.assertIs(reorder_predicates(unchanged), unchanged)
+        self.assertEqual(reorder_predicates(parse_query('process where match(a, "b") and (c == 1 or d)')),
+                         parse_query('process where (d or c == 1) and match(a, "b")'))
+
+        events = [Event.from_data({'event_type': 'process', 'process_name': 'proc{}.exe'.format(i % 5), 'pid': i,
+                                   'command_line': 'run {}'.format(i % 7), 'unique_pid': i, 'serial_event_id': i})
+                  for i in range(100)]
+        queries = [
+            'process where wildcard(command_line, "*3") and process_name == "proc1.exe"',
+            'process where match(command_line, ".*[45]") or pid in (1, 2, 3) or process_name == "proc2.exe"',
+            'process where not (command_line == "run 1" and pid < 50) and stringContains(process_name, "3")',
+        ]
+
+        def get_output(config):
+            output = []
+            engine = PythonEngine(dict(config, flatten=True))
+            engine.add_output_hook(output.append)
+            engine.add_queries([parse_query(query) for query in queries])
+            engine.stream_events(events)
+            return output
+
+        expected = get_output({})
+        self.assertGreater(len(expected), 0)
+        self.assertListEqual(get_output({'reorder_predicates': True}), expected)
+
+        statistics = FieldStatistics()
+        statistics.add_events(events[:20])
+        self.assertListEqual(get_output({'reorder_predicates': True, 'field_statistics': statistics}), expected)
+
+    def test_adaptive_predicates(self):
+        """Test that terms are reordered at runtime by their observed cost and pass rates."""
+        events = [Event.from_data({'event_type': 'process', 'pid': i, 'command_line': 'abc' * (i % 50),
+                                   'unique_pid': i, 'serial_event_id': i})
+                  for i in range(2000)]
+        queries = [
+            'process where match(command_line, "(a|b|c)*") and pid == 4',
+            'process where stringContains(command_line, "x") or pid in (1, 2, 3) or command_line == "abcabc"',
+            'process where stringContains(command_line, "abc") and length(command_line) < 9 and pid > 5 and pid < 9',
+        ]
+
+        def get_engine(config):
+            output = []
+            engine = PythonEngine(dict(config, flatten=True))
+            engine.add_output_hook(output.append)
+            engine.add_queries([parse_query(query) for query in queries])
+            engine.stream_events(events)
+            return engine, output
+
+        _, expected = get_engine({})
+        engine, output = get_engine({'adaptive_predicates': True, 'adaptive_sample_rate': 4, 'adaptive_interval': 8})
+        self.assertGreater(len(expected), 0)
+        self.assertListEqual(output, expected)
+
+        stats = engine.get_predicate_stats()
+        self.assertEqual(list(stats), ['query-0', 'query-1', 'query-2'])
+
+        first = stats['query-0'][0]
+        self.assertEqual(first['order'], ['pid == 4', 'match(command_line, "(a|b|c)*")'])
+        self.assertEqual(first['evaluations'], len(events))
+        self.assertEqual(first['samples'], len(events) // 4)
+        self.assertGreater(first['reorders'], 0)
+
+        second = stats['query-1'][0]
+        self.assertEqual(second['order'][-1], 'stringContains(command_line, "x")')
+
+        # The length function may raise errors, so terms are never moved around it
+        third = stats['query-2'][0]
+        self.assertEqual(third['order'][1], 'length(command_line) < 9')
+        self.assertEqual(third['order'][2:], ['pid < 9', 'pid > 5'])
+
+    def test_wildcard_matchers(self):
+        """Test that the specialized wildcard matchers match the same strings as the equivalent regular expression."""
+        import re
+        from eql.matchers import compile_wildcard, match_wildcard
+
+        rng = random.Random(1234)
+        patterns = ['abc', '', '*', '**', 'a*', '*C', '*b*', 'a*c', 'a*b*c', '*a*b*', 'ab*ba', '*a**b', 'a*a*a',
+                    'C:\\windows\\*\\*.EXE', '*.dll*']
+        strings = [''.join(rng.choice('abcAB.') for _ in range(rng.randint(0, 8))) for _ in range(300)]
+        strings.extend(['c:\\Windows\\System32\\cmd.exe', 'c:\\windows\\cmd.exe', 'x.DLL', 'aba'])
+
+        for count in (1, 2, 3):
+            for _ in range(40):
+                selected = rng.sample(patterns, count)
+                regex = re.compile('|'.join('^{}$'.format('.*?'.join(re.escape(s) for s in p.split('*')))
+                                            for p in selected), re.IGNORECASE)
+                matcher = compile_wildcard(selected)
+                for text in strings:
+                    self.assertEqual(matcher(text), regex.match(text) is not None, (selected, text))
+
+        self.assertFalse(match_wildcard(None, '*'))
+        self.assertFalse(match_wildcard(123, '*'))
+
+        # A * also matches newlines, which the old .*? regular expression stopped at
+        self.assertIsNone(re.match('^a.*?b$', 'A\nB', re.IGNORECASE))
+        self.assertTrue(match_wildcard('A\nB', 'a*b'))
+        self.assertTrue(compile_wildcard(['*cmd*'])('echo\r\ncmd.exe'))
+        self.assertFalse(match_wildcard('A\nB', 'a*c'))
+
+        # Patterns that make a backtracking regular expression take exponential time are still linear
+        text = 'a' * 20000
+        self.assertFalse(match_wildcard(text, '*a*a*a*a*a*a*a*a*b'))
+        self.assertTrue(match_wildcard(text + 'b', '*a*a*a*a*a*a*a*a*b'))
+
+        # Wildcards are optimized at parse time, and through the engine with a non-string field
+        self.assertEqual(parse_query('process where "C:\\\\Windows\\\\cmd.exe" == "c:\\\\*\\\\CMD.*"'),
+                         parse_query('process where true'))
+        output = []
+        engine = PythonEngine({'flatten': True})
+        engine.add_output_hook(output.append)
+        engine.add_queries([parse_query('process where wildcard(command_line, "*-enc*", "powershell*")'),
+                            parse_query('process where pid == "*"')])
+        engine.stream_events([Event.from_data({'event_type': 'process', 'command_line': line, 'pid': pid,
+                                               'unique_pid': pid, 'serial_event_id': pid})
+                              for pid, line in enumerate(['powershell.exe', 'cmd /c x -ENC y', 'cmd'])])
+        self.assertEqual([event.data['pid'] for event in output], [0, 1])
+
+    def test_shared_patterns(self):
+        """Test that patterns for the same field are shared across analytics, and each value is scanned once."""
+        from eql.matchers import AhoCorasick, PatternSet
+
+        automaton = AhoCorasick([('he', 'he'), ('she', 'she'), ('his', 'his'), ('hers', 'hers'), ('empty', '')])
+        self.assertEqual(automaton.search('ushers'), {'he', 'she', 'hers', 'empty'})
+        self.assertEqual(automaton.search('ahishe'), {'his', 'she', 'he', 'empty'})
+
+        patterns = PatternSet()
+        ids = [patterns.add_wildcard(p) for p in ['cmd.exe', 'C:\\\\*', '*.EXE', '*-enc*', 'a*b*c', '*.exe']]
+        self.assertEqual(ids, [0, 1, 2, 3, 4, 2])
+        self.assertEqual(patterns.add(PatternSet.SUBSTRING, '-ENC'), 3)
+        self.assertEqual(len(patterns), 5)
+        self.assertEqual(patterns.match('C:\\\\x -Enc.exe'), {1, 2, 3})
+        self.assertEqual(patterns.match('CMD.exe'), {0, 2})
+        self.assertEqual(patterns.match('abxc'), {4})
+        self.assertEqual(patterns.match(None), set())
+
+        events = [Event.from_data({'event_type': 'process', 'pid': i, 'unique_pid': i, 'serial_event_id': i,
+                                   'process_name': ['cmd.exe', 'powershell.exe', 'net.exe', None, 5][i % 5],
+                                   'command_line': ['x -enc y', 'C:\\\\a\\\\b', 'net user /add', 'abc', ''][i % 5]})
+                  for i in range(50)]
+        queries = [
+            'process where process_name == "*.exe" and command_line == "*-ENC*"',
+            'process where startsWith(command_line, "c:\\\\\\\\") or endsWith(process_name, "NET.EXE")',
+            'process where stringContains(command_line, "user") and wildcard(process_name, "net*", "cmd.exe")',
+            'process where wildcard(command_line, "a*c", "*b") and not stringContains(process_name, "power")',
+        ]
+
+        def get_output(config):
+            output = []
+            engine = PythonEngine(dict(config, flatten=True))
+            engine.add_output_hook(output.append)
+            engine.add_queries([parse_query(query) for query in queries])
+            engine.stream_events(events)
+            return engine, output
+
+        _, expected = get_output({})
+        engine, output = get_output({'shared_patterns': True})
+        self.assertGreater(len(expected), 0)
+        self.assertListEqual(output, expected)
+        self.assertEqual(sorted(engine._pattern_sets), ['command_line', 'process_name'])
+        self.assertEqual(len(engine._pattern_sets['command_line']), 5)
+
+    def test_regex_functions(self):
+        """Test that literal regular expressions are compiled once, combined and checked for nested quantifiers."""
+        import warnings
+        from eql.matchers import combine_regexes, has_nested_quantifiers
+
+        self.assertTrue(has_nested_quantifiers('(a+)+$'))
+        self.assertTrue(has_nested_quantifiers('([a-z]+\\.)*com'))
+        self.assertFalse(has_nested_quantifiers('a+b*(cd)+'))
+        self.assertEqual(combine_regexes(['a.*', 'b\\d']), '(?:a.*)|(?:b\\d)')
+        self.assertIsNone(combine_regexes(['(a)\\1', 'b']))
+        self.assertIsNone(combine_regexes(['(?i)a', 'b']))
+        self.assertIsNone(combine_regexes(['(?P<x>a)', 'b']))
+
+        events = [Event.from_data({'event_type': 'process', 'pid': i, 'unique_pid': i, 'serial_event_id': i,
+                                   'process_name': ['CMD.exe', 'net.exe', 'powershell.exe', None, 5][i % 5]})
+                  for i in range(20)]
+        queries = [
+            'process where match("cmd\\\\.", process_name) or matchLite("NET", process_name) or pid == 4',
+            'process where match("(a)\\\\1", process_name) or match("power", process_name)',
+            'process where matchLite(".*exe$", process_name) and pid < 10',
+        ]
+        output = []
+        engine = PythonEngine({'flatten': True})
+        engine.add_output_hook(output.append)
+        engine.add_queries([parse_query(query) for query in queries])
+
+        with mock.patch('re.match') as re_match:
+            engine.stream_events(events)
+            re_match.assert_not_called()
+
+        pids = [event.data['pid'] for event in output]
+        self.assertEqual(sorted(pids), sorted([0, 1, 4, 5, 6, 10, 11, 15, 16] + [2, 7, 12, 17] + [0, 1, 2, 5, 6, 7]))
+        self.assertEqual(engine.unsafe_patterns, [])
+
+        terms = parse_query(queries[0]).first.query.terms
+        self.assertEqual([term.render() for term in engine._merge_regex_terms(terms)],
+                         ['match("(?:cmd\\\\.)|(?:NET)", process_name)', 'pid == 4'])
+
+        unsafe = parse_query('process where match("(\\\\w+\\\\s?)+$", process_name)')
+        engine = PythonEngine({'unsafe_regex': 'warn'})
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            engine.add_query(unsafe)
+        self.assertEqual(engine.unsafe_patterns, [('query-0', '(\\w+\\s?)+$')])
+        self.assertEqual(len(caught), 1)
+        self.assertRaises(ValueError, PythonEngine({'unsafe_regex': 'error'}).add_query, unsafe)
+
+    def test_function_metadata(self):
+        """Test that pure functions are folded, deterministic functions memoized and batch functions batched."""
+        from eql import functions
+        from eql.ast import FunctionCall, Number
+        from eql.parser import parse_expression
+
+        # Only wildcard and length are folded when parsing, so functions can be overridden by each engine
+        self.assertEqual(parse_expression('length("abc")'), Number(3))
+        self.assertIsInstance(parse_expression('concat("a", 1, "b")'), FunctionCall)
+
+        events = [Event.from_data({'event_type': 'process', 'pid': 1})]
+        query = parse_query('process where concat("a", 1, "b") == "a1b" and add(1, multiply(2, 3)) == 7')
+        self.assertEqual(len(self.get_output(queries=[query], events=events)), 1)
+        query = parse_query('process where concat("a", "b") == "X"')
+        config = {'functions': {'concat': lambda *args: 'X'}}
+        self.assertEqual(len(self.get_output(queries=[query], events=events, config=config)), 1)
+
+        folded = []
+        version = functions.get_registry_version()
+        try:
+            functions.register_function('double', lambda x: folded.append(x) or x * 2, pure=True)
+            self.assertGreater(functions.get_registry_version(), version)
+            query = parse_query('process where double(4) == 8 and double(divide(1, 0)) != 0')
+            output = self.get_output(queries=[query], events=events * 3)
+            self.assertEqual(len(output), 3)
+            # The call with literal arguments is evaluated once, when the query is loaded
+            self.assertEqual(folded.count(4), 1)
+        finally:
+            functions._functions.pop('double')
+
+        calls = []
+
+        def lookup(value):
+            calls.append(value)
+            return (value or '').upper()
+
+        def enrich(arguments):
+            calls.append(len(arguments))
+            return [pid * 10 for pid, in arguments]
+
+        events = [Event.from_data({'event_type': 'process', 'pid': i, 'unique_pid': i, 'serial_event_id': i,
+                                   'process_name': ['cmd.exe', 'net.exe'][i % 2]})
+                  for i in range(10)]
+        output = []
+        engine = PythonEngine({'flatten': True, 'batch_size': 4})
+        engine.add_custom_function('lookup', lookup, deterministic=True)
+        engine.add_custom_function('enrich', enrich, batch=True)
+        engine.add_output_hook(output.append)
+        engine.add_query(parse_query('process where lookup(process_name) == "CMD.EXE" and enrich(pid) > 40'))
+        engine.stream_events(events)
+
+        self.assertEqual([event.data['pid'] for event in output], [6, 8])
+        # Batches are evaluated on first use for the rest of the events in the batch
+        self.assertEqual(calls, ['cmd.exe', 4, 'net.exe', 4, 2])
+
+        # Also when events are replaced as they're ingested
+        events = [event._replace(data=dict(event.data, timestamp=1559392215 + i)) for i, event in enumerate(events)]
+        for config in ({'time_format': 'epoch_s'}, {'flatten_paths': True}):
+            del calls[:]
+            output = []
+            engine = PythonEngine(dict(config, flatten=True, batch_size=4))
+            engine.add_custom_function('enrich', enrich, batch=True)
+            engine.add_output_hook(output.append)
+            engine.add_query(parse_query('process where enrich(pid) > 40'))
+            engine.stream_events(events)
+            self.assertEqual([event.data['pid'] for event in output], [5, 6, 7, 8, 9], config)
+            self.assertEqual(calls, [4, 4, 2], config)
+
+    def test_field_types(self):
+        """Test comparisons that are specialized for the field types in the schema."""
+        schema = {
+            'event_types': {'process': 1},
+            'field_types': {
+                'process': {'pid': 'number', 'parent_pid': 'number', 'process_name': 'string',
+                            'opcode': ['start', 'stop', 'restart']},
+            },
+        }
+        events = [Event.from_data({'event_type': 'process', 'serial_event_id': i, 'parent_pid': i - 1,
+                                   'pid': str(i) if i % 4 == 0 else i,
+                                   'process_name': ['CMD.exe', 'net.exe', 7][i % 3],
+                                   'opcode': ['Start', 'STOP', 'start', None][i % 4]})
+                  for i in range(12)]
+        queries = [
+            'process where pid >= 6 and process_name == "cmd.exe"',
+            'process where opcode in ("start", "restart")',
+            'process where opcode != "stop" and parent_pid < pid',
+            'process where 5 > pid',
+        ]
+        expected = [[6, 9], [0, 2, 4, 6, 8, 10], [2, 3, 6, 7, 10, 11], [1, 2, 3]]
+
+        with use_schema(schema):
+            for query, expected_ids in zip(queries, expected):
+                output = []
+                engine = PythonEngine({'schema': schema, 'flatten': True})
+                engine.add_output_hook(lambda event: output.append(event.data['serial_event_id']))
+                engine.add_query(parse_query(query))
+                engine.stream_events(events)
+                self.assertEqual(output, expected_ids, query)
+
+        # Events that don't follow the schema get the same results as without field types
+        events = [Event.from_data({'event_type': 'process', 'serial_event_id': 0}),
+                  Event.from_data({'event_type': 'process', 'serial_event_id': 1, 'pid': 'A', 'parent_pid': 'a'}),
+                  Event.from_data({'event_type': 'process', 'serial_event_id': 2, 'pid': 'b', 'parent_pid': 'a'}),
+                  Event.from_data({'event_type': 'process', 'serial_event_id': 3, 'pid': 3, 'parent_pid': 3}),
+                  Event.from_data({'event_type': 'process', 'serial_event_id': 4, 'pid': 4, 'parent_pid': 3})]
+
+        for query in ['process where pid == parent_pid', 'process where pid != parent_pid']:
+            outputs = []
+            for config in ({'schema': schema, 'flatten': True}, {'flatten': True}):
+                output = []
+                engine = PythonEngine(config)
+                engine.add_output_hook(lambda event: output.append(event.data['serial_event_id']))
+                with use_schema(config.get('schema')):
+                    engine.add_query(parse_query(query))
+                engine.stream_events(events)
+                outputs.append(output)
+            self.assertEqual(outputs[0], outputs[1], query)
+        self.assertEqual(outputs[0], [2, 4])
+
+    def test_compact_events(self):
+        """Test that retained events are stored as compact records without changing the results."""
+        from eql.engines.records import CompactData, RecordLayout
+
+        layout = RecordLayout(['pid'])
+        record = layout.compact({'pid': 4, 'process_name': 'cmd.exe', 'parent': {'pid': 1}})
+        other = layout.compact({'command_line': 'cmd /c'})
+        self.assertEqual(layout.keys, ['pid', 'process_name', 'parent', 'command_line'])
+        self.assertEqual(record, {'pid': 4, 'process_name': 'cmd.exe', 'parent': {'pid': 1}})
+        self.assertIsInstance(record['parent'], CompactData)
+        self.assertEqual(len(record.values), 3)
+        self.assertNotIn('command_line', record)
+        self.assertEqual(other.get('pid', 'missing'), 'missing')
+        self.assertEqual(dict(other), {'command_line': 'cmd /c'})
+
+        config = {'flatten': True, 'data_source': 'endgame', 'compact_events': True}
+        for query_check in self.get_example_queries():
+            output = self.get_output(queries=[query_check['analytic'].query], config=config)
+            actual_ids = [event.data['serial_event_id'] for event in output]
+            self.validate_results(actual_ids, query_check['expected_event_ids'], query_check['query'])
+            self.assertFalse(any(isinstance(event.data, CompactData) for event in output))
+
+        engine = PythonEngine({'compact_events': True})
+        engine.add_query(parse_query('sequence by pid [process where true] [file where true]'))
+        engine.stream_events([Event.from_data({'event_type': 'process', 'pid': 4, 'parent': {'pid': 1}})])
+        (lookups, ), = [state['lookups'][1].values() for _, state in engine._states.values()]
+        self.assertIsInstance(lookups[0].data, CompactData)
+
+    def test_intern_fields(self):
+        """Test that repeated strings are deduplicated as events are ingested."""
+        def copy(text):
+            return ''.join(list(text))
+
+        events = [Event.from_data({'event_type': 'process', 'pid': i, 'hostname': copy('host-1'), 'user': copy('root'),
+                                   'parent': {'process_name': copy('cmd.exe')}, 'args': [copy('-c'), i]})
+                  for i in range(10)]
+        engine = PythonEngine({'intern_fields': ['hostname', 'parent.process_name', 'args', 'missing.field'],
+                               'intern_table_size': 2})
+        engine.add_query(parse_query('sequence by hostname [process where true] [file where true]'))
+        engine.stream_events(events, finalize=False)
+
+        self.assertTrue(all(event.data['hostname'] is events[0].data['hostname'] for event in events))
+        self.assertTrue(all(event.data['parent']['process_name'] is events[0].data['parent']['process_name']
+                            for event in events))
+        self.assertFalse(any(event.data['args'][0] is events[0].data['args'][0] for event in events[1:]))
+        self.assertFalse(any(event.data['user'] is events[0].data['user'] for event in events[1:]))
+
+        stats = engine.get_intern_stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses'], stats['overflow']), (2, 18, 12, 10))
+        self.assertGreater(stats['bytes_saved'], 0)
+        self.assertIsNone(PythonEngine().get_intern_stats())
+
+    def test_retained_fields(self):
+        """Test that retained events only keep the fields for pipes and outputs, and are restored from a store."""
+        events = [Event.from_data({'event_type': ['process', 'file'][i % 2], 'serial_event_id': i, 'pid': i // 4,
+                                   'process_name': 'proc-{}.exe'.format(i), 'command_line': 'x' * 100})
+                  for i in range(12)]
+        query = parse_query('sequence by pid [process where true] [file where true] | unique events[1].process_name')
+
+        engine = PythonEngine({'output_fields': ['serial_event_id']})
+        self.assertEqual(engine._get_retained_fields(query), ('process_name', 'serial_event_id'))
+        self.assertIsNone(PythonEngine()._get_retained_fields(query))
+
+        output = []
+        engine.add_output_hook(output.append)
+        engine.add_query(query)
+        engine.stream_events(events[:3], finalize=False)
+        (retained, ), = [state['lookups'][1].values() for kind, state in engine._states.values() if kind == 'sequence']
+        self.assertEqual(retained[0].data, {'serial_event_id': 2, 'process_name': 'proc-2.exe'})
+
+        store = {event.data['serial_event_id']: event.data for event in events}
+        expected = self.get_output(queries=[query], events=events)
+        self.assertEqual(len(expected), 6)
+        for config in ({'event_store': store}, {'event_store': store.get, 'compact_events': True}):
+            output = self.get_output(queries=[query], events=events, config=config)
+            self.assertEqual([[event.data for event in result.events] for result in output],
+                             [[event.data for event in result.events] for result in expected])
+
+        # Fields that pipes remove aren't restored, and only events that were projected are restored
+        events = [event._replace(data=dict(event.data, hostname='host-{}'.format(i % 3)))
+                  for i, event in enumerate(events)]
+        store = {event.data['serial_event_id']: event.data for event in events}
+        for query in ['process where true | unique_count process_name, hostname',
+                      'sequence by pid [process where true] [file where true] | count hostname',
+                      'sequence by pid [process where true] [file where true] | unique_count pid | tail 2']:
+            query = parse_query(query)
+            expected = self.get_output(queries=[query], events=events, config={'flatten': True})
+            for config in ({'event_store': store}, {'event_store': store, 'compact_events': True}):
+                config.update(flatten=True, output_fields=['serial_event_id'])
+                output = self.get_output(queries=[query], events=events, config=config)
+                self.assertEqual([event.data for event in output], [event.data for event in expected], query)
+
+    def test_flatten_paths(self):
+        """Test that nested fields are looked up in an index of paths that's built when events are ingested."""
+        from eql.engines.records import FlatData
+
+        data = FlatData({'process': {'parent': {'name': 'cmd.exe'}, 'args': ['a', {'b': 1}, 'c']}}, max_items=2)
+        self.assertEqual(data.paths[('process', 'parent', 'name')], 'cmd.exe')
+        self.assertEqual(data.paths[('process', 'args', 1, 'b')], 1)
+        self.assertNotIn(('process', 'args', 2), data.paths)
+
+        events = [Event.from_data({'event_type': 'process', 'serial_event_id': i,
+                                   'process': {'parent': {'name': ['cmd.exe', 'net.exe'][i % 2]},
+                                               'args': ['x'] * (i % 4), 'pid': i}})
+                  for i in range(8)]
+        queries = [
+            'process where process.parent.name == "net.exe" and process.args[2] == "x"',
+            'process where process.args[1] == "x" and process.missing.name == null',
+            'sequence [process where process.pid == 1] [process where true] | filter events[1].process.pid == 2',
+        ]
+        config = {'flatten': True, 'flatten_paths': True, 'flatten_max_items': 2}
+        for query, expected in zip(queries, [[3, 7], [2, 3, 6, 7], [1, 2]]):
+            output = self.get_output(queries=[parse_query(query)], events=events, config=config)
+            self.assertEqual([event.data['serial_event_id'] for event in output], expected, query)
+
+        config = {'flatten': True, 'data_source': 'endgame', 'flatten_paths': True}
+        for query_check in self.get_example_queries():
+            output = self.get_output(queries=[query_check['analytic'].query], config=config)
+            actual_ids = [event.data['serial_event_id'] for event in output]
+            self.validate_results(actual_ids, query_check['expected_event_ids'], query_check['query'])
+
+    def test_time_format(self):
+        """Test that timestamps in different formats are converted to the time unit of the engine."""
+        from eql.engines.timestamps import TimestampParser
+
+        expected = 132038658152500000
+        parser = TimestampParser()
+        for value in ['2019-06-01T12:30:15.25Z', '2019-06-01 13:30:15.250+01:00', '2019-06-01T08:30:15.25-0400',
+                      1559392215.25, 1559392215250, 1559392215250000, expected]:
+            self.assertEqual(parser.parse(value), expected, value)
+        self.assertEqual((parser.hits, parser.misses), (0, 3))
+        self.assertEqual(parser.parse('2019-06-01T12:30:59Z'), expected + 437500000)
+        self.assertEqual(parser.hits, 1)
+        self.assertEqual(TimestampParser('epoch_ns', time_unit=1000).parse('1559392215250000000'),
+                         (expected + 5) // 10000)
+        self.assertEqual(TimestampParser('epoch_s').parse(0), TimestampParser().parse('1970-01-01'))
+        self.assertRaises(ValueError, parser.parse, '2019-06-01T12:3')
+        self.assertRaises(ValueError, parser.parse, '2019-06-01T12:30:15 UTC')
+        self.assertRaises(ValueError, TimestampParser, 'unix')
+
+        # Numbers within strings are detected by magnitude, and dates may have a timezone without a time
+        self.assertEqual(parser.parse('1559392215.25'), expected)
+        self.assertEqual(parser.parse('1559392215250'), expected)
+        self.assertEqual(parser.parse('2019-06-01Z'), parser.parse('2019-06-01'))
+        self.assertEqual(parser.parse('2019-06-02+01:00'), parser.parse('2019-06-01T23:00Z'))
+        self.assertRaises(ValueError, TimestampParser('iso8601').parse, 1559392215)
+        self.assertRaises(ValueError, TimestampParser('iso8601').parse, '1559392215')
+
+        # Events from different sources can be sequenced together
+        events = [
+            Event.from_data({'event_type': 'process', 'pid': 1, 'serial_event_id': 1, '@timestamp': 1559392215000}),
+            Event.from_data({'event_type': 'file', 'pid': 1, 'serial_event_id': 2, 'ts': '2019-06-01T12:30:16Z'}),
+            Event.from_data({'event_type': 'process', 'pid': 2, 'serial_event_id': 3, 'ts': '2019-06-01T12:30:16Z'}),
+            Event.from_data({'event_type': 'file', 'pid': 2, 'serial_event_id': 4, '@timestamp': 1559392225000}),
+        ]
+        query = parse_query('sequence by pid with maxspan=5s [process where true] [file where true]')
+        config = {'flatten': True, 'time_format': 'auto', 'time_fields': ['@timestamp', 'ts']}
+        output = self.get_output(queries=[query], events=events, config=config)
+        self.assertEqual([event.data['serial_event_id'] for event in output], [1, 2])
+
+    def test_fused_dispatch(self):
+        """Test that the callbacks for each event type are fused into a single function."""
+        from eql.engines.native import fuse_callbacks
+
+        calls = []
+        fused = fuse_callbacks([lambda event: calls.append(1), lambda event: calls.append(event)])
+        fused('x')
+        self.assertEqual(calls, [1, 'x'])
+
+        events = [Event.from_data({'event_type': ''.join(['proc', 'ess']), 'pid': 1}),
+                  Event.from_data({'event_type': ''.join(['proc', 'ess']), 'pid': 2})]
+        self.assertIs(events[0].type, events[1].type)
+
+        output = []
+        engine = PythonEngine({'flatten': True})
+        engine.add_output_hook(output.append)
+        engine.add_query(parse_query('process where pid == 1'))
+        engine.stream_events(events[:1], finalize=False)
+        dispatch = engine._dispatchers['process']
+        engine.stream_events(events[1:], finalize=False)
+        self.assertIs(engine._dispatchers['process'], dispatch)
+        engine.stream_event(Event.from_data({'event_type': 'file', 'pid': 1}))
+        self.assertNotIn('file', engine._event_hooks)
+
+        engine.add_query(parse_query('any where pid == 2'))
+        self.assertEqual(engine._dispatchers, {})
+        engine.stream_events(events, finalize=False)
+        self.assertEqual([event.data['pid'] for event in output], [1, 1, 2])
+
+    def test_reused_scope(self):
+        """Test that scopes are reused for each event, and the garbage collector is tuned while streaming."""
+        import gc
+        from eql.engines.native import Scope, fuse_tuple
+
+        # Freezing is permanent for the whole process, so release the objects for the rest of the tests
+        if hasattr(gc, 'unfreeze'):
+            self.addCleanup(gc.unfreeze)
+
+        self.assertEqual(fuse_tuple([len, str])('abc'), (3, 'abc'))
+
+        scope = Scope([None], [1])
+        self.assertRaises(ZeroDivisionError, scope.call, lambda s: 1 / 0, 2, 3)
+        self.assertEqual(scope.variables, [1])
+
+        events = [Event.from_data({'event_type': 'process', 'pid': i, 'ppid': i % 3, 'args': ['a', 'b', str(i)]})
+                  for i in range(10)]
+        queries = [
+            'process where arraySearch(args, x, x == "5") and ppid == 2',
+            'process where pid == 1 or ppid == 1 or arrayContains(args, "3")',
+            'process where true | unique ppid, modulo(pid, 2)',
+        ]
+        thresholds = gc.get_threshold()
+        output = self.get_output(queries=[parse_query(query) for query in queries], events=events,
+                                 config={'flatten': True, 'gc_freeze': True, 'gc_thresholds': (10000, 20, 20)})
+        self.assertEqual(gc.get_threshold(), thresholds)
+        self.assertEqual(sorted(event.data['pid'] for event in output), [0, 1, 1, 2, 3, 3, 4, 4, 5, 5, 7])
+
+    def test_replace_analytic(self):
+        """Test that analytics are removed and replaced while streaming, without losing the state of the others."""
+        events = []
+        for i in range(60):
+            pid = 100 + i // 3
+            events.append(Event.from_data({'event_type': 'process', 'subtype': 'create', 'pid': pid, 'ppid': pid - 1,
+                                           'process_name': 'proc{}.exe'.format(i % 5), 'serial_event_id': len(events),
+                                           'timestamp': len(events)}))
+            events.append(Event.from_data({'event_type': 'file', 'pid': pid, 'file_name': 'file{}.txt'.format(i % 7),
+                                           'serial_event_id': len(events), 'timestamp': len(events)}))
+
+        def get_analytic(analytic_id, query):
+            return parse_analytic({'query': query, 'metadata': {'id': analytic_id}})
+
+        analytics = [
+            get_analytic('sequence', 'sequence by pid [process where process_name == "proc1.exe"] [file where true]'),
+            get_analytic('join', 'join by pid [file where file_name == "file3.txt"] [process where true]'),
+            get_analytic('descendant', 'file where descendant of [process where process_name == "proc2.exe"]'),
+            get_analytic('count', 'file where true | count file_name'),
+            get_analytic('any', 'any where true | unique event_type'),
+        ]
+
+        def get_results(engine, remaining):
+            output = []
+            engine.add_output_hook(output.append)
+            engine.stream_events(remaining)
+            results = defaultdict(list)
+            for result in output:
+                results[result.analytic_id].append([event.data for event in result.events])
+            return results
+
+        expected_engine = PythonEngine()
+        expected_engine.add_analytics(analytics)
+        expected_engine.stream_events(events[:53], finalize=False)
+        expected = get_results(expected_engine, events[53:])
+
+        engine = PythonEngine()
+        engine.add_analytics(analytics)
+        engine.stream_events(events[:53], finalize=False)
+
+        # A sequence, a descendant of and unique are all in progress
+        engine.remove_analytic('join')
+        engine.replace_analytic(analytics[0])
+        engine.replace_analytic(get_analytic('count', 'file where true | count pid'))
+        engine.replace_analytic(get_analytic('new', 'process where process_name == "proc3.exe" | head 1'))
+        self.assertRaises(KeyError, engine.remove_analytic, 'join')
+        results = get_results(engine, events[53:])
+
+        # Unchanged analytics keep their sequences, named subqueries and pipes
+        self.assertGreater(len(expected['sequence']), 0)
+        self.assertGreater(len(expected['descendant']), 0)
+        self.assertGreater(len(expected['join']), 0)
+        for analytic_id in ('sequence', 'descendant', 'any'):
+            self.assertEqual(results[analytic_id], expected[analytic_id])
+        self.assertNotIn('join', results)
+
+        changed = PythonEngine()
+        changed.add_analytic(get_analytic('count', 'file where true | count pid'))
+        changed.add_analytic(get_analytic('new', 'process where process_name == "proc3.exe" | head 1'))
+        changed_results = get_results(changed, events[53:])
+        self.assertEqual(results['count'], changed_results['count'])
+        self.assertEqual(results['new'], changed_results['new'])
+
+        # Nothing is left behind once every analytic is removed
+        for analytic_id in ('sequence', 'descendant', 'count', 'any', 'new'):
+            engine.remove_analytic(analytic_id)
+        self.assertEqual(engine._any_event_hooks, [])
+        self.assertEqual([hooks for hooks in engine._event_hooks.values() if hooks], [])
+        self.assertEqual((engine._query_pipes, engine._states), ([], {}))
+
+        # Reducers and post-processors are kept apart, and only the reducer is registered again for a new version
+        engine.add_analytic(analytics[3])
+        engine.add_reducer(analytics[3])
+        engine.add_post_processor(parse_query('generic where true | head 1'), analytic_id='count')
+        self.assertEqual(len(engine._reducer_hooks['count']), 2)
+        reducer, post_processor = engine._reducer_hooks['count']
+        engine.replace_analytic(analytics[3])
+        self.assertEqual(len(engine._reducer_hooks['count']), 2)
+        self.assertIs(engine._reducer_hooks['count'][0], post_processor)
+        self.assertIsNot(engine._reducer_hooks['count'][1], reducer)
+        self.assertIn('post/count', engine._owner_fingerprints)
+
+        engine.remove_analytic('count')
+        self.assertEqual((dict(engine._reducer_hooks), engine._states), ({}, {}))
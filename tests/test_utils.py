@@ -2,6 +2,7 @@
 import json
 import os
 import unittest
+from collections import OrderedDict, deque
 
 import eql.utils
 
@@ -41,3 +42,23 @@ class TestUtils(unittest.TestCase):
         jsonl = '\n'.join(json.dumps(item) for item in example)
         parsed = list(eql.utils.stream_json_lines(jsonl.splitlines()))
         self.assertEqual(parsed, example, "JSON lines didn't stream properly.")
+
+    def test_pack_unpack(self):
+        """Check that packed data round trips with types that JSON can't represent."""
+        data = OrderedDict([
+            (('key', 1), {'count': 3, 'hosts': set(['a', 'b'])}),
+            ('list', [1, 2.5, None, True, u'text']),
+            ('nested', {(1, 2): frozenset([3]), 'd': deque([4, 5])}),
+        ])
+        packed = eql.utils.pack(data)
+        self.assertIsInstance(packed, bytes)
+
+        unpacked = eql.utils.unpack(packed)
+        self.assertIsInstance(unpacked, OrderedDict)
+        self.assertEqual(list(unpacked.keys()), list(data.keys()))
+        self.assertEqual(unpacked[('key', 1)], data[('key', 1)])
+        self.assertEqual(unpacked['list'], data['list'])
+        self.assertEqual(unpacked['nested'], {(1, 2): set([3]), 'd': [4, 5]})
+
+        self.assertRaises(ValueError, eql.utils.unpack, b'not packed')
+        self.assertRaises(TypeError, eql.utils.pack, object())